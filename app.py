@@ -1,27 +1,32 @@
 #!/usr/bin/env python3
 
 from dotenv import load_dotenv
-
-load_dotenv()  # loaded here so imports will have access to the env variables
-import smtplib
 from email.message import EmailMessage
-import pandas as pd
 import base
+import collector
+import mailer
+import metrics
+import planner
+import sinks
+import sync
 import yaml
 import logging
-import google_spreadsheets
 import os
 from datetime import datetime
+from functools import partial
+
 
-logging.basicConfig(filename='report.log',
-                    level=logging.INFO,
-                    format="%(asctime)s; %(levelname)s: %(message)s",
-                    datefmt='%d/%m/%Y',
-                    )
+def create_mailer(email_config=None):
+    """creates the mailer delivering the run's emails through EMAIL_PROXY_SERVER, authenticated given EMAIL_USER."""
+    email_config = email_config or {}
+    # the localhost assumes you have an smtp server running on you machine
+    return mailer.Mailer(os.getenv("EMAIL_PROXY_SERVER", "localhost"), os.getenv("EMAIL_USER"),
+                         os.getenv("EMAIL_PASSWORD"), email_config.get('max_retries', mailer.DEFAULT_MAX_RETRIES),
+                         email_config.get('retry_delay', mailer.DEFAULT_RETRY_DELAY))
 
 
-def send_email(subject, body, recipients=None):
-    """send an email to the selected recipients with a given body context."""
+def send_email(subject, body, recipients=None, email_mailer=None):
+    """send an email to the selected recipients with a given body context, queued on the mailer if given."""
 
     # TODO: hack for now, validation should happen when program starts
     email_from = os.getenv("EMAIL_FROM")
@@ -35,43 +40,49 @@ def send_email(subject, body, recipients=None):
         msg['From'] = email_from
         msg['To'] = ", ".join(recipients)
         msg.set_content(body, subtype='html')
-        # the localhost assumes you have an smtp server running on you machine
-        with smtplib.SMTP(os.getenv("EMAIL_PROXY_SERVER", "localhost")) as server:
-            server.send_message(msg)
-            logging.info("mail sent successfully.")
+        if email_mailer:
+            email_mailer.send(msg)
+            logging.info("mail queued.")
+        else:
+            email_mailer = create_mailer()
+            email_mailer.send(msg)
+            email_mailer.close()
     else:
         logging.info("No recipients given, Mail not sent.")
 
 
-def publish(report, recipients=None, team=None):
-    """Outputs the report to Google sheets and publish it as a mail"""
-    title = f"Open Code Contributions - {team}"
-    if report.empty:
-        body = report.to_html(justify='left')
-        logging.info("Sending an empty report.")
-    else:
-        google_sheet = google_spreadsheets.create_and_share_spreadsheet(title, report)
-        body = f"<p>The report is also available on Google Sheets:<br> {google_sheet}</p> {report.to_html(justify='left')}"
-    send_email(title, body, recipients)
-
-
-def process(df_cc, servers):
-    """fills a DF with the CC from each of the selected servers."""
-    have_namespaces_or_users = False
+def select_active_servers(servers):
+    """returns the servers which have any valid namespace or user to pull CC from."""
+    active_servers = []
     try:
         for server in servers:
             if server.namespaces or server.users:
-                for cc in server.get_ccs():
-                    code_change = server.cc_to_dict(cc)
-                    df_cc = df_cc.append(code_change, ignore_index=True)
-                have_namespaces_or_users = True
+                active_servers.append(server)
             else:
                 logging.warning(f"No valid namespaces or users entered for the {server.name} server.")
     except TypeError as e:
         logging.warning(f"No servers or users entered: {e}.")
-    if not have_namespaces_or_users:
+    if not active_servers:
         logging.warning("No valid namespaces or users entered overall.")
-    return df_cc
+    return active_servers
+
+
+def pull_teams(plan, servers, workers=None, sync_store=None, use_asyncio=False):
+    """pulls the CC of the run plan's merged servers once, and yields each of the plan's teams along with its rows.
+
+    A team is yielded as soon as its servers are pulled (see planner.RunPlan.split_as_pulled()), while the next servers
+    are. With asyncio, the servers are async_base ones, all pulled concurrently within a single thread.
+    """
+    try:
+        if use_asyncio:
+            import async_base
+            sources = async_base.collect_sources(select_active_servers(servers), workers)
+        else:
+            sources = collector.collect_sources(select_active_servers(servers), workers, sync_store)
+        yield from plan.split_as_pulled(sources)
+    finally:
+        for server in servers:
+            server.close()
 
 
 def get_configuration():
@@ -90,32 +101,85 @@ def create_servers_from_dictionary(team):
     servers = []
     try:
         for server in team.get('servers'):
-            if server.get('vendor').casefold() == 'GitLab'.casefold():
-                servers.append(base.Gitlab(server.get('host'), server.get('namespaces'), server.get('users'),
-                                           server.get('repositories')))
-            elif server.get('vendor').casefold() == 'GitHub'.casefold():
-                servers.append(base.GitHub(server.get('host'), server.get('namespaces'), server.get('repositories')))
-            else:
-                servers.append(base.Gerrit(server.get('host'), server.get('bot_users'), server.get('repositories')))
+            with metrics.tagged(phase='connect', server=server.get('vendor'), host=server.get('host')):
+                servers.append(create_server(server))
     except (ValueError, TypeError) as e:
         logging.warning(f"No valid servers found: {e}.")
     return servers
 
 
+def create_server(server):
+    """creates a server object out of its configuration."""
+    if server.get('vendor').casefold() == 'GitLab'.casefold():
+        return base.Gitlab(server.get('host'), server.get('namespaces'), server.get('users'),
+                           server.get('repositories'), server.get('workers'),
+                           server.get('http_cache'), server.get('rate_limit'))
+    elif server.get('vendor').casefold() == 'GitHub'.casefold():
+        return base.GitHub(server.get('host'), server.get('namespaces'), server.get('repositories'),
+                           server.get('workers'), server.get('http_cache'), server.get('rate_limit'),
+                           server.get('base_branch'))
+    return base.Gerrit(server.get('host'), server.get('bot_users'), server.get('repositories'),
+                       server.get('workers'), server.get('query_limit'),
+                       server.get('query_options'), server.get('projects_per_query'))
+
+
 def main():
-    pd.set_option('display.max_colwidth', -1)
-    pd.set_option('display.max_columns', 10)
-    for team in get_configuration().get('teams'):
-        # produce a separate report for each team (recipient)
-
-        logging.info(f'Producing report: {team.get("name")}')
-        df_cc = pd.DataFrame(
-            columns=['project', 'last updated', 'contributor', 'state', 'title', 'web_url']
-        )
-        server_list = create_servers_from_dictionary(team)
-        df_cc = process(df_cc, server_list)
-        df_cc.index += 1
-        publish(df_cc, team.get('recipients'), team.get("name"))
+    # importing this module has no side effects, nor loads the heavy dependencies (the Google API, PyGithub, Django...)
+    # which are only imported once needed; see benchmarks/startup.py
+    load_dotenv()
+    logging.basicConfig(filename='report.log',
+                        level=logging.INFO,
+                        format="%(asctime)s; %(levelname)s: %(message)s",
+                        datefmt='%d/%m/%Y %H:%M:%S',
+                        )
+    config = get_configuration()
+    metrics.run_metrics = metrics.RunMetrics(**(config.get('metrics') or {}))
+    try:
+        run(config)
+    finally:
+        # a failed run's metrics tell where it failed
+        metrics.run_metrics.export()
+
+
+def run(config):
+    """pulls the CC of all the teams' servers, and publishes each team's report to the configured sinks."""
+    base.metadata_cache = base.MetadataCache(**(config.get('metadata_cache') or {}))
+    sync_config = config.get('incremental_sync') or {}
+    sync_store = sync.SyncStore(**sync_config) if sync_config.get('path') else None
+    # teams sharing servers get them pulled once, the CC are then split into a separate report per team (recipient)
+    plan = planner.RunPlan(config.get('teams'))
+    database_config = config.get('database') or {}
+    if database_config.get('settings'):
+        import django_store  # Django is only required for storing the CC
+        store = django_store.DjangoStore(database_config['settings'])
+    else:
+        store = None
+    report_config = config.get('report') or {}
+    # the emails are sent in the background while the next reports are published, over a single SMTP session
+    run_mailer = create_mailer(report_config.get('email'))
+    report_sinks = sinks.create_sinks(report_config, partial(send_email, email_mailer=run_mailer), store, plan)
+    if config.get('asyncio'):
+        import async_base  # aiohttp is only required by the asyncio collection
+        if sync_store:
+            logging.warning("Incremental sync isn't supported by the asyncio collection, pulling all the CC.")
+        server_list = plan.create_servers(async_base.create_servers_from_dictionary)
+        team_rows = pull_teams(plan, server_list, config.get('workers'), use_asyncio=True)
+    else:
+        server_list = plan.create_servers(create_servers_from_dictionary)
+        team_rows = pull_teams(plan, server_list, config.get('workers'), sync_store)
+    try:
+        # each team is published (and its emails sent) as soon as its servers are pulled, while the next ones are
+        for team, rows in team_rows:
+            requests_used = plan.requests_used(team)
+            logging.info(f'Producing report: {team.get("name")} ({requests_used} rate limited API requests)')
+            metrics.run_metrics.record_team(team.get('name'), rows=len(rows), requests=requests_used)
+            with metrics.tagged(team=team.get('name')):
+                sinks.publish(team, rows, report_sinks)
+    finally:
+        team_rows.close()
+        run_mailer.close()
+    base.metadata_cache.log_stats()
+    base.metadata_cache.save()
 
 
 if __name__ == '__main__':
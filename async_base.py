@@ -0,0 +1,411 @@
+"""asyncio counterparts of the servers in base.py.
+
+GitLab and GitHub are pulled over a pooled aiohttp client and Gerrit over async SSH subprocesses,
+each server bounding the number of its requests in flight, so hundreds of them fit in a single thread.
+aiohttp is only imported by this module, which is only used when the 'asyncio' collection is configured.
+"""
+import asyncio
+import logging
+import os
+from abc import ABCMeta, abstractmethod
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import aiohttp
+
+import base
+import metrics
+from base import json_loads
+
+DEFAULT_HOST_CONCURRENCY = 20
+GERRIT_HOST_CONCURRENCY = 8  # stays below sshd's default MaxSessions for the multiplexed connection
+
+
+class AsyncServer(metaclass=ABCMeta):
+    """Abstract class for the different git servers, pulled with asyncio.
+
+    The servers are configured on creation, but only connect and resolve their namespaces once open()ed
+    within the event loop running the collection.
+    """
+
+    def __init__(self, name, host, concurrency=None):
+        self.name = name
+        self.host = host
+        self.concurrency = concurrency or DEFAULT_HOST_CONCURRENCY
+        self.namespaces = {}
+        self.users = {}
+        self.session = None
+        self.phase = 'connect'
+        self._limiter = None
+
+    async def open(self):
+        """Opens the server's connection pool, within the running event loop, and resolves its namespaces."""
+        self._limiter = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(headers=self._headers(), connector=self._connector())
+        await self._set_namespaces()
+        self.phase = 'list'
+
+    def _timed(self, description, phase=None):
+        # coroutines share the thread, so the calls are tagged explicitly instead of by metrics.tagged()
+        return metrics.run_metrics.timed(description, phase=phase or self.phase, server=self.name, host=self.host)
+
+    async def aclose(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    def close(self):
+        """Nothing is left open by then, the collection closes the servers within its event loop."""
+        pass
+
+    def _headers(self):
+        return {}
+
+    def _connector(self):
+        return aiohttp.TCPConnector(limit_per_host=self.concurrency)
+
+    async def _request(self, method, url, phase=None, **kwargs):
+        """Returns the JSON body and the next page's URL of a request, waiting for a free slot of the host."""
+        async with self._limiter:
+            with self._timed(f'{method} {urlparse(url).path}', phase):
+                async with self.session.request(method, url, **kwargs) as response:
+                    response.raise_for_status()
+                    next_page = response.links.get('next', {}).get('url')
+                    return await response.json(loads=json_loads, content_type=None), next_page and str(next_page)
+
+    async def _pages(self, url, **params):
+        """Yields the items of all the pages of a listing."""
+        while url:
+            items, url = await self._request('GET', url, params=params)
+            params = None  # the next page's URL already holds them
+            for item in items:
+                yield item
+
+    @abstractmethod
+    async def _set_namespaces(self):
+        """Resolves the requested server's namespaces, dropping the ones which aren't found."""
+        pass
+
+    @abstractmethod
+    async def get_sources(self):
+        """Returns the independent units (projects, repos...) the server's CC are pulled from."""
+        pass
+
+    @abstractmethod
+    def get_source_ccs(self, source):
+        """An async generator of the CC of a single source returned by get_sources()."""
+        pass
+
+    @abstractmethod
+    async def cc_to_dict(self, cc):
+        """Converts a CC, as pulled by get_source_ccs(), into its base.CodeContribution row"""
+        pass
+
+    def source_namespace(self, source):
+        """Returns the configured namespace (org, group or user) the source belongs to, if any."""
+        return None
+
+    def source_scope(self, source):
+        """Returns what tells the source's CC apart once stored, as base.Server.source_scope()."""
+        return None
+
+
+class AsyncGitlab(AsyncServer):
+    def __init__(self, host, namespaces, users, repos, concurrency=None):
+        super().__init__('GitLab', host, concurrency)
+        self.api_url = host.rstrip('/') + '/api/v4'
+        self.namespaces = dict.fromkeys(namespaces or [])
+        self.users = dict.fromkeys(users or [])
+        self.repos = repos
+
+    def _headers(self):
+        return {'PRIVATE-TOKEN': os.getenv("GITLAB_TOKEN") or ''}
+
+    def _connector(self):
+        # as the synchronous client, doesn't verify the server's certificate
+        return aiohttp.TCPConnector(limit_per_host=self.concurrency, ssl=False)
+
+    async def _set_namespaces(self):
+        for group_id in list(self.namespaces):
+            try:
+                self.namespaces[group_id], _ = await self._request('GET', f'{self.api_url}/groups/{group_id}',
+                                                                   params={'with_projects': 'false'})
+            except aiohttp.ClientResponseError:
+                logging.warning(f"GitLab group '{group_id}' not found.")
+                del self.namespaces[group_id]
+        for username in list(self.users):
+            users, _ = await self._request('GET', f'{self.api_url}/users', params={'username': username})
+            if users:
+                self.users[username] = users[0]
+            else:
+                logging.warning(f"GitLab user '{username}' not found.")
+                del self.users[username]
+
+    async def get_sources(self):
+        return [('group', group_id) for group_id in self.namespaces] + [('user', username) for username in self.users]
+
+    def source_namespace(self, source):
+        return source[1]
+
+    def source_scope(self, source):
+        kind, key = source
+        path = self.namespaces[key]['full_path'] if kind == 'group' else self.users[key]['username']
+        return 'url', f"{self.host.rstrip('/')}/{path}/"
+
+    async def get_source_ccs(self, source, state='opened', order='updated_at'):
+        kind, key = source
+        namespace = self.namespaces[key] if kind == 'group' else self.users[key]
+        base_url = f"{self.api_url}/{'groups' if kind == 'group' else 'users'}/{namespace['id']}"
+        projects = {}
+        async for project in self._pages(f'{base_url}/projects', per_page=100):
+            if project['name'] in self.repos or self.repos == ['*']:
+                projects[project['id']] = project['name']
+                base.metadata_cache.put('project', self.host, project['id'], project['name'])
+        filters = {'state': state, 'order_by': order, 'per_page': 100}
+        if kind == 'group':
+            async for mr in self._pages(f'{base_url}/merge_requests', **filters):
+                if mr['project_id'] in projects:
+                    yield mr
+        else:
+            for project_id in projects:
+                async for mr in self._pages(f'{self.api_url}/projects/{project_id}/merge_requests', **filters):
+                    yield mr
+
+    async def _project_name(self, project_id):
+        name = base.metadata_cache.lookup('project', self.host, project_id)
+        if name is None:
+            project, _ = await self._request('GET', f'{self.api_url}/projects/{project_id}', phase='enrich')
+            name = project['name']
+            base.metadata_cache.put('project', self.host, project_id, name)
+        return name
+
+    async def cc_to_dict(self, mr):
+        return base.CodeContribution(
+            project=await self._project_name(mr['project_id']),
+            last_updated=datetime.strptime(mr['updated_at'], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc),
+            contributor=mr['author']['name'],
+            state='open' if mr['state'] == 'opened' else mr['state'],
+            title=mr['title'],
+            web_url=mr['web_url'],
+            vendor=self.name,
+        )
+
+
+class AsyncGitHub(AsyncServer):
+    def __init__(self, host, namespaces, repos, concurrency=None, base_branch=None):
+        super().__init__('GitHub', host, concurrency)
+        self.api_url, self.graphql_url = base.github_api_urls(host)
+        self.base_branch = base_branch
+        self.namespaces = dict.fromkeys(namespaces or [])
+        self.repos = repos
+
+    def _headers(self):
+        return {'Authorization': f'bearer {os.getenv("GITHUB_TOKEN")}'}
+
+    async def _set_namespaces(self):
+        for org_name in list(self.namespaces):
+            try:
+                self.namespaces[org_name], _ = await self._request('GET', f'{self.api_url}/orgs/{org_name}')
+            except aiohttp.ClientResponseError:
+                logging.warning(f"Github org '{org_name}' not found.")
+                del self.namespaces[org_name]
+
+    async def get_sources(self):
+        if self.repos == ['*']:
+            return [('org', org_name) for org_name in self.namespaces]
+        return [('repo', f'{org_name}/{repo_name}') for repo_name in self.repos or [] for org_name in self.namespaces]
+
+    def source_namespace(self, source):
+        kind, name = source
+        return name.split('/')[0]
+
+    def source_scope(self, source):
+        kind, name = source
+        return 'url', f'{base.github_web_url(self.host)}/{name}/'
+
+    async def get_source_ccs(self, source, state='open'):
+        kind, name = source
+        if kind == 'repo':
+            filters = {'base': self.base_branch} if self.base_branch else {}
+            try:
+                async for pr in self._pages(f'{self.api_url}/repos/{name}/pulls', state=state, sort='updated',
+                                            direction='desc', per_page=100, **filters):
+                    yield pr
+            except aiohttp.ClientResponseError as e:
+                if e.status != 404:
+                    raise
+            return
+        cursor = None
+        query = f'org:{name} is:pr is:{state} sort:updated-desc'
+        if self.base_branch:
+            query += f' base:{self.base_branch}'
+        while True:
+            payload, _ = await self._request('POST', self.graphql_url, json={
+                'query': base.PULL_REQUESTS_SEARCH_QUERY,
+                'variables': {'query': query, 'cursor': cursor},
+            })
+            if payload.get('errors'):
+                raise base.GraphQLError(payload['errors'])
+            search = payload['data']['search']
+            if cursor is None and search['issueCount'] > base.GITHUB_SEARCH_LIMIT:
+                logging.warning(f"GitHub search '{query}' matched {search['issueCount']} PRs, "
+                                f"listing the PRs of the '{name}' org repo by repo instead.")
+                async for repo in self._pages(f'{self.api_url}/orgs/{name}/repos', per_page=100):
+                    async for pr in self.get_source_ccs(('repo', repo['full_name']), state):
+                        yield pr
+                return
+            for node in search['nodes']:
+                if node:
+                    yield node
+            if not search['pageInfo']['hasNextPage']:
+                return
+            cursor = search['pageInfo']['endCursor']
+
+    async def _user_name(self, login):
+        name = base.metadata_cache.lookup('user', self.host, login)
+        if name is None:
+            user, _ = await self._request('GET', f'{self.api_url}/users/{login}', phase='enrich')
+            name = user.get('name') or login
+            base.metadata_cache.put('user', self.host, login, name)
+        return name
+
+    async def cc_to_dict(self, pr):
+        if 'updatedAt' in pr:  # a PR node of the org-wide GraphQL search
+            author = pr.get('author') or {}
+            contributor = author.get('name') or author.get('login')
+            updated_at, project, url = pr['updatedAt'], pr['repository']['name'], pr['url']
+        else:
+            contributor = await self._user_name(pr['user']['login'])
+            updated_at, project, url = pr['updated_at'], pr['base']['repo']['name'], pr['html_url']
+        return base.CodeContribution(
+            project=project,
+            last_updated=datetime.strptime(updated_at, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc),
+            contributor=contributor,
+            state=pr['state'].lower(),
+            title=pr['title'],
+            web_url=url,
+            vendor=self.name,
+        )
+
+
+class AsyncGerrit(AsyncServer):
+    """Runs the 'gerrit query' SSH commands of a base.Gerrit server as async subprocesses."""
+
+    def __init__(self, gerrit, concurrency=None):
+        super().__init__('Gerrit', gerrit.host, concurrency or GERRIT_HOST_CONCURRENCY)
+        self.gerrit = gerrit
+        self.namespaces = gerrit.namespaces
+
+    async def open(self):
+        self._limiter = asyncio.Semaphore(self.concurrency)
+
+    def close(self):
+        self.gerrit.close()
+
+    async def _set_namespaces(self):
+        pass
+
+    async def get_sources(self):
+        return self.gerrit.get_sources()
+
+    def source_scope(self, projects):
+        return self.gerrit.source_scope(projects)
+
+    async def get_source_ccs(self, projects, status='open'):
+        if not os.getenv("GERRIT_IDENTITY_FILE"):
+            logging.warning(
+                'No identity file found for Gerrit. Please set "GERRIT_IDENTITY_FILE to be the path to the identity file')
+            return
+        skip = 0
+        while True:
+            stats = {}
+            command = self.gerrit.query_command(projects, skip, status)
+            async with self._limiter:
+                with self._timed(f'gerrit query --start {skip}', 'list'):
+                    # a patch with all its fields can get longer than the default line limit of 64KB
+                    query = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                                 limit=2 ** 24)
+                    patches = []
+                    async for line in query.stdout:
+                        patch = json_loads(line)
+                        if patch.get('type') == 'stats':
+                            stats = patch
+                        elif not self.gerrit.is_bot_patch(patch):
+                            patches.append(patch)
+                    if await query.wait():
+                        raise RuntimeError(f"'{' '.join(command)}' failed with exit code {query.returncode}.")
+            for patch in patches:
+                yield patch
+            results_cnt = stats.get('rowCount', 0)
+            if not stats.get('moreChanges', results_cnt >= self.gerrit.query_limit):
+                break
+            skip += results_cnt
+
+    async def cc_to_dict(self, patch):
+        return self.gerrit.cc_to_dict(patch)
+
+
+async def _pull_sources(servers, workers):
+    """Yields the (server, source, rows) of the servers, pulling all the sources concurrently, in sequential order."""
+    limiter = asyncio.Semaphore(workers)
+
+    async def pull(server, source):
+        async with limiter:
+            return [await server.cc_to_dict(cc) async for cc in server.get_source_ccs(source)]
+
+    await asyncio.gather(*(server.open() for server in servers))
+    server_sources = await asyncio.gather(*(server.get_sources() for server in servers))
+    pulled = [(server, source, asyncio.ensure_future(pull(server, source)))
+              for server, sources in zip(servers, server_sources) for source in sources]
+    try:
+        for server, source, rows in pulled:
+            yield server, source, await rows
+    finally:
+        for _, _, rows in pulled:
+            rows.cancel()
+        await asyncio.gather(*(rows for _, _, rows in pulled), return_exceptions=True)
+
+
+async def _close(servers):
+    await asyncio.gather(*(server.aclose() for server in servers))
+
+
+def collect_sources(servers, workers=None):
+    """Yields the (server, source, rows) of the given async servers, streaming them out of an event loop."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)  # subprocesses are watched through the current loop
+    # the sources' slots are awaited rather than held by threads, so many more of them can be in flight
+    pulled = _pull_sources(servers, workers or 100)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(pulled.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(pulled.aclose())
+        loop.run_until_complete(_close(servers))
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def create_servers_from_dictionary(team):
+    """reads a dictionary of servers configurations and creates a list of async server objects per server in it."""
+    servers = []
+    try:
+        for server in team.get('servers'):
+            if server.get('vendor').casefold() == 'GitLab'.casefold():
+                servers.append(AsyncGitlab(server.get('host'), server.get('namespaces'), server.get('users'),
+                                           server.get('repositories'), server.get('workers')))
+            elif server.get('vendor').casefold() == 'GitHub'.casefold():
+                servers.append(AsyncGitHub(server.get('host'), server.get('namespaces'), server.get('repositories'),
+                                           server.get('workers'), server.get('base_branch')))
+            else:
+                servers.append(AsyncGerrit(base.Gerrit(server.get('host'), server.get('bot_users'),
+                                                       server.get('repositories'), None, server.get('query_limit'),
+                                                       server.get('query_options'),
+                                                       server.get('projects_per_query')),
+                                           server.get('workers')))
+    except (ValueError, TypeError) as e:
+        logging.warning(f"No valid servers found: {e}.")
+    return servers
@@ -1,22 +1,159 @@
 from abc import ABCMeta, abstractmethod
-from github import Github
-import gitlab
-import github
+import logging
+import requests
 import os
+import http_cache
+import metrics
+import ratelimit
 import ssl
 import json
-from subprocess import check_output
-from datetime import datetime
+import shutil
+import sys
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+from subprocess import DEVNULL, PIPE, CalledProcessError, Popen, call
+from datetime import datetime, timezone
 from time import time
-from app import logging
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+
+_MISSING = object()
+
+
+class MetadataCache:
+    """A bounded LRU cache of metadata shared by the servers, such as project names and user display names.
+
+    Entries are keyed by (kind, host, id). When a path is given, the entries younger than 'ttl' seconds
+    are loaded from it on creation and written back by save(), so the next run starts warm.
+    """
+
+    def __init__(self, size=10000, path=None, ttl=86400):
+        self.size = size
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    def lookup(self, kind, host, key, default=None):
+        """Returns the cached value, or the default on a miss (or an expired entry)."""
+        entry_key = (kind, host, str(key))
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry and time() - entry[1] < self.ttl:
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return default
+
+    def get(self, kind, host, key, loader):
+        """Returns the cached value, or calls the loader and caches its result on a miss (or an expired entry)."""
+        value = self.lookup(kind, host, key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.put(kind, host, key, value)
+        return value
+
+    def put(self, kind, host, key, value, stored_at=None):
+        with self._lock:
+            entry_key = (kind, host, str(key))
+            self._entries[entry_key] = (value, stored_at or time())
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as cache_file:
+                entries = json.load(cache_file)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logging.warning(f"Metadata cache '{self.path}' is corrupted, starting cold: {e}.")
+            return
+        for kind, host, key, value, stored_at in entries:
+            if time() - stored_at < self.ttl:
+                self.put(kind, host, key, value, stored_at)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = [[*entry_key, value, stored_at] for entry_key, (value, stored_at) in self._entries.items()]
+        with open(self.path, 'w') as cache_file:
+            json.dump(entries, cache_file, separators=(',', ':'))
+
+    def log_stats(self):
+        logging.info(f"Metadata cache: {self.hits} hits, {self.misses} misses, {len(self._entries)} entries.")
+
+
+metadata_cache = MetadataCache()
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class CodeContribution(namedtuple('CodeContribution', 'project last_updated contributor state title web_url vendor')):
+    """A collected CC, the report row all the servers build straight out of the JSON they pulled.
+
+    It's an immutable tuple without a __dict__, so the rows of a large run stay compact, and the names shared by
+    many CC (projects, contributors...) are interned. It's also read like the dicts it replaced, by report column
+    (row['last updated'], row.get('web_url')...).
+    """
+    __slots__ = ()
+
+    COLUMNS = ('project', 'last updated', 'contributor', 'state', 'title', 'web_url', 'vendor')
+    _positions = {column: position for position, column in enumerate(COLUMNS)}
+
+    def __new__(cls, project, last_updated, contributor, state, title, web_url, vendor):
+        return super().__new__(cls, _intern(project), last_updated, _intern(contributor), _intern(state), title,
+                               web_url, _intern(vendor))
+
+    @classmethod
+    def from_row(cls, row, **fields):
+        """Creates the CC out of a row of report columns (e.g a stored one), given or overriding some fields."""
+        values = {column.replace(' ', '_'): row.get(column) for column in cls.COLUMNS}
+        values.update(fields)
+        return cls(**values)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._positions[key]
+            except KeyError:
+                raise KeyError(key) from None
+        return super().__getitem__(key)
+
+    def get(self, column, default=None):
+        position = self._positions.get(column)
+        return default if position is None else super().__getitem__(position)
+
+    def keys(self):
+        return self.COLUMNS
+
+    def items(self):
+        return zip(self.COLUMNS, self)
 
 
 class Server(metaclass=ABCMeta):
     """Abstract class for the different git servers."""
 
-    def __init__(self, name, host):
+    def __init__(self, name, host, workers=None):
         self.name = name
         self.host = host
+        self.workers = workers
+        self.http_cache = None
+        self.scheduler = None
         self.namespaces = {}
         self.users = {}
 
@@ -31,15 +168,79 @@ class Server(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def get_ccs(self):
-        """Pulls and yield CC from the requested server's namespaces."""
+    def get_sources(self):
+        """Returns the independent units (projects, repos...) the server's CC are pulled from."""
         pass
 
+    @abstractmethod
+    def get_source_ccs(self, source, updated_after=None, **filters):
+        """Pulls and yield CC from a single source returned by get_sources().
+
+        When updated_after (an epoch timestamp) is given, only the CC updated since are pulled, whatever their state,
+        so that closed and merged CC can be told apart from the ones which weren't updated.
+        The CC are yielded as the JSON the server returned, which cc_to_dict() only keeps the needed fields of.
+        """
+        pass
+
+    def source_key(self, source):
+        """Returns a string identifying the source across runs."""
+        return str(source)
+
+    def source_namespace(self, source):
+        """Returns the configured namespace (org, group or user) the source belongs to, if any."""
+        return None
+
+    def source_scope(self, source):
+        """Returns what tells the source's CC apart once stored: ('url', their web URLs' prefix) or ('projects', names).
+
+        None when they can't be told apart, so that they are never taken for CC which got closed since.
+        """
+        return None
+
+    def get_ccs(self, **filters):
+        """Pulls and yield CC from the requested server's namespaces."""
+        for source in self.get_sources():
+            yield from self.get_source_ccs(source, **filters)
+
     @abstractmethod
     def cc_to_dict(self, cc):
-        """Converts a CC to a specific dictionary structure"""
+        """Converts a CC, as pulled by get_source_ccs(), into its CodeContribution row"""
         pass
 
+    @abstractmethod
+    def cc_updated_at(self, cc):
+        """Returns the epoch (Unix time) timestamp of the CC's last update."""
+        pass
+
+    def close(self):
+        """Releases the connection to the server, in case one is kept open."""
+        if self.http_cache:
+            self.http_cache.log_stats(f'{self.name} ({self.host})')
+        if self.scheduler:
+            self.scheduler.log_stats(f'{self.name} ({self.host})')
+
+    def _mount_adapter(self, session, cache_config=None, rate_limit=None):
+        """Mounts the transport adapter pacing the session's requests by the rate limit, and caching them if asked to.
+
+        Returns the adapter, so it can be mounted on other sessions of the same server.
+        """
+
+        self.scheduler = ratelimit.RateLimitScheduler(self.host, **(rate_limit or {}))
+        if cache_config and cache_config.get('path'):
+            self.http_cache = http_cache.mount_cache(session, scheduler=self.scheduler, **cache_config)
+            return self.http_cache
+        return ratelimit.mount_scheduler(session, self.scheduler)
+
+    @staticmethod
+    def convert_timestamp_to_iso(time_var):
+        """Converts an epoch (Unix time) timestamp to an ISO 8601 UTC string"""
+        return datetime.fromtimestamp(time_var, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    @staticmethod
+    def convert_timestamp_to_datetime(time_var):
+        """Converts an epoch (Unix time) timestamp to a UTC datetime, as carried by the report rows"""
+        return datetime.fromtimestamp(time_var, timezone.utc)
+
     @staticmethod
     def convert_timestamp_to_time_passed(time_var):
         """Converts an epoch (Unix time) timestamp to a 'X hours/days ago' string"""
@@ -52,19 +253,25 @@ class Server(metaclass=ABCMeta):
 
 
 class Gitlab(Server):
-    def __init__(self, host, namespaces, users, repos):
-        super().__init__('GitLab', host)
-        self.gl = self._connect()
+    def __init__(self, host, namespaces, users, repos, workers=None, cache_config=None, rate_limit=None):
+        super().__init__('GitLab', host, workers)
+        self.per_page = 100
+        self.gl = self._connect(cache_config, rate_limit)
         self._set_namespaces(namespaces)
         self._set_personal_users(users)
         self.repos = repos
 
-    def _connect(self):
+    def _connect(self, cache_config=None, rate_limit=None):
+        import gitlab  # python-gitlab is only imported once a GitLab server is configured
+
+        session = requests.Session()
+        self._mount_adapter(session, cache_config, rate_limit)
         try:
             gl = gitlab.Gitlab(
                 self.host,
                 private_token=os.getenv("GITLAB_TOKEN"),
-                ssl_verify=False
+                ssl_verify=False,
+                session=session,
             )
             return gl
         except gitlab.exceptions.GitlabAuthenticationError:
@@ -75,6 +282,8 @@ class Gitlab(Server):
         In case the namespace code is not found within GitLab, an alert will be outputted.
         """
 
+        import gitlab
+
         if groups:
             for group_id in groups:
                 try:
@@ -94,43 +303,152 @@ class Gitlab(Server):
                 except IndexError:
                     logging.warning(f"GitLab user '{username}' not found.")
 
-    def get_ccs(self, state='opened', order='updated_at'):
-        for group in self.namespaces:
-            for project in self.gl.groups.get(group).projects.list(all=True):
-                if project.attributes['name'] in self.repos or self.repos == ['*']:
-                    for mr in self.gl.projects.get(project.id).mergerequests.list(state=state, order_by=order):
-                        yield mr
-        for user in self.users.values():
-            for project in user.projects.list():
-                if project.attributes['name'] in self.repos or self.repos == ['*']:
-                    for mr in self.gl.projects.get(project.id).mergerequests.list(state=state, order_by=order):
-                        yield mr
+    def get_sources(self):
+        """Returns the requested groups, followed by the requested users."""
+        return [('group', group) for group in self.namespaces.values()] + \
+               [('user', user) for user in self.users.values()]
+
+    def _select_projects(self, projects):
+        """Returns the IDs and names of the given projects which are part of the requested repositories."""
+        return {project['id']: project['name'] for project in projects
+                if project['name'] in self.repos or self.repos == ['*']}
+
+    def source_key(self, source):
+        kind, namespace = source
+        return f'{kind}:{namespace.id}'
+
+    def source_namespace(self, source):
+        kind, namespace = source
+        configured = self.namespaces if kind == 'group' else self.users
+        return next(key for key, value in configured.items() if value is namespace)
+
+    def source_scope(self, source):
+        kind, namespace = source
+        path = namespace.full_path if kind == 'group' else namespace.username
+        return 'url', f"{self.host.rstrip('/')}/{path}/"
+
+    def get_source_ccs(self, source, state='opened', order='updated_at', updated_after=None):
+        """Pulls and yield the MRs of a group or of a user's personal projects.
+
+        A group's MRs are listed by a single paginated query, which also covers its subgroups,
+        so they are filtered to the selected projects of the group itself.
+        """
+
+        kind, namespace = source
+        filters = {'state': state, 'order_by': order, 'per_page': self.per_page}
+        if updated_after:
+            filters.update(state='all', updated_after=self.convert_timestamp_to_iso(updated_after))
+        # the listings are paged through as raw JSON, sparing python-gitlab's objects (and their managers) per item
+        path = f"/{'groups' if kind == 'group' else 'users'}/{namespace.id}"
+        projects = self._select_projects(self.gl.http_list(f'{path}/projects', {'per_page': self.per_page},
+                                                           as_list=False))
+        for project_id, name in projects.items():
+            metadata_cache.put('project', self.host, project_id, name)
+        if kind == 'group':
+            for mr in self.gl.http_list(f'{path}/merge_requests', filters, as_list=False):
+                if mr['project_id'] in projects:
+                    yield mr
+        else:
+            # there is no per-user MR listing, each project's MRs are listed instead
+            for project_id in projects:
+                yield from self.gl.http_list(f'/projects/{project_id}/merge_requests', filters, as_list=False)
+
+    def get_project_name(self, project_id):
+        return metadata_cache.get('project', self.host, project_id, lambda: self._load_project_name(project_id))
+
+    def _load_project_name(self, project_id):
+        with metrics.tagged(phase='enrich'):
+            return self.gl.http_get(f'/projects/{project_id}')['name']
+
+    def cc_updated_at(self, mr):
+        return datetime.strptime(mr['updated_at'], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc).timestamp()
 
     def cc_to_dict(self, mr):
-        project = self.gl.projects.get(mr.attributes['project_id'])
-        return {
-            'project': project.attributes['name'],
-            'last updated': self.convert_timestamp_to_time_passed(
-                datetime.strptime(mr.attributes['updated_at'], "%Y-%m-%dT%H:%M:%S.%fZ").timestamp()),
-            'contributor': mr.attributes['author']['name'],
-            'state': 'open' if mr.attributes['state'] == 'opened' else mr.attributes['state'],
-            'title': mr.attributes['title'],
-            'web_url': mr.attributes['web_url'],
-        }
+        return CodeContribution(
+            project=self.get_project_name(mr['project_id']),
+            last_updated=self.convert_timestamp_to_datetime(self.cc_updated_at(mr)),
+            contributor=mr['author']['name'],
+            state='open' if mr['state'] == 'opened' else mr['state'],
+            title=mr['title'],
+            web_url=mr['web_url'],
+            vendor=self.name,
+        )
+
+
+GITHUB_API_URL = 'https://api.github.com'
+GITHUB_WEB_URL = 'https://github.com'
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+GITHUB_SEARCH_LIMIT = 1000  # GitHub's search won't return more results than that for a single query
+PULL_REQUESTS_SEARCH_QUERY = """
+query($query: String!, $cursor: String) {
+  search(query: $query, type: ISSUE, first: 100, after: $cursor) {
+    issueCount
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      ... on PullRequest {
+        title url state updatedAt
+        repository { name }
+        author { login ... on User { name } }
+      }
+    }
+  }
+}
+"""
+
+
+def _is_github_com(host):
+    return not host or host.split('://')[-1].strip('/') in ('github.com', 'api.github.com')
+
+
+def github_api_urls(host):
+    """Returns the REST and GraphQL API URLs of a GitHub host, either github.com or a GitHub Enterprise server."""
+    if _is_github_com(host):
+        return GITHUB_API_URL, GITHUB_GRAPHQL_URL
+    url = github_web_url(host)
+    return f'{url}/api/v3', f'{url}/api/graphql'
+
+
+def github_web_url(host):
+    """Returns the web URL of a GitHub host, which the URLs of its PRs start with."""
+    if _is_github_com(host):
+        return GITHUB_WEB_URL
+    return (host if '://' in host else f'https://{host}').rstrip('/')
+
+
+class SearchLimitExceeded(Exception):
+    """Raised when a search matches more results than the server is willing to return."""
+
+
+class GraphQLError(Exception):
+    """Raised when a GraphQL query fails, as its errors come along a successful (200) response."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(error.get('message', str(error)) for error in errors))
+        self.errors = errors
 
 
 class GitHub(Server):
-    def __init__(self, host, namespaces, repos):
-        super().__init__('GitHub', host)
+    def __init__(self, host, namespaces, repos, workers=None, cache_config=None, rate_limit=None, base_branch=None):
+        super().__init__('GitHub', host, workers)
+        self.api_url, self.graphql_url = github_api_urls(host)
+        # the PRs of every branch are pulled unless a base branch is configured
+        self.base_branch = base_branch
         self.gh = self._connect()
         if self.gh:
+            self.api = requests.Session()
+            self.api.headers['Authorization'] = f'bearer {os.getenv("GITHUB_TOKEN")}'
+            self._mount_github_adapter(cache_config, rate_limit)
             self._set_namespaces(namespaces)
             self.repos = repos
 
     def _connect(self):
-        gh = Github(os.getenv("GITHUB_TOKEN"))
+        import github  # PyGithub is only imported once a GitHub server is configured
+
+        gh = github.Github(os.getenv("GITHUB_TOKEN"), base_url=self.api_url)
         try:
-            gh.get_user().login
+            # PyGithub's session only exists once connected, so the adapter recording the requests isn't mounted yet
+            with metrics.run_metrics.timed('GET /user'):
+                gh.get_user().login
         except github.GithubException as e:
             logging.warning(f'No valid GitHub token entered, authentication failed: {e}.')
             return
@@ -139,11 +457,27 @@ class GitHub(Server):
             return
         return gh
 
+    def _mount_github_adapter(self, cache_config, rate_limit):
+        """Mounts the rate limited (and maybe caching) adapter on the PyGithub client and on the GraphQL session.
+
+        PyGithub doesn't take a session, but keeps a single one per client once connected, in its private requester.
+        """
+
+        adapter = self._mount_adapter(self.api, cache_config, rate_limit)
+        connection = getattr(self.gh._Github__requester, '_Requester__connection', None)
+        if connection is not None and hasattr(connection, 'session'):
+            connection.session.mount('https://', adapter)
+            connection.session.mount('http://', adapter)
+        else:
+            logging.warning("Could not reach PyGithub's session, only GraphQL requests will be rate limited.")
+
     def _set_namespaces(self, namespaces):
         """Search and set the requested Github namespaces (orgs) to work with.
         In case the namespace name is not found within Github, an alert will be outputted.
         """
 
+        import github
+
         if namespaces:
             for org_name in namespaces:
                 try:
@@ -151,34 +485,181 @@ class GitHub(Server):
                 except github.UnknownObjectException:
                     logging.warning(f"Github org '{org_name}' not found.")
 
-    def get_ccs(self, state='open', sort='updated_at', base='master'):
-        for org in self.namespaces:
-            for repo in self.namespaces[org].get_repos():
-                if repo.name in self.repos or self.repos == ['*']:
-                    for pr in repo.get_pulls(state, sort, base):
-                        yield pr
+    def get_sources(self):
+        """Returns the requested orgs when all their repositories are selected, otherwise the selected repositories.
+
+        Listed repositories are fetched directly by their full name instead of paging through the whole org.
+        """
+        import github
+
+        if self.repos == ['*']:
+            return [('org', org_name) for org_name in self.namespaces]
+        sources = []
+        for repo_name in self.repos or []:
+            found = False
+            for org_name in self.namespaces:
+                try:
+                    sources.append(('repo', self.gh.get_repo(f'{org_name}/{repo_name}')))
+                    found = True
+                except github.UnknownObjectException:
+                    continue
+            if not found:
+                logging.warning(f"GitHub repository '{repo_name}' not found in the requested orgs.")
+        return sources
+
+    def source_key(self, source):
+        kind, namespace = source
+        return f'{kind}:{namespace.full_name if kind == "repo" else namespace}'
+
+    def source_namespace(self, source):
+        kind, namespace = source
+        return namespace.owner.login if kind == 'repo' else namespace
+
+    def source_scope(self, source):
+        kind, namespace = source
+        return 'url', f'{github_web_url(self.host)}/{namespace.full_name if kind == "repo" else namespace}/'
+
+    def get_source_ccs(self, source, state='open', sort='updated', updated_after=None):
+        kind, namespace = source
+        if kind == 'repo':
+            yield from self._get_pulls(namespace, state, sort, updated_after)
+            return
+        query = f'org:{namespace} is:pr sort:updated-desc'
+        if self.base_branch:
+            query += f' base:{self.base_branch}'
+        if updated_after:
+            query += f' updated:>={self.convert_timestamp_to_iso(updated_after)}'
+        else:
+            query += f' is:{state}'
+        try:
+            yield from self._search_pulls(query)
+        except SearchLimitExceeded as e:
+            logging.warning(f"{e}, listing the PRs of the '{namespace}' org repo by repo instead.")
+            for repo in self.namespaces[namespace].get_repos():
+                yield from self._get_pulls(repo, state, sort, updated_after)
+
+    def _get_pulls(self, repo, state, sort, updated_after=None):
+        """Yields the repository's PRs, or all the ones updated since updated_after, latest update first.
+
+        They're listed as raw JSON through the API session, sparing PyGithub's (lazily completed) objects.
+        """
+        url = f'{self.api_url}/repos/{repo.full_name}/pulls'
+        filters = {'base': self.base_branch} if self.base_branch else {}
+        if not updated_after:
+            yield from self._pages(url, state=state, sort=sort, **filters)
+            return
+        for pr in self._pages(url, state='all', sort='updated', direction='desc', **filters):
+            if self.cc_updated_at(pr) < updated_after:
+                return
+            yield pr
+
+    def _pages(self, url, **params):
+        """Yields the items of all the pages of a REST listing."""
+        params['per_page'] = 100
+        while url:
+            response = self.api.get(url, params=params)
+            response.raise_for_status()
+            params = None  # the next page's URL already holds them
+            url = response.links.get('next', {}).get('url')
+            yield from json_loads(response.content)
+
+    def _search_pulls(self, query):
+        """Yields the PRs matched by a GitHub search query, as GraphQL nodes carrying their author's name.
+
+        Raises SearchLimitExceeded before yielding anything when the search can't return all the matches.
+        """
+
+        cursor = None
+        while True:
+            response = self.api.post(self.graphql_url, json={
+                'query': PULL_REQUESTS_SEARCH_QUERY,
+                'variables': {'query': query, 'cursor': cursor},
+            })
+            response.raise_for_status()
+            payload = response.json()
+            if payload.get('errors'):
+                raise GraphQLError(payload['errors'])
+            search = payload['data']['search']
+            if cursor is None and search['issueCount'] > GITHUB_SEARCH_LIMIT:
+                raise SearchLimitExceeded(f"GitHub search '{query}' matched {search['issueCount']} PRs")
+            for node in search['nodes']:
+                if node:
+                    yield node
+            if not search['pageInfo']['hasNextPage']:
+                return
+            cursor = search['pageInfo']['endCursor']
+
+    def get_user_name(self, login):
+        """Returns the user's display name, or its login when no name is set."""
+        return metadata_cache.get('user', self.host, login, lambda: self._load_user_name(login))
+
+    def _load_user_name(self, login):
+        with metrics.tagged(phase='enrich'):
+            return self.gh.get_user(login).name or login
+
+    def cc_updated_at(self, pr):
+        # either a PR node of the GraphQL search or a PR of the REST API
+        updated_at = pr['updatedAt'] if 'updatedAt' in pr else pr['updated_at']
+        return datetime.strptime(updated_at, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
 
     def cc_to_dict(self, pr):
-        return {
-            'project': pr.base.repo.name,
-            'last updated': self.convert_timestamp_to_time_passed(pr.updated_at.timestamp()),
-            'contributor': self.gh.get_user(pr.user.login).name or self.gh.get_user(pr.user.login).login,
-            'state': pr.state,
-            'title': pr.title,
-            'web_url': pr.html_url,
-        }
+        if 'updatedAt' in pr:
+            return self._node_to_dict(pr)
+        return CodeContribution(
+            project=pr['base']['repo']['name'],
+            last_updated=self.convert_timestamp_to_datetime(self.cc_updated_at(pr)),
+            contributor=self.get_user_name(pr['user']['login']),
+            state=pr['state'],
+            title=pr['title'],
+            web_url=pr['html_url'],
+            vendor=self.name,
+        )
+
+    def _node_to_dict(self, node):
+        """Converts a PR node of the GraphQL search, which already holds the author's name."""
+        author = node.get('author') or {}
+        return CodeContribution(
+            project=node['repository']['name'],
+            last_updated=self.convert_timestamp_to_datetime(self.cc_updated_at(node)),
+            contributor=author.get('name') or author.get('login'),
+            state=node['state'].lower(),
+            title=node['title'],
+            web_url=node['url'],
+            vendor=self.name,
+        )
+
+
+GERRIT_SSH_PORT = '29418'
 
 
 class Gerrit(Server):
-    def __init__(self, host, bot_users, namespaces):
-        super().__init__('Gerrit', host)
-        self.query_limit = 50
+    def __init__(self, host, bot_users, namespaces, workers=None, query_limit=None, query_options=None,
+                 projects_per_query=None):
+        super().__init__('Gerrit', host, workers)
+        self.query_limit = query_limit or 100
+        self.query_options = query_options or []
+        self.projects_per_query = projects_per_query or 25
         self._connect()
         self._set_namespaces(namespaces)
         self._set_bot_users(bot_users)
 
     def _connect(self):
-        pass
+        """Prepares a multiplexed SSH connection, so all the queries to the host share a single handshake.
+
+        The first query opens a master connection which the following ones (also concurrent ones) go through,
+        and which is closed by close() or after being idle for a minute.
+        """
+
+        self.control_dir = tempfile.mkdtemp(prefix='batyam-ssh-')
+        self.ssh_command = [
+            'ssh', self.host, '-p', GERRIT_SSH_PORT,
+            '-o', 'ControlMaster=auto', '-o', f'ControlPath={self.control_dir}/%C', '-o', 'ControlPersist=60',
+        ]
+
+    def close(self):
+        super().close()
+        call(self.ssh_command + ['-O', 'exit'], stdout=DEVNULL, stderr=DEVNULL)
+        shutil.rmtree(self.control_dir, ignore_errors=True)
 
     def _set_bot_users(self, bot_users):
         self.bot_users = []
@@ -189,47 +670,77 @@ class Gerrit(Server):
     def _set_namespaces(self, projects):
         self.namespaces = projects
 
-    def get_ccs(self, status='open'):
-        """Pulls and yield CC from the requested Gerrit's namespaces using an SSH command.
+    def get_sources(self):
+        """Returns the requested Gerrit projects, grouped so that each group is pulled by a single query."""
+        projects = list(self.namespaces or [])
+        return [tuple(projects[i:i + self.projects_per_query])
+                for i in range(0, len(projects), self.projects_per_query)]
+
+    def source_key(self, projects):
+        return ','.join(projects)
+
+    def source_scope(self, projects):
+        # a change's URL doesn't always hold its project
+        return 'projects', list(projects)
+
+    def get_source_ccs(self, projects, status='open', updated_after=None):
+        """Pulls and yield CC from a group of the requested Gerrit's projects using an SSH command.
+
+        The query's output is parsed line by line while it is still being received,
+        and its closing stats line tells whether another page should be queried.
 
               skip: Number of changes to skip.
-              result_cnt: Keeping count of the number of results left to return.
-              cc_content: Outputted JSON of CC from the ssh command.
-              lines: Line-separated JSON copy of cc_content.
+              stats: The query's stats line, holding its row count and whether more changes are left.
               patch: One gerrit CC.
         """
 
-        for project in self.namespaces:
-            skip = 0
-            results_cnt = self.query_limit
-            gerrit_identity_file = os.getenv("GERRIT_IDENTITY_FILE")
-            if not gerrit_identity_file:
-                logging.warning(
-                    'No identity file found for Gerrit. Please set "GERRIT_IDENTITY_FILE to be the path to the identity file')
-                continue
-
-            while results_cnt >= self.query_limit:
-                cc_content = check_output([
-                    'ssh', self.host, '-p', '29418', '-i', gerrit_identity_file, 'gerrit', 'query',
-                    '--comments', '--all-approvals', '--format=JSON',
-                    '--start', str(skip), 'limit:' + str(self.query_limit),
-                                          'project:' + project, 'status:' + status,
-                ])
-                lines = cc_content.splitlines()
-                for line in lines:
-                    patch = json.loads(line)
-                    if patch.get('type') == 'stats' or patch.get('owner').get('name') in self.bot_users:
-                        continue  # ignore output stats query
-                    yield patch
-                results_cnt = len(lines) - 1
-                skip += results_cnt
+        if not os.getenv("GERRIT_IDENTITY_FILE"):
+            logging.warning(
+                'No identity file found for Gerrit. Please set "GERRIT_IDENTITY_FILE to be the path to the identity file')
+            return
+
+        skip = 0
+        while True:
+            command = self.query_command(projects, skip, status, updated_after)
+            stats = {}
+            with metrics.run_metrics.timed(f'gerrit query --start {skip}'):
+                with Popen(command, stdout=PIPE) as query:
+                    for line in query.stdout:
+                        patch = json_loads(line)
+                        if patch.get('type') == 'stats':
+                            stats = patch
+                        elif not self.is_bot_patch(patch):
+                            yield patch
+                if query.returncode:
+                    raise CalledProcessError(query.returncode, command)
+            results_cnt = stats.get('rowCount', 0)
+            if not stats.get('moreChanges', results_cnt >= self.query_limit):
+                break
+            skip += results_cnt
+
+    def query_command(self, projects, skip, status='open', updated_after=None):
+        """Returns the SSH command querying a page of the projects' CC."""
+        projects_query = '(' + ' OR '.join('project:' + project for project in projects) + ')'
+        # a change's age is the time since its last update, '-age' picks the ones updated since then
+        status_query = f'-age:{int(time() - updated_after) + 1}s' if updated_after else 'status:' + status
+        return self.ssh_command + [
+            '-i', os.getenv("GERRIT_IDENTITY_FILE"), 'gerrit', 'query', *self.query_options, '--format=JSON',
+            '--start', str(skip), 'limit:' + str(self.query_limit), projects_query, status_query,
+        ]
+
+    def is_bot_patch(self, patch):
+        return (patch.get('owner') or {}).get('name') in self.bot_users
+
+    def cc_updated_at(self, patch):
+        return patch.get('lastUpdated', 0)
 
     def cc_to_dict(self, patch):
-        return {
-            'project': patch.get('project'),
-            'last updated': self.convert_timestamp_to_time_passed(patch.get('lastUpdated', 0)),
-            'contributor': patch.get('owner').get('name'),
-            'state': 'open' if patch.get('status') == 'NEW' else patch.get('status'),
-            'title': patch.get('subject'),
-            'web_url': patch.get('url'),
-        }
+        return CodeContribution(
+            project=patch.get('project'),
+            last_updated=self.convert_timestamp_to_datetime(self.cc_updated_at(patch)),
+            contributor=(patch.get('owner') or {}).get('name'),
+            state='open' if patch.get('status') == 'NEW' else patch.get('status'),
+            title=patch.get('subject'),
+            web_url=patch.get('url'),
+            vendor=self.name,
+        )
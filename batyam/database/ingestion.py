@@ -0,0 +1,165 @@
+from itertools import islice
+
+from django.db import transaction
+
+from .models import CodeContribution, Contributor, Generation, Project
+
+VENDORS = {vendor_name.casefold(): vendor for vendor, vendor_name in CodeContribution.VENDOR_CHOICES}
+UPDATED_FIELDS = ['project', 'contributor', 'last_updated', 'title', 'state']
+# stays below SQLite's limit of 999 variables per query
+QUERY_CHUNK_SIZE = 500
+# bulk_update's batches are also capped by the backend's limits; bulk_create's are left for the backend to size,
+# as before Django 3.0 a given batch_size would override them
+UPDATE_BATCH_SIZE = 1000
+
+
+def _chunks(values, size=QUERY_CHUNK_SIZE):
+    values = iter(values)
+    chunk = list(islice(values, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(values, size))
+
+
+def _resolve(model, names, max_length, ids):
+    """Adds the IDs of the model's objects by their names to ids, creating the missing ones in bulk."""
+    names = {name[:max_length] for name in names} - ids.keys()
+    for chunk in _chunks(names):
+        ids.update({name: pk for pk, name in model.objects.filter(name__in=chunk).values_list('pk', 'name')})
+    missing = names - ids.keys()
+    if missing:
+        model.objects.bulk_create([model(name=name) for name in missing])
+        # bulk_create doesn't set the primary keys on every backend (e.g SQLite), so they're queried back
+        for chunk in _chunks(missing):
+            ids.update({name: pk for pk, name in model.objects.filter(name__in=chunk).values_list('pk', 'name')})
+    return ids
+
+
+def _attnames():
+    return [CodeContribution._meta.get_field(field).attname for field in UPDATED_FIELDS]
+
+
+def _changed(stored, collected):
+    return any(getattr(stored, attname) != getattr(collected, attname) for attname in _attnames())
+
+
+def to_code_contribution(team, row, projects, contributors):
+    """Converts a collected row (see sinks.REPORT_COLUMNS, plus its 'vendor') into an unsaved CodeContribution."""
+    return CodeContribution(
+        team=team[:50],
+        vendor=VENDORS[row['vendor'].casefold()],
+        url=row['web_url'],
+        project_id=projects[(row['project'] or '')[:255]],
+        contributor_id=contributors[(row['contributor'] or '')[:100]],
+        last_updated=row['last updated'],
+        title=(row['title'] or '')[:255],
+        state='OP' if row['state'] == 'open' else 'CD',
+    )
+
+
+def _upsert(team, rows, projects, contributors, seen):
+    """Creates and updates a chunk of the team's CC, skipping those already seen. Returns the created and updated."""
+    _resolve(Project, {row['project'] or '' for row in rows}, 255, projects)
+    _resolve(Contributor, {row['contributor'] or '' for row in rows}, 100, contributors)
+    collected = {}
+    for row in rows:
+        cc = to_code_contribution(team, row, projects, contributors)
+        if (cc.vendor, cc.url) not in seen:  # the first (latest) row of a CC pulled twice wins
+            seen[(cc.vendor, cc.url)] = None
+            collected[(cc.vendor, cc.url)] = cc
+
+    stored = {}
+    for vendor in {vendor for vendor, _ in collected}:
+        urls = [url for cc_vendor, url in collected if cc_vendor == vendor]
+        for chunk in _chunks(urls):
+            for cc in CodeContribution.objects.filter(team=team[:50], vendor=vendor, url__in=chunk):
+                stored[(cc.vendor, cc.url)] = cc
+
+    created, updated = [], []
+    for key, cc in collected.items():
+        if key not in stored:
+            created.append(cc)
+            continue
+        cc.pk = seen[key] = stored[key].pk
+        if _changed(stored[key], cc):
+            updated.append(cc)
+    CodeContribution.objects.bulk_create(created)
+    CodeContribution.objects.bulk_update(updated, UPDATED_FIELDS, batch_size=UPDATE_BATCH_SIZE)
+    return len(created), len(updated)
+
+
+def _covered(scopes):
+    """Returns a function telling whether a stored CC's vendor, URL and project are within the pulled scopes.
+
+    The scopes are (vendor, 'url', prefix) or (vendor, 'projects', names), see base.Server.source_scope().
+    """
+    prefixes, projects = {}, {}
+    for vendor, kind, value in scopes:
+        vendor = VENDORS[vendor.casefold()]
+        if kind == 'url':
+            prefixes[vendor] = prefixes.get(vendor, ()) + (value.casefold(),)
+        else:
+            projects.setdefault(vendor, set()).update(name[:255] for name in value)
+
+    def covered(vendor, url, project):
+        return url.casefold().startswith(prefixes.get(vendor, ())) or project in projects.get(vendor, ())
+    return covered
+
+
+def ingest(team, rows, scopes=None):
+    """Upserts the team's collected CC, keyed by their vendor and URL, in a single transaction.
+
+    The rows are taken QUERY_CHUNK_SIZE at a time: their projects and contributors are resolved by name,
+    and the CC are created and updated in bulk. The team's stored open CC which weren't collected this time
+    got closed or merged meanwhile, so they are marked as closed; given the scopes the rows were pulled from,
+    only those within them are, as the sources which failed to be pulled (e.g an unreachable server) had no
+    rows collected at all. The database's generation is bumped along, which invalidates the views' caches.
+    Returns the number of created, updated and closed CC.
+    """
+
+    with transaction.atomic():
+        stored_open = CodeContribution.objects.filter(team=team[:50], state='OP')
+        if scopes is None:
+            stored_open = set(stored_open.values_list('pk', flat=True))
+        else:
+            covered = _covered(scopes)
+            stored_open = {pk for pk, vendor, url, project
+                           in stored_open.values_list('pk', 'vendor', 'url', 'project__name')
+                           if covered(vendor, url, project)}
+        projects, contributors, seen = {}, {}, {}
+        created = updated = 0
+        for chunk in _chunks(rows):
+            chunk_created, chunk_updated = _upsert(team, chunk, projects, contributors, seen)
+            created += chunk_created
+            updated += chunk_updated
+        stored_open -= set(seen.values())
+        for chunk in _chunks(stored_open):
+            CodeContribution.objects.filter(pk__in=chunk).update(state='CD')
+        Generation.bump()
+    return created, updated, len(stored_open)
+
+
+def upsert(team, row):
+    """Creates or updates a single CC (e.g from a webhook event), keeping the team's rows current between the runs.
+
+    The CC is updated for every team it's stored for, and created for the given team if it isn't stored for it.
+    Its contributor is only set on creation, as an event may only name the user who triggered it, and events
+    older than the stored CC (delivered out of order) are ignored. Returns the number of created and updated CC.
+    """
+
+    with transaction.atomic():
+        projects = _resolve(Project, {row['project'] or ''}, 255, {})
+        contributors = _resolve(Contributor, {row['contributor'] or ''}, 100, {})
+        cc = to_code_contribution(team, row, projects, contributors)
+        team_cc, created = CodeContribution.objects.get_or_create(
+            team=cc.team, vendor=cc.vendor, url=cc.url,
+            defaults={attname: getattr(cc, attname) for attname in _attnames()})
+        stored = CodeContribution.objects.filter(vendor=cc.vendor, url=cc.url)
+        if created:
+            stored = stored.exclude(pk=team_cc.pk)
+        if cc.last_updated:
+            stored = stored.exclude(last_updated__gt=cc.last_updated)
+        updated = stored.update(project_id=cc.project_id, last_updated=cc.last_updated, title=cc.title, state=cc.state)
+        if created or updated:
+            Generation.bump()
+    return int(created), updated
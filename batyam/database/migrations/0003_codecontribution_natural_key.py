@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:33
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0002_auto_20200829_1519'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='codecontribution',
+            unique_together={('team', 'vendor', 'url')},
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0003_codecontribution_natural_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contributor',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='codecontribution',
+            index=models.Index(fields=['team', 'state', 'id'], name='database_co_team_f10b49_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='codecontribution',
+            index=models.Index(fields=['vendor', 'state', 'id'], name='database_co_vendor_34ee68_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='codecontribution',
+            index=models.Index(fields=['state', 'id'], name='database_co_state_71ff59_idx'),
+        ),
+    ]
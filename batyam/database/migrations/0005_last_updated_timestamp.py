@@ -0,0 +1,68 @@
+from django.db import migrations, models
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+def parse_last_updated(apps, schema_editor):
+    """Keeps the last update of the CC which stored an actual date; relative ones ('3 days ago') are dropped."""
+    CodeContribution = apps.get_model('database', 'CodeContribution')
+    for cc in CodeContribution.objects.all():
+        value = (cc.last_updated or '').strip()
+        try:
+            updated_at = parse_datetime(value)
+            if updated_at is None and parse_date(value):
+                updated_at = parse_datetime(value + 'T00:00:00')
+        except ValueError:
+            updated_at = None
+        if updated_at is not None:
+            if timezone.is_naive(updated_at):
+                updated_at = timezone.make_aware(updated_at, timezone.utc)
+            cc.last_updated_at = updated_at
+            cc.save(update_fields=['last_updated_at'])
+
+
+def format_last_updated(apps, schema_editor):
+    CodeContribution = apps.get_model('database', 'CodeContribution')
+    for cc in CodeContribution.objects.exclude(last_updated_at=None):
+        cc.last_updated = cc.last_updated_at.isoformat()
+        cc.save(update_fields=['last_updated'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0004_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='codecontribution',
+            name='last_updated_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(parse_last_updated, format_last_updated),
+        # lets the field be added back, to the existing rows, when unapplied
+        migrations.AlterField(
+            model_name='codecontribution',
+            name='last_updated',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RemoveField(
+            model_name='codecontribution',
+            name='last_updated',
+        ),
+        migrations.RenameField(
+            model_name='codecontribution',
+            old_name='last_updated_at',
+            new_name='last_updated',
+        ),
+        migrations.AlterField(
+            model_name='codecontribution',
+            name='last_updated',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='codecontribution',
+            index=models.Index(fields=['team', 'state', 'last_updated'], name='database_co_team_8b7652_idx'),
+        ),
+    ]
@@ -1,15 +1,17 @@
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 
 
 class Contributor(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)
     github_id = models.CharField(max_length=20, default=None, blank=True, null=True)
     gitlab_id = models.CharField(max_length=20, default=None, blank=True, null=True)
     gerrit_id = models.CharField(max_length=20, default=None, blank=True, null=True)
 
 
 class Project(models.Model):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
 
 
 class CodeContribution(models.Model):
@@ -26,10 +28,43 @@ class CodeContribution(models.Model):
 
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
     contributor = models.ForeignKey(Contributor, on_delete=models.CASCADE)
-    last_updated = models.CharField(max_length=255)
+    # null for the CC stored before it was a timestamp, when only their relative age was kept
+    last_updated = models.DateTimeField(null=True, db_index=True)
     url = models.URLField(max_length=255, null=False, blank=True)
     title = models.CharField(max_length=255)
     state = models.CharField(choices=STATE_CHOICES , max_length=2)
     vendor = models.CharField(choices=VENDOR_CHOICES , max_length=2)
     # namespace = models.CharField(default=None, blank=True, null=True)
     team = models.CharField(max_length=50)
+
+    class Meta:
+        # the natural key the collected CC are upserted by
+        unique_together = ('team', 'vendor', 'url')
+        # the listing's filters, each ending with the ID it is paginated by
+        indexes = [
+            models.Index(fields=['team', 'state', 'id']),
+            models.Index(fields=['vendor', 'state', 'id']),
+            models.Index(fields=['state', 'id']),
+            # the stale CC of a team, e.g its open ones not updated for a week
+            models.Index(fields=['team', 'state', 'last_updated']),
+        ]
+
+
+class Generation(models.Model):
+    """Counts the ingestions into the database, so the views' caches and ETags change along with its data."""
+    number = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def current(cls):
+        return cls.objects.get_or_create(pk=1)[0]
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(number=F('number') + 1, updated_at=timezone.now()):
+            cls.objects.create(pk=1, number=1)
+
+    @property
+    def etag(self):
+        # the time tells apart the same number of a recreated database
+        return f'{self.number}-{int(self.updated_at.timestamp())}'
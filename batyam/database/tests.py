@@ -1,3 +1,255 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+from datetime import timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .ingestion import ingest
+from .models import CodeContribution, Contributor, Generation, Project
+
+NOW = timezone.now()
+
+
+def collected_row(number, state='open', **fields):
+    row = {
+        'project': f'project-{number % 3}',
+        'last updated': NOW - timedelta(days=number, hours=12),
+        'contributor': f'contributor-{number % 5}',
+        'state': state,
+        'title': f'Change {number}',
+        'web_url': f'https://git.example.com/changes/{number}',
+        'vendor': 'GitLab',
+    }
+    row.update(fields)
+    return row
+
+
+class IngestTests(TestCase):
+    def test_creates_the_code_contributions_with_their_projects_and_contributors(self):
+        created, updated, closed = ingest('team-a', [collected_row(number) for number in range(10)])
+
+        self.assertEqual((created, updated, closed), (10, 0, 0))
+        self.assertEqual(Project.objects.count(), 3)
+        self.assertEqual(Contributor.objects.count(), 5)
+        cc = CodeContribution.objects.select_related('project', 'contributor').get(url__endswith='/changes/4')
+        self.assertEqual((cc.project.name, cc.contributor.name, cc.state, cc.vendor, cc.team),
+                         ('project-1', 'contributor-4', 'OP', 'GL', 'team-a'))
+
+    def test_updates_the_changed_code_contributions_only(self):
+        ingest('team-a', [collected_row(number) for number in range(10)])
+
+        rows = [collected_row(number) for number in range(10)]
+        rows[2]['title'] = 'Renamed'
+        created, updated, closed = ingest('team-a', rows)
+
+        self.assertEqual((created, updated, closed), (0, 1, 0))
+        self.assertEqual(CodeContribution.objects.count(), 10)
+        self.assertEqual(CodeContribution.objects.get(url__endswith='/changes/2').title, 'Renamed')
+
+    def test_stores_when_the_code_contributions_were_last_updated(self):
+        row = collected_row(1)
+        ingest('team-a', [row])
+
+        self.assertEqual(CodeContribution.objects.get().last_updated, row['last updated'])
+
+    def test_closes_the_code_contributions_which_were_not_collected_again(self):
+        ingest('team-a', [collected_row(number) for number in range(10)])
+
+        created, updated, closed = ingest('team-a', [collected_row(number) for number in range(5, 12)])
+
+        self.assertEqual((created, updated, closed), (2, 0, 5))
+        self.assertEqual(CodeContribution.objects.filter(state='CD').count(), 5)
+
+    def test_only_closes_the_code_contributions_of_the_pulled_scopes(self):
+        ingest('team-a', [collected_row(1, web_url='https://gitlab.example.com/group-a/project-1/-/merge_requests/1'),
+                          collected_row(2, web_url='https://gitlab.example.com/group-b/project-2/-/merge_requests/2'),
+                          collected_row(3, web_url='https://github.com/Org-A/project-0/pull/3', vendor='GitHub'),
+                          collected_row(4, web_url='https://github.com/org-b/project-1/pull/4', vendor='GitHub'),
+                          collected_row(5, project='core', vendor='Gerrit'),
+                          collected_row(6, project='docs', vendor='Gerrit')])
+
+        # group-b and the GitHub server failed to be pulled, core's change got merged meanwhile
+        created, updated, closed = ingest('team-a', [], [('GitLab', 'url', 'https://gitlab.example.com/group-a/'),
+                                                         ('Gerrit', 'projects', ['core'])])
+
+        self.assertEqual((created, updated, closed), (0, 0, 2))
+        self.assertEqual(set(CodeContribution.objects.filter(state='CD').values_list('url', flat=True)),
+                         {'https://gitlab.example.com/group-a/project-1/-/merge_requests/1',
+                          'https://git.example.com/changes/5'})
+
+        closed = ingest('team-a', [], [('GitHub', 'url', 'https://github.com/org-a/')])[2]
+
+        self.assertEqual(closed, 1)
+        self.assertEqual(CodeContribution.objects.get(url__endswith='/pull/3').state, 'CD')
+
+    def test_keys_the_code_contributions_by_team_vendor_and_url(self):
+        ingest('team-a', [collected_row(1), collected_row(1, vendor='GitHub')])
+        ingest('team-b', [collected_row(1)])
+
+        self.assertEqual(CodeContribution.objects.count(), 3)
+        self.assertEqual(CodeContribution.objects.filter(team='team-a', state='OP').count(), 2)
+
+    def test_ingests_more_code_contributions_than_a_query_takes_variables(self):
+        created, _, _ = ingest('team-a', [collected_row(number) for number in range(2500)])
+
+        self.assertEqual(created, 2500)
+        self.assertEqual(ingest('team-a', [collected_row(number) for number in range(2500)]), (0, 0, 0))
+
+    def test_ingests_the_rows_chunk_by_chunk_as_they_are_iterated(self):
+        rows = (collected_row(number % 600, title=f'Pulled {number}') for number in range(1200))
+
+        self.assertEqual(ingest('team-a', rows), (600, 0, 0))
+        self.assertEqual(CodeContribution.objects.get(url__endswith='/changes/0').title, 'Pulled 0')
+
+    def test_bumps_the_generation(self):
+        ingest('team-a', [collected_row(1)])
+        ingest('team-b', [collected_row(1)])
+
+        self.assertEqual(Generation.current().number, 2)
+
+
+class ListingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        ingest('team-a', [collected_row(number) for number in range(30)])
+        ingest('team-b', [collected_row(number, vendor='Gerrit') for number in range(30, 40)])
+
+    def test_filters_the_listing(self):
+        response = self.client.get('/database/api/code-contributions/',
+                                   {'team': 'team-a', 'project': 'project-1', 'contributor': 'contributor-2'})
+
+        self.assertEqual([cc['title'] for cc in response.json()['results']], ['Change 22', 'Change 7'])
+
+    def test_filters_the_vendor_and_state_by_either_their_code_or_name(self):
+        by_name = self.client.get('/database/api/code-contributions/', {'vendor': 'gerrit', 'state': 'open'})
+        by_code = self.client.get('/database/api/code-contributions/', {'vendor': 'GR', 'state': 'OP'})
+
+        self.assertEqual(len(by_name.json()['results']), 10)
+        self.assertEqual(by_name.json(), by_code.json())
+
+    def test_paginates_the_listing_by_its_keyset(self):
+        titles = []
+        url, params = '/database/api/code-contributions/', {'team': 'team-a', 'limit': 12}
+        while url:
+            page = self.client.get(url, params).json()
+            titles += [cc['title'] for cc in page['results']]
+            url, params = page['next'], None
+
+        self.assertEqual(titles, [f'Change {number}' for number in reversed(range(30))])
+
+    def test_renders_a_page_with_a_constant_number_of_queries(self):
+        with self.assertNumQueries(2):  # the generation and the page
+            response = self.client.get('/database/', {'limit': 25})
+
+        self.assertContains(response, 'contributor-4')
+        self.assertContains(response, 'Next page')
+
+    def test_lists_the_code_contributions_not_updated_for_a_number_of_days(self):
+        response = self.client.get('/database/api/code-contributions/',
+                                   {'team': 'team-a', 'state': 'open', 'stale_days': 28})
+
+        self.assertEqual([cc['title'] for cc in response.json()['results']], ['Change 29', 'Change 28'])
+
+    def test_serves_the_cached_page_until_the_next_ingestion(self):
+        first = self.client.get('/database/api/code-contributions/', {'team': 'team-a', 'limit': 5})
+        with self.assertNumQueries(1):
+            cached = self.client.get('/database/api/code-contributions/', {'limit': 5, 'team': 'team-a'})
+        ingest('team-a', [collected_row(number, title='Renamed') for number in range(30)])
+        refreshed = self.client.get('/database/api/code-contributions/', {'team': 'team-a', 'limit': 5})
+
+        self.assertEqual(cached.content, first.content)
+        self.assertEqual({cc['title'] for cc in refreshed.json()['results']}, {'Renamed'})
+
+    def test_answers_the_revalidation_of_an_unchanged_page_with_a_304(self):
+        response = self.client.get('/database/', {'team': 'team-b'})
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        not_modified = self.client.get('/database/', {'team': 'team-b'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        since = self.client.get('/database/', {'team': 'team-b'}, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        ingest('team-b', [collected_row(40, vendor='Gerrit')])
+        modified = self.client.get('/database/', {'team': 'team-b'}, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual((not_modified.status_code, since.status_code), (304, 304))
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified['ETag'], response['ETag'])
+
+
+def pull_request_event(number, state='open', updated_at='2020-06-01T10:00:00Z', title=None):
+    return {
+        'action': 'opened' if state == 'open' else 'closed',
+        'pull_request': {
+            'html_url': f'https://git.example.com/changes/{number}', 'state': state, 'updated_at': updated_at,
+            'title': title or f'Change {number}', 'user': {'login': 'octocat'}, 'base': {'repo': {'name': 'project-9'}},
+        },
+    }
+
+
+@override_settings(GITHUB_WEBHOOK_SECRET='github-secret', GITLAB_WEBHOOK_TOKEN='gitlab-token')
+class WebhookTests(TestCase):
+    def post_github(self, payload, event='pull_request', secret='github-secret'):
+        body = json.dumps(payload).encode()
+        signature = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return self.client.post('/database/webhooks/github/team-a/', body, content_type='application/json',
+                                HTTP_X_GITHUB_EVENT=event, HTTP_X_HUB_SIGNATURE_256=signature)
+
+    def test_creates_the_code_contribution_of_a_pull_request_event(self):
+        response = self.post_github(pull_request_event(1))
+
+        self.assertEqual(response.json(), {'event': 'pull_request', 'created': 1, 'updated': 0})
+        cc = CodeContribution.objects.select_related('project', 'contributor').get()
+        self.assertEqual((cc.team, cc.vendor, cc.state, cc.project.name, cc.contributor.name),
+                         ('team-a', 'GH', 'OP', 'project-9', 'octocat'))
+
+    def test_updates_the_code_contribution_for_every_team_but_not_its_contributor(self):
+        ingest('team-a', [collected_row(1, vendor='GitHub')])
+        ingest('team-b', [collected_row(1, vendor='GitHub')])
+
+        response = self.post_github(pull_request_event(1, state='closed', updated_at=NOW.isoformat()))
+
+        self.assertEqual(response.json()['updated'], 2)
+        self.assertEqual(set(CodeContribution.objects.values_list('state', 'contributor__name')),
+                         {('CD', 'contributor-1')})
+
+    def test_ignores_the_events_older_than_the_stored_code_contribution(self):
+        ingest('team-a', [collected_row(1, vendor='GitHub')])
+
+        response = self.post_github(pull_request_event(1, state='closed'))
+
+        self.assertEqual(response.json()['updated'], 0)
+        self.assertEqual(CodeContribution.objects.get().state, 'OP')
+
+    def test_rejects_an_invalid_signature(self):
+        response = self.post_github(pull_request_event(1), secret='another-secret')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(CodeContribution.objects.exists())
+
+    def test_acknowledges_the_other_events(self):
+        response = self.post_github({'zen': 'Keep it simple.'}, event='ping')
+
+        self.assertEqual(response.json(), {'event': 'ping', 'ignored': True})
+
+    def test_upserts_the_code_contribution_of_a_merge_request_event(self):
+        payload = {
+            'object_kind': 'merge_request', 'user': {'name': 'Jane Doe'}, 'project': {'name': 'project-9'},
+            'object_attributes': {'url': 'https://git.example.com/changes/1', 'state': 'merged',
+                                  'title': 'Change 1', 'updated_at': '2020-06-01 10:00:00 UTC'},
+        }
+        headers = {'content_type': 'application/json', 'HTTP_X_GITLAB_EVENT': 'Merge Request Hook'}
+
+        rejected = self.client.post('/database/webhooks/gitlab/team-a/', json.dumps(payload),
+                                    HTTP_X_GITLAB_TOKEN='wrong-token', **headers)
+        response = self.client.post('/database/webhooks/gitlab/team-a/', json.dumps(payload),
+                                    HTTP_X_GITLAB_TOKEN='gitlab-token', **headers)
+
+        self.assertEqual(rejected.status_code, 403)
+        self.assertEqual(response.json(), {'event': 'merge_request', 'created': 1, 'updated': 0})
+        cc = CodeContribution.objects.get()
+        self.assertEqual((cc.vendor, cc.state, cc.last_updated.isoformat()), ('GL', 'CD', '2020-06-01T10:00:00+00:00'))
+
+    @override_settings(GITHUB_WEBHOOK_SECRET=None)
+    def test_disables_a_receiver_without_its_secret(self):
+        self.assertEqual(self.post_github(pull_request_event(1)).status_code, 404)
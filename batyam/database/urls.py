@@ -1,8 +1,11 @@
 from django.urls import path
 
-from . import views
+from . import views, webhooks
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('api/code-contributions/', views.code_contributions, name='code_contributions'),
+    path('webhooks/github/<str:team>/', webhooks.github, name='github_webhook'),
+    path('webhooks/gitlab/<str:team>/', webhooks.gitlab, name='gitlab_webhook'),
 ]
 
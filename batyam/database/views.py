@@ -1,16 +1,146 @@
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import urlencode
+from django.views.decorators.http import condition
+
+from .models import CodeContribution, Generation
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+FILTERS = ['team', 'vendor', 'state', 'project', 'contributor', 'stale_days']
+
+
+def _choice(choices, value):
+    """Returns the code of a choice given either its code or its name, case insensitively."""
+    for code, name in choices:
+        if value.casefold() in (code.casefold(), name.casefold()):
+            return code
+    return value
+
+
+def _page_size(params):
+    try:
+        return min(max(int(params.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return DEFAULT_PAGE_SIZE
+
+
+def filter_code_contributions(params):
+    """Returns the CC matching the request's filters, the latest stored first, with their projects and contributors.
+
+    The listing is paginated by its keyset: 'before' takes the ID of the previous page's last CC,
+    so a page costs the same index range scan however deep it is.
+    """
+
+    cc_list = CodeContribution.objects.select_related('project', 'contributor').order_by('-id')
+    if params.get('team'):
+        cc_list = cc_list.filter(team=params['team'])
+    if params.get('vendor'):
+        cc_list = cc_list.filter(vendor=_choice(CodeContribution.VENDOR_CHOICES, params['vendor']))
+    if params.get('state'):
+        cc_list = cc_list.filter(state=_choice(CodeContribution.STATE_CHOICES, params['state']))
+    if params.get('project'):
+        cc_list = cc_list.filter(project__name=params['project'])
+    if params.get('contributor'):
+        cc_list = cc_list.filter(contributor__name=params['contributor'])
+    if params.get('stale_days', '').isdigit():
+        # the CC not updated for that many days
+        cc_list = cc_list.filter(last_updated__lt=timezone.now() - timedelta(days=int(params['stale_days'])))
+    if params.get('before', '').isdigit():
+        cc_list = cc_list.filter(id__lt=int(params['before']))
+    return cc_list
+
+
+def paginate(request):
+    """Returns the requested page of CC, and the URL of the next page (None on the last one)."""
+    page_size = _page_size(request.GET)
+    # one more CC tells whether there is a next page, without counting them all
+    page = list(filter_code_contributions(request.GET)[:page_size + 1])
+    next_url = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        params = {name: request.GET[name] for name in FILTERS + ['limit'] if request.GET.get(name)}
+        next_url = f'{request.path}?{urlencode(dict(params, before=page[-1].id))}'
+    return page, next_url
 
-from .models import CodeContribution
 
+def _generation(request):
+    # read once per request, by both the conditional checks and the cache
+    if not hasattr(request, '_generation'):
+        request._generation = Generation.current()
+    return request._generation
+
+
+def cached_listing(view):
+    """Caches the view's responses by its query string, for the database's current generation.
+
+    The generation only changes when the collector ingests, so it also serves as the responses' ETag
+    and Last-Modified: clients revalidating an unchanged listing get a 304, without it being rendered.
+    """
+
+    @condition(etag_func=lambda request, *args, **kwargs: _generation(request).etag,
+               last_modified_func=lambda request, *args, **kwargs: _generation(request).updated_at)
+    @wraps(view)
+    def cached_view(request, *args, **kwargs):
+        # the host too, as the JSON's next page URL is absolute
+        query = hashlib.md5(f'{request.get_host()}?{urlencode(sorted(request.GET.items()))}'.encode()).hexdigest()
+        key = f'database:{view.__name__}:{_generation(request).etag}:{query}'
+        cached = cache.get(key)
+        if cached is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, (response.content, response['Content-Type']))
+        else:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+        # clients may keep the listing, but have to revalidate it as the next ingestion may change it anytime
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    return cached_view
+
+
+@cached_listing
 def index(request):
-    cc_list = CodeContribution.objects.all()
-    #print(cc_list[0][0])
+    cc_list, next_url = paginate(request)
     context = {
         'codecontribution_list': cc_list,
         'fields': ['Project', 'Contributor', 'Last Updated', 'URL', 'Title',
-        'State', 'Vendor', 'Team']
+        'State', 'Vendor', 'Team'],
+        'filters': {name: request.GET.get(name, '') for name in FILTERS},
+        'next_url': next_url,
+        'json_url': f"{reverse('code_contributions')}?{request.GET.urlencode()}",
     }
-    #output = ', '.join([cc.title for cc in cc_list])
-    #return HttpResponse(output)
     return render(request, 'index.html', context=context)
+
+
+def code_contribution_to_dict(cc):
+    return {
+        'id': cc.id,
+        'project': cc.project.name,
+        'contributor': cc.contributor.name,
+        'last_updated': cc.last_updated.isoformat() if cc.last_updated else None,
+        'url': cc.url,
+        'title': cc.title,
+        'state': cc.get_state_display(),
+        'vendor': cc.get_vendor_display(),
+        'team': cc.team,
+    }
+
+
+@cached_listing
+def code_contributions(request):
+    """The index's listing as JSON, taking the same filters and pagination."""
+    cc_list, next_url = paginate(request)
+    return JsonResponse({
+        'results': [code_contribution_to_dict(cc) for cc in cc_list],
+        'next': request.build_absolute_uri(next_url) if next_url else None,
+    })
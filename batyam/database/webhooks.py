@@ -0,0 +1,111 @@
+"""Receivers of the GitHub pull_request and GitLab merge_request webhooks, upserting the CC as the events arrive.
+
+Each team's webhooks point at their receiver's URL with the team's name, e.g /database/webhooks/github/my-team/,
+and are verified by the secret (GitHub) or token (GitLab) in the settings; without one, the receiver is disabled.
+The collector's runs then only reconcile what the events missed.
+"""
+import hashlib
+import hmac
+import json
+from datetime import timezone
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .ingestion import upsert
+
+
+def _parse_time(value):
+    """Parses the events' ISO times, as well as GitLab's older '2020-01-01 10:00:00 UTC' ones."""
+    if not value:
+        return None
+    updated_at = parse_datetime(value.replace(' UTC', ''))
+    if updated_at and updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return updated_at
+
+
+def _payload(request):
+    try:
+        return json.loads(request.body.decode())
+    except ValueError:
+        return None
+
+
+def _receive(team, payload, event, to_row):
+    try:
+        row = to_row(payload)
+    except (KeyError, TypeError, AttributeError) as e:
+        return JsonResponse({'error': f'Invalid {event} event, missing {e}.'}, status=400)
+    created, updated = upsert(team, row)
+    return JsonResponse({'event': event, 'created': created, 'updated': updated})
+
+
+def pull_request_to_row(payload):
+    """Converts a GitHub pull_request event into a collected row (see ingestion.to_code_contribution)."""
+    pull_request = payload['pull_request']
+    return {
+        'project': pull_request['base']['repo']['name'],
+        'last updated': _parse_time(pull_request.get('updated_at')),
+        # only the author's login, their name is set by the next run
+        'contributor': pull_request['user']['login'],
+        'state': pull_request['state'],
+        'title': pull_request['title'],
+        'web_url': pull_request['html_url'],
+        'vendor': 'GitHub',
+    }
+
+
+def merge_request_to_row(payload):
+    """Converts a GitLab merge_request event into a collected row (see ingestion.to_code_contribution)."""
+    merge_request = payload['object_attributes']
+    return {
+        'project': payload['project']['name'],
+        'last updated': _parse_time(merge_request.get('updated_at')),
+        # the user who triggered the event, the author when opening it
+        'contributor': payload['user']['name'],
+        'state': 'open' if merge_request['state'] == 'opened' else merge_request['state'],
+        'title': merge_request['title'],
+        'web_url': merge_request['url'],
+        'vendor': 'GitLab',
+    }
+
+
+@csrf_exempt
+@require_POST
+def github(request, team):
+    secret = settings.GITHUB_WEBHOOK_SECRET
+    if not secret:
+        return JsonResponse({'error': 'The GitHub webhook receiver is disabled.'}, status=404)
+    expected = 'sha256=' + hmac.new(secret.encode(), request.body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(request.META.get('HTTP_X_HUB_SIGNATURE_256', '').encode(), expected.encode()):
+        return JsonResponse({'error': 'Invalid signature.'}, status=403)
+
+    event = request.META.get('HTTP_X_GITHUB_EVENT')
+    payload = _payload(request)
+    if payload is None:
+        return JsonResponse({'error': 'Invalid JSON payload.'}, status=400)
+    if event != 'pull_request':  # e.g the 'ping' sent when the webhook is added
+        return JsonResponse({'event': event, 'ignored': True})
+    return _receive(team, payload, event, pull_request_to_row)
+
+
+@csrf_exempt
+@require_POST
+def gitlab(request, team):
+    token = settings.GITLAB_WEBHOOK_TOKEN
+    if not token:
+        return JsonResponse({'error': 'The GitLab webhook receiver is disabled.'}, status=404)
+    if not hmac.compare_digest(request.META.get('HTTP_X_GITLAB_TOKEN', '').encode(), token.encode()):
+        return JsonResponse({'error': 'Invalid token.'}, status=403)
+
+    payload = _payload(request)
+    if payload is None:
+        return JsonResponse({'error': 'Invalid JSON payload.'}, status=400)
+    event = payload.get('object_kind') if isinstance(payload, dict) else None
+    if event != 'merge_request':
+        return JsonResponse({'event': event, 'ignored': True})
+    return _receive(team, payload, event, merge_request_to_row)
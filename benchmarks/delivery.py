@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Delivery of the run's emails through the mailer, against a local debugging SMTP server.
+
+The server accepts every message (counting the connections and the messages it got), and can be made to fail
+every nth message transiently, either with a 451 reply or by dropping the connection, to see the retries at work:
+
+    python benchmarks/delivery.py --messages 20 --size 500
+    python benchmarks/delivery.py --messages 20 --fail-every 3 --drop-every 7 --json
+"""
+import argparse
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+import time
+from email.message import EmailMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class DebuggingSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of SMTP for smtplib: HELO/EHLO, MAIL, RCPT, DATA, RSET, NOOP and QUIT."""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 batyam debugging SMTP server')
+        for line in self.rfile:
+            command = line.decode(errors='replace').strip().split(' ', 1)[0].upper()
+            if command == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                for data_line in self.rfile:
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(data_line)
+                time.sleep(server.latency)
+                with server.lock:
+                    server.attempts += 1
+                    attempt = server.attempts
+                if server.drop_every and attempt % server.drop_every == 0:
+                    return  # the connection is dropped without a reply
+                if server.fail_every and attempt % server.fail_every == 0:
+                    self.reply('451 Temporary failure, try again later')
+                    continue
+                with server.lock:
+                    server.messages += 1
+                    server.bytes += size
+                self.reply('250 OK: queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class DebuggingSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0, fail_every=0, drop_every=0):
+        super().__init__(('127.0.0.1', 0), DebuggingSMTPHandler)
+        self.latency = latency
+        self.fail_every = fail_every
+        self.drop_every = drop_every
+        self.lock = threading.Lock()
+        self.connections = self.attempts = self.messages = self.bytes = 0
+
+
+def report_message(number, size):
+    message = EmailMessage()
+    message['Subject'] = f'Open Code Contributions - team-{number}'
+    message['From'] = 'batyam@localhost'
+    message['To'] = f'team-{number}@localhost'
+    message.set_content('<table>' + '<tr><td>CC</td></tr>' * (size * 1024 // 20) + '</table>', subtype='html')
+    return message
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--messages', type=int, default=10, help='reports to send')
+    parser.add_argument('--size', type=int, default=100, help="KB of each report's body")
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds the server takes per message')
+    parser.add_argument('--fail-every', type=int, default=0, help='reply 451 to every nth message')
+    parser.add_argument('--drop-every', type=int, default=0, help='drop the connection on every nth message')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if not args.json else logging.WARNING, format='%(message)s')
+
+    import mailer
+
+    server = DebuggingSMTPServer(args.latency / 1000, args.fail_every, args.drop_every)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    messages = [report_message(number, args.size) for number in range(args.messages)]
+    run_mailer = mailer.Mailer(f'127.0.0.1:{server.server_address[1]}', retry_delay=0.01)
+    start = time.perf_counter()
+    for message in messages:
+        run_mailer.send(message)
+    queued = time.perf_counter() - start
+    run_mailer.close()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    results = {
+        'messages': args.messages, 'size_kb': args.size, 'sent': run_mailer.sent, 'failed': run_mailer.failed,
+        'received': server.messages, 'smtp_connections': server.connections,
+        'queue_time_s': round(queued, 3), 'wall_time_s': round(elapsed, 3),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, value in results.items():
+            print(f'{name:>16} {value}')
+
+
+if __name__ == '__main__':
+    main()
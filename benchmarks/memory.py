@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Memory taken by the CC of a large run, pulled from the offline stand-ins of benchmarks/offline.py.
+
+The servers are pulled as a run does, without building the report, while tracemalloc traces the allocations:
+the peak while pulling (the API's pages and objects on top of the rows) and what the pulled rows keep once done,
+compared with the same rows as plain dicts. Compare the same command across commits:
+
+    python benchmarks/memory.py --ccs 50000
+    python benchmarks/memory.py --vendors gitlab --repos 500 --ccs 50000 --json
+
+Run it from the repository root; tracing the allocations slows the run down a few times.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import offline
+
+MB = 1024 * 1024
+
+
+def pull(config):
+    """Creates and pulls the servers as a run does, returning their rows and the pull's traced memory."""
+    import app
+    import collector
+    import metrics
+    import planner
+
+    metrics.run_metrics = metrics.RunMetrics(slow_call=None)
+    plan = planner.RunPlan(config['teams'])
+    servers = plan.create_servers(app.create_servers_from_dictionary)
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    rows = [row for _, _, source_rows in collector.collect_sources(servers) for row in source_rows]
+    elapsed = time.perf_counter() - start
+    for server in servers:
+        server.close()
+    retained, peak = tracemalloc.get_traced_memory()
+    # the same rows as dicts of the report columns, which the rows were before
+    as_dicts = [{column: row[column] for column in row.keys()} for row in rows]
+    dicts_retained = tracemalloc.get_traced_memory()[0] - retained
+    tracemalloc.stop()
+    del as_dicts
+    return rows, elapsed, retained - baseline, peak - baseline, dicts_retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--vendors', default=','.join(offline.VENDORS), help='comma separated stand-ins to pull')
+    parser.add_argument('--orgs', type=int, default=1, help='orgs (groups) per stand-in')
+    parser.add_argument('--repos', type=int, default=500, help='repositories per stand-in')
+    parser.add_argument('--ccs', type=int, default=50000, help='CC per stand-in, about 10%% of them closed')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    vendors = [vendor.strip().casefold() for vendor in args.vendors.split(',')]
+    unknown = set(vendors) - set(offline.VENDORS)
+    if unknown:
+        parser.error(f"unknown vendors: {', '.join(sorted(unknown))}")
+
+    dataset = offline.Dataset(args.orgs, args.repos, args.ccs)
+    queue = multiprocessing.Queue()
+    stand_ins = multiprocessing.Process(target=offline.serve, args=(dataset, 0, queue), daemon=True)
+    stand_ins.start()
+    directory = tempfile.mkdtemp(prefix='batyam-benchmark-')
+    try:
+        urls = queue.get(timeout=30)
+        offline.install_fake_ssh(directory, dataset, 0)
+        os.environ.setdefault('GITLAB_TOKEN', 'benchmark')
+        os.environ.setdefault('GITHUB_TOKEN', 'benchmark')
+        config = {'teams': [offline.team_config(dataset, vendors, urls, False)]}
+        rows, elapsed, retained, peak, dicts_retained = pull(config)
+    finally:
+        stand_ins.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    results = {
+        'vendors': vendors, 'repos': args.repos, 'ccs': args.ccs, 'rows': len(rows),
+        'row_type': type(rows[0]).__name__ if rows else None, 'wall_time_s': round(elapsed, 3),
+        'pull_peak_mb': round(peak / MB, 1), 'rows_retained_mb': round(retained / MB, 1),
+        'bytes_per_row': round(retained / len(rows)) if rows else None,
+        'as_dicts_mb': round(dicts_retained / MB, 1),
+        # ru_maxrss is in KB on Linux; the stand-ins run in their own processes
+        'peak_memory_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{', '.join(vendors)}: {args.repos} repos, {args.ccs} CC per server")
+    print(f"{'rows':>14} {results['rows']} ({results['row_type']})")
+    print(f"{'wall time':>14} {results['wall_time_s']:.3f} s (traced)")
+    print(f"{'pull peak':>14} {results['pull_peak_mb']:.1f} MB")
+    print(f"{'rows retained':>14} {results['rows_retained_mb']:.1f} MB, {results['bytes_per_row']} bytes per row")
+    print(f"{'as dicts':>14} {results['as_dicts_mb']:.1f} MB more")
+    print(f"{'peak memory':>14} {results['peak_memory_mb']:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
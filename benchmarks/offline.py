@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""Offline benchmark of a full run against local stand-ins for GitLab, GitHub and Gerrit.
+
+A child process serves synthetic orgs over enough of the GitLab v4, GitHub v3 (and GraphQL search) APIs,
+and a fake 'ssh' answering 'gerrit query' with JSON lines is put first on the PATH. The run then creates
+the servers and pulls them like app.main() does, without publishing, and reports its wall time, the API
+calls each stand-in received and the run's peak memory. Compare the same command across commits:
+
+    python benchmarks/offline.py --repos 500 --ccs 5000 --latency 20
+    python benchmarks/offline.py --vendors gitlab,gerrit --repos 5000 --ccs 50000 --workers 8 --json
+
+Run it from the repository root, no .env is needed: the report isn't published, so the Google API isn't even loaded.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, unquote, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VENDORS = ['gitlab', 'github', 'gerrit']
+CONTRIBUTORS = 500
+BOT_USER = 'ci-bot'
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+class Dataset:
+    """Synthetic orgs, the same for every vendor: 'repos' repositories spread over 'orgs' orgs, and 'ccs' CC.
+
+    CC number i belongs to repository i % repos and was updated i minutes before the dataset's end,
+    every tenth one is closed and every twentieth one (an open one) is owned by a bot.
+    """
+
+    def __init__(self, orgs, repos, ccs):
+        self.orgs = orgs
+        self.repos = repos
+        self.ccs = ccs
+
+    def org_name(self, org):
+        return f'org-{org}'
+
+    def repo_name(self, repo):
+        return f'repo-{repo}'
+
+    @staticmethod
+    def _index(name, prefix):
+        number = name[len(prefix):]
+        return int(number) if name.startswith(prefix) and number.isdigit() else None
+
+    def org_index(self, name):
+        return self._index(name, 'org-')
+
+    def repo_index(self, name):
+        return self._index(name, 'repo-')
+
+    def org_repos(self, org):
+        return range(org, self.repos, self.orgs)
+
+    def repo_ccs(self, repo):
+        return range(repo, self.ccs, self.repos)
+
+    def updated_at(self, cc):
+        return EPOCH + (self.ccs - cc) * 60
+
+    def is_open(self, cc):
+        return cc % 10 != 9
+
+    def contributor(self, cc):
+        return BOT_USER if cc % 20 == 18 else f'user-{cc % CONTRIBUTORS}'
+
+    def latest_first(self, ccs):
+        return sorted(ccs)  # lower numbers were updated later
+
+
+def _iso(timestamp, milliseconds=False):
+    value = datetime.fromtimestamp(timestamp, timezone.utc)
+    return value.strftime('%Y-%m-%dT%H:%M:%S') + ('.000Z' if milliseconds else 'Z')
+
+
+def _parse_iso(value):
+    return datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+
+
+class _Stop(Exception):
+    pass
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Routes the requests to the server's routes, counting them and delaying each by the injected latency."""
+
+    protocol_version = 'HTTP/1.1'  # keeps the connections alive, as the real servers do
+    disable_nagle_algorithm = True  # or the body, written apart from the headers, waits for a delayed ACK
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        if url.path == '/_stats':
+            self._send(200, {'calls': self.server.calls})
+            return
+        with self.server.lock:
+            self.server.calls += 1
+        time.sleep(self.server.latency)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length).decode()) if length else None
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            self._send(*self.server.route(self, method, unquote(url.path), query, body))
+        except _Stop:
+            self._send(404, {'message': 'Not Found'})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, dataset, latency):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.dataset = dataset
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def page(self, handler, items, render, query, default_per_page):
+        """Returns a page of the rendered items, linking to the next one like GitLab and GitHub do."""
+        page = int(query.get('page', 1))
+        per_page = min(int(query.get('per_page', default_per_page)), 100)
+        items = list(items)
+        headers = {'X-Page': str(page), 'X-Per-Page': str(per_page), 'X-Total': str(len(items)),
+                   'X-Total-Pages': str(max(1, -(-len(items) // per_page)))}
+        if page * per_page < len(items):
+            query = dict(query, page=page + 1, per_page=per_page)
+            path = urlparse(handler.path).path
+            next_url = f'{self.url}{path}?' + '&'.join(f'{key}={value}' for key, value in query.items())
+            headers['Link'] = f'<{next_url}>; rel="next"'
+        return 200, [render(item) for item in items[(page - 1) * per_page:page * per_page]], headers
+
+
+class GitLabStandIn(StandInServer):
+    """Groups 1..orgs hold the projects 1..repos, which hold the MRs 1..ccs."""
+
+    def _project(self, repo):
+        org = repo % self.dataset.orgs
+        return {'id': repo + 1, 'name': self.dataset.repo_name(repo), 'namespace': {'id': org + 1},
+                'path_with_namespace': f'{self.dataset.org_name(org)}/{self.dataset.repo_name(repo)}'}
+
+    def _mr(self, cc):
+        repo = cc % self.dataset.repos
+        return {
+            'id': cc + 1, 'iid': cc + 1, 'project_id': repo + 1, 'title': f'Change {cc}',
+            'state': 'opened' if self.dataset.is_open(cc) else 'closed',
+            'updated_at': _iso(self.dataset.updated_at(cc), milliseconds=True),
+            'author': {'name': self.dataset.contributor(cc), 'username': self.dataset.contributor(cc)},
+            'web_url': f'{self.url}/{self._project(repo)["path_with_namespace"]}/-/merge_requests/{cc + 1}',
+        }
+
+    def _mrs(self, handler, repos, query):
+        ccs = self.dataset.latest_first(cc for repo in repos for cc in self.dataset.repo_ccs(repo))
+        if query.get('state', 'all') == 'opened':
+            ccs = [cc for cc in ccs if self.dataset.is_open(cc)]
+        if 'updated_after' in query:
+            updated_after = _parse_iso(query['updated_after'])
+            ccs = [cc for cc in ccs if self.dataset.updated_at(cc) >= updated_after]
+        return self.page(handler, ccs, self._mr, query, 20)
+
+    def _org(self, value):
+        org = int(value) - 1 if value.isdigit() else -1
+        if not 0 <= org < self.dataset.orgs:
+            raise _Stop
+        return org
+
+    def _repo(self, value):
+        repo = int(value) - 1
+        if not 0 <= repo < self.dataset.repos:
+            raise _Stop
+        return repo
+
+    def route(self, handler, method, path, query, body):
+        parts = path.strip('/').split('/')
+        if parts[:2] != ['api', 'v4'] or method != 'GET':
+            raise _Stop
+        parts = parts[2:]
+        if parts == ['users']:
+            return 200, [], {}
+        if parts[0] == 'groups' and len(parts) == 2:
+            org = self._org(parts[1])
+            return 200, {'id': org + 1, 'name': self.dataset.org_name(org), 'full_path': self.dataset.org_name(org)}, {}
+        if parts[0] == 'groups' and parts[2:] == ['projects']:
+            return self.page(handler, self.dataset.org_repos(self._org(parts[1])), self._project, query, 20)
+        if parts[0] == 'groups' and parts[2:] == ['merge_requests']:
+            return self._mrs(handler, self.dataset.org_repos(self._org(parts[1])), query)
+        if parts[0] == 'projects' and len(parts) == 2:
+            return 200, self._project(self._repo(parts[1])), {}
+        if parts[0] == 'projects' and parts[2:] == ['merge_requests']:
+            return self._mrs(handler, [self._repo(parts[1])], query)
+        raise _Stop
+
+
+class GitHubStandIn(StandInServer):
+    """A GitHub Enterprise like server, its REST API under /api/v3 and its GraphQL one at /api/graphql."""
+
+    def _owner(self, org):
+        return {'login': self.dataset.org_name(org), 'type': 'Organization',
+                'url': f'{self.url}/api/v3/orgs/{self.dataset.org_name(org)}'}
+
+    def _repository(self, repo):
+        org = repo % self.dataset.orgs
+        full_name = f'{self.dataset.org_name(org)}/{self.dataset.repo_name(repo)}'
+        return {'id': repo + 1, 'name': self.dataset.repo_name(repo), 'full_name': full_name,
+                'owner': self._owner(org), 'url': f'{self.url}/api/v3/repos/{full_name}'}
+
+    def _html_url(self, cc):
+        return f'{self.url}/{self._repository(cc % self.dataset.repos)["full_name"]}/pull/{cc + 1}'
+
+    def _pull(self, cc):
+        login = self.dataset.contributor(cc)
+        return {
+            'id': cc + 1, 'number': cc + 1, 'title': f'Change {cc}',
+            'state': 'open' if self.dataset.is_open(cc) else 'closed',
+            'updated_at': _iso(self.dataset.updated_at(cc)), 'html_url': self._html_url(cc),
+            'url': f'{self._repository(cc % self.dataset.repos)["url"]}/pulls/{cc + 1}',
+            'user': {'login': login, 'url': f'{self.url}/api/v3/users/{login}'},
+            'base': {'ref': 'master', 'repo': self._repository(cc % self.dataset.repos)},
+        }
+
+    def _node(self, cc):
+        login = self.dataset.contributor(cc)
+        return {'title': f'Change {cc}', 'url': self._html_url(cc),
+                'state': 'OPEN' if self.dataset.is_open(cc) else 'CLOSED',
+                'updatedAt': _iso(self.dataset.updated_at(cc)),
+                'repository': {'name': self.dataset.repo_name(cc % self.dataset.repos)},
+                'author': {'login': login, 'name': login.replace('-', ' ').title()}}
+
+    def _org(self, name):
+        org = self.dataset.org_index(name)
+        if org is None or org >= self.dataset.orgs:
+            raise _Stop
+        return org
+
+    def _repo(self, org_name, name):
+        repo = self.dataset.repo_index(name)
+        if repo is None or repo >= self.dataset.repos or repo % self.dataset.orgs != self._org(org_name):
+            raise _Stop
+        return repo
+
+    def _search(self, variables):
+        terms = dict(term.split(':', 1) for term in variables['query'].split() if ':' in term)
+        ccs = (cc for repo in self.dataset.org_repos(self._org(terms['org'])) for cc in self.dataset.repo_ccs(repo))
+        ccs = self.dataset.latest_first(ccs)
+        if terms.get('is') == 'open':
+            ccs = [cc for cc in ccs if self.dataset.is_open(cc)]
+        if 'updated' in terms:
+            updated_after = _parse_iso(terms['updated'].lstrip('>='))
+            ccs = [cc for cc in ccs if self.dataset.updated_at(cc) >= updated_after]
+        start = int(variables.get('cursor') or 0)
+        end = start + 100
+        return {'data': {'search': {
+            'issueCount': len(ccs),
+            'pageInfo': {'hasNextPage': end < len(ccs), 'endCursor': str(end)},
+            'nodes': [self._node(cc) for cc in ccs[start:end]],
+        }}}
+
+    def route(self, handler, method, path, query, body):
+        parts = path.strip('/').split('/')
+        if method == 'POST' and parts == ['api', 'graphql']:
+            return 200, self._search(body['variables']), {}
+        if parts[:2] != ['api', 'v3'] or method != 'GET':
+            raise _Stop
+        parts = parts[2:]
+        if parts == ['user']:
+            return 200, {'login': 'benchmark', 'url': f'{self.url}/api/v3/user'}, {}
+        if parts[0] == 'users' and len(parts) == 2:
+            return 200, {'login': parts[1], 'name': parts[1].replace('-', ' ').title()}, {}
+        if parts[0] == 'orgs' and len(parts) == 2:
+            return 200, self._owner(self._org(parts[1])), {}
+        if parts[0] == 'orgs' and parts[2:] == ['repos']:
+            return self.page(handler, self.dataset.org_repos(self._org(parts[1])), self._repository, query, 30)
+        if parts[0] == 'repos' and len(parts) == 3:
+            return 200, self._repository(self._repo(parts[1], parts[2])), {}
+        if parts[0] == 'repos' and parts[3:] == ['pulls']:
+            ccs = self.dataset.latest_first(self.dataset.repo_ccs(self._repo(parts[1], parts[2])))
+            if query.get('state', 'open') == 'open':
+                ccs = [cc for cc in ccs if self.dataset.is_open(cc)]
+            return self.page(handler, ccs, self._pull, query, 30)
+        raise _Stop
+
+
+def serve(dataset, latency, queue):
+    """Serves the GitLab and GitHub stand-ins until terminated, sending their URLs through the queue."""
+    servers = [GitLabStandIn(dataset, latency), GitHubStandIn(dataset, latency)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    queue.put([server.url for server in servers])
+    threading.Event().wait()
+
+
+def fake_ssh(args):
+    """Answers 'gerrit query' like the Gerrit ssh command does, out of the dataset in BATYAM_BENCH_GERRIT."""
+    settings = json.loads(os.environ['BATYAM_BENCH_GERRIT'])
+    if '-O' in args:  # closing the multiplexed connection
+        return
+    with open(settings['calls'], 'a') as calls:
+        calls.write('\n')
+    time.sleep(settings['latency'])
+    dataset = Dataset(settings['orgs'], settings['repos'], settings['ccs'])
+    start = int(args[args.index('--start') + 1])
+    limit = int(next(arg for arg in args if arg.startswith('limit:'))[len('limit:'):])
+    projects = {arg.strip('()')[len('project:'):] for arg in ' '.join(args).split() if arg.strip('()')
+                .startswith('project:')}
+    repos = sorted(filter(lambda repo: repo is not None and repo < dataset.repos, map(dataset.repo_index, projects)))
+    ccs = dataset.latest_first(cc for repo in repos for cc in dataset.repo_ccs(repo))
+    age = next((arg for arg in args if arg.startswith('-age:')), None)
+    if age:
+        updated_after = time.time() - int(age[len('-age:'):-1])
+        ccs = [cc for cc in ccs if dataset.updated_at(cc) >= updated_after]
+    else:
+        ccs = [cc for cc in ccs if dataset.is_open(cc)]
+    out = sys.stdout
+    for cc in ccs[start:start + limit]:
+        repo = cc % dataset.repos
+        out.write(json.dumps({
+            'project': dataset.repo_name(repo), 'branch': 'master', 'number': cc + 1, 'subject': f'Change {cc}',
+            'owner': {'name': dataset.contributor(cc)}, 'url': f'https://gerrit.benchmark/c/{cc + 1}',
+            'status': 'NEW' if dataset.is_open(cc) else 'ABANDONED', 'lastUpdated': int(dataset.updated_at(cc)),
+        }) + '\n')
+    shown = len(ccs[start:start + limit])
+    out.write(json.dumps({'type': 'stats', 'rowCount': shown, 'moreChanges': start + shown < len(ccs)}) + '\n')
+
+
+def install_fake_ssh(directory, dataset, latency):
+    """Puts a fake 'ssh' first on the PATH, returning the file its calls are counted in."""
+    calls = os.path.join(directory, 'gerrit-calls')
+    open(calls, 'w').close()
+    ssh = os.path.join(directory, 'ssh')
+    with open(ssh, 'w') as script:
+        script.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" --fake-ssh "$@"\n')
+    os.chmod(ssh, 0o755)
+    identity = os.path.join(directory, 'identity')
+    open(identity, 'w').close()
+    os.environ.update({
+        'PATH': directory + os.pathsep + os.environ.get('PATH', ''),
+        'GERRIT_IDENTITY_FILE': identity,
+        'BATYAM_BENCH_GERRIT': json.dumps({'orgs': dataset.orgs, 'repos': dataset.repos, 'ccs': dataset.ccs,
+                                           'latency': latency, 'calls': calls}),
+    })
+    return calls
+
+
+def team_config(dataset, vendors, urls, listed):
+    """Returns a team pulling all the stand-ins' orgs, every repository or each one listed by name."""
+    repositories = [dataset.repo_name(repo) for repo in range(dataset.repos)] if listed else ['*']
+    orgs = [dataset.org_name(org) for org in range(dataset.orgs)]
+    servers = {
+        'gitlab': {'vendor': 'GitLab', 'host': urls[0], 'namespaces': list(range(1, dataset.orgs + 1)),
+                   'repositories': repositories},
+        'github': {'vendor': 'GitHub', 'host': urls[1], 'namespaces': orgs, 'repositories': repositories},
+        # Gerrit's projects are always listed, under 'repositories'
+        'gerrit': {'vendor': 'Gerrit', 'host': 'gerrit.benchmark', 'bot_users': [BOT_USER],
+                   'repositories': [dataset.repo_name(repo) for repo in range(dataset.repos)]},
+    }
+    return {'name': 'benchmark', 'recipients': [], 'servers': [servers[vendor] for vendor in vendors]}
+
+
+def run(config, workers, use_asyncio, metrics_path=None):
+    """Creates and pulls the servers as app.main() does, returning the number of rows of each team's report."""
+    import app
+    import base
+    import metrics
+    import planner
+
+    base.metadata_cache = base.MetadataCache()
+    metrics.run_metrics = metrics.RunMetrics(summary_path=metrics_path, slow_call=None)
+    plan = planner.RunPlan(config['teams'])
+    if use_asyncio:
+        import async_base
+        servers = plan.create_servers(async_base.create_servers_from_dictionary)
+    else:
+        servers = plan.create_servers(app.create_servers_from_dictionary)
+    team_rows = {team['name']: len(rows)
+                 for team, rows in app.pull_teams(plan, servers, workers, use_asyncio=use_asyncio)}
+    metrics.run_metrics.export()
+    return [team_rows[team['name']] for team in plan.teams]
+
+
+def api_calls(url):
+    import requests
+    return requests.get(f'{url}/_stats').json()['calls']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--vendors', default=','.join(VENDORS), help='comma separated stand-ins to pull')
+    parser.add_argument('--orgs', type=int, default=1, help='orgs (groups) per stand-in')
+    parser.add_argument('--repos', type=int, default=100, help='repositories per stand-in')
+    parser.add_argument('--ccs', type=int, default=1000, help='CC per stand-in, about 10%% of them closed')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to every API call')
+    parser.add_argument('--workers', type=int, default=1, help="the config's 'workers'")
+    parser.add_argument('--listed', action='store_true', help='list every repository instead of using "*"')
+    parser.add_argument('--asyncio', action='store_true', help='pull with the asyncio variant of the servers')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--metrics', help="write the run's metrics summary (calls per phase and server) there")
+    args = parser.parse_args()
+    vendors = [vendor.strip().casefold() for vendor in args.vendors.split(',')]
+    unknown = set(vendors) - set(VENDORS)
+    if unknown:
+        parser.error(f"unknown vendors: {', '.join(sorted(unknown))}")
+
+    dataset = Dataset(args.orgs, args.repos, args.ccs)
+    latency = args.latency / 1000
+    queue = multiprocessing.Queue()
+    stand_ins = multiprocessing.Process(target=serve, args=(dataset, latency, queue), daemon=True)
+    stand_ins.start()
+    directory = tempfile.mkdtemp(prefix='batyam-benchmark-')
+    try:
+        urls = queue.get(timeout=30)
+        gerrit_calls = install_fake_ssh(directory, dataset, latency)
+        os.environ.setdefault('GITLAB_TOKEN', 'benchmark')
+        os.environ.setdefault('GITHUB_TOKEN', 'benchmark')
+        config = {'teams': [team_config(dataset, vendors, urls, args.listed)]}
+        memory_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        rows = run(config, args.workers, args.asyncio, args.metrics)
+        elapsed = time.perf_counter() - start
+        with open(gerrit_calls) as calls:
+            calls = {'gitlab': api_calls(urls[0]), 'github': api_calls(urls[1]), 'gerrit': len(calls.read())}
+    finally:
+        stand_ins.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    results = {
+        'vendors': vendors, 'orgs': args.orgs, 'repos': args.repos, 'ccs': args.ccs, 'latency_ms': args.latency,
+        'workers': args.workers, 'listed': args.listed, 'asyncio': args.asyncio, 'rows': sum(rows),
+        'wall_time_s': round(elapsed, 3),
+        'api_calls': {vendor: calls[vendor] for vendor in vendors},
+        # ru_maxrss is in KB on Linux; the stand-ins run in their own processes
+        'peak_memory_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_memory_before_run_mb': round(memory_before / 1024, 1),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{', '.join(vendors)}: {args.orgs} orgs, {args.repos} repos, {args.ccs} CC per server, "
+          f"{args.latency:g} ms latency, {args.workers} workers{', asyncio' if args.asyncio else ''}")
+    print(f"{'rows':>14} {results['rows']}")
+    print(f"{'wall time':>14} {results['wall_time_s']:.3f} s")
+    for vendor in vendors:
+        print(f"{vendor + ' calls':>14} {calls[vendor]}")
+    print(f"{'peak memory':>14} {results['peak_memory_mb']:.1f} MB "
+          f"({results['peak_memory_before_run_mb']:.1f} MB before the run)")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--fake-ssh']:
+        fake_ssh(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Startup budget check: importing the run's modules should be fast, and load none of the heavy dependencies.
+
+Each module is imported in a fresh interpreter, which reports how long the import took and which of the heavy
+dependencies it loaded; with Python 3.7+ (-X importtime) the slowest imports are listed as well. Exits with 1 when
+a module goes over the budget or loads a heavy dependency, so it can run in CI:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --budget 0.5 --modules app,base --slowest 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ['app']
+# only imported once a run needs them: the Google API to publish the reports on Sheets, PyGithub / python-gitlab
+# for GitHub / GitLab servers, Django to store the CC and aiohttp for the asyncio collection
+HEAVY_MODULES = ['googleapiclient', 'google.oauth2', 'jinja2', 'github', 'gitlab', 'django', 'aiohttp']
+DEFAULT_BUDGET = 1.0  # seconds
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def parse_importtime(stderr):
+    """Returns the (cumulative seconds, module) of each import logged by -X importtime."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((int(cumulative) / 1e6, module.strip()))
+    return imports
+
+
+def measure(module):
+    """Imports the module in a fresh interpreter, returning how long it took, the heavy modules and all its imports."""
+    code = CHILD.format(module=module, heavy=HEAVY_MODULES)
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode:
+        raise RuntimeError(f'importing {module} failed:\n{process.stderr}')
+    result = json.loads(process.stdout.splitlines()[-1])
+    return result['seconds'], result['loaded'], parse_importtime(process.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--modules', default=','.join(MODULES), help='comma separated modules to import')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='seconds each import may take')
+    parser.add_argument('--slowest', type=int, default=10, help='slowest imports to list (Python 3.7+)')
+    args = parser.parse_args()
+
+    failed = False
+    for module in [module.strip() for module in args.modules.split(',')]:
+        seconds, loaded, imports = measure(module)
+        over_budget = seconds > args.budget
+        failed = failed or over_budget or bool(loaded)
+        print(f"import {module}: {seconds:.3f}s (budget {args.budget:.3f}s){' OVER BUDGET' if over_budget else ''}")
+        if loaded:
+            print(f"  loaded heavy modules: {', '.join(loaded)}")
+        # a module's cumulative time includes the imports it made
+        for cumulative, name in sorted(imports, reverse=True)[:args.slowest]:
+            print(f'  {cumulative:.3f}s {name}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Replays a recorded 'gerrit stream-events' stream through the Gerrit events consumer, into a scratch database.
+
+A fake 'ssh' is put first on the PATH: each stream-events session replays the next events of the recording and
+then drops the connection, losing the events which follow it, which the consumer must recover with its catch-up
+'gerrit query' (answered out of the lost events). The stored CC are then checked against those the recording
+leaves each team with, exiting with 1 on any difference:
+
+    python benchmarks/stream_events.py
+    python benchmarks/stream_events.py --drop-after 5 --lose 3 --json
+
+Run it from the repository root, no .env is needed.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EVENTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gerrit-stream-events.jsonl')
+HOST = 'review.example.com'
+TEAMS = [
+    {'name': 'batyam', 'servers': [{'vendor': 'Gerrit', 'host': HOST, 'repositories': ['batyam', 'batyam-docs'],
+                                    'bot_users': ['ci-bot']}]},
+    {'name': 'docs', 'servers': [{'vendor': 'Gerrit', 'host': HOST, 'repositories': ['batyam-docs'],
+                                  'bot_users': ['ci-bot', 'docs-bot']}]},
+]
+STATUS = {'change-merged': 'MERGED', 'change-abandoned': 'ABANDONED'}
+IDLE_TIMEOUT = 5  # seconds the last session waits for the consumer to be stopped
+
+
+def read_events(path=EVENTS):
+    with open(path) as events:
+        return [json.loads(line) for line in events if line.strip()]
+
+
+def event_patch(event):
+    change = event['change']
+    return dict(change, status=STATUS.get(event['type'], change.get('status')), lastUpdated=event['eventCreatedOn'])
+
+
+def write_state(path, state):
+    with open(path + '.tmp', 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(path + '.tmp', path)  # the state is read concurrently
+
+
+def fake_ssh(args):
+    """Answers 'gerrit stream-events' and 'gerrit query' out of the recording, as set in BATYAM_BENCH_STREAM."""
+    settings = json.loads(os.environ['BATYAM_BENCH_STREAM'])
+    if '-O' in args:  # closing the multiplexed connection
+        return
+    with open(settings['state']) as state_file:
+        state = json.load(state_file)
+    events = read_events(settings['events'])
+    out = sys.stdout
+
+    if 'query' in args:
+        # the latest state of the lost changes, in the queried projects
+        projects = {arg.strip('()')[len('project:'):] for arg in ' '.join(args).split()
+                    if arg.strip('()').startswith('project:')}
+        patches = {}
+        for position in state['lost']:
+            if events[position].get('change') and events[position]['project'] in projects:
+                patch = event_patch(events[position])
+                patches[patch['url']] = patch
+        for patch in patches.values():
+            out.write(json.dumps(patch) + '\n')
+        out.write(json.dumps({'type': 'stats', 'rowCount': len(patches), 'moreChanges': False}) + '\n')
+        with open(settings['queries'], 'a') as queries:
+            queries.write('\n')
+        return
+
+    subscribed = {args[i + 1] for i, arg in enumerate(args) if arg == '-s'}
+    start = state['position']
+    state['sessions'] += 1
+    if start >= len(events):
+        state['done'] = True
+        write_state(settings['state'], state)
+        time.sleep(IDLE_TIMEOUT)  # an idle stream, until the consumer is stopped
+        return
+    for event in events[start:start + settings['drop_after']]:
+        if not subscribed or event['type'] in subscribed:
+            out.write(json.dumps(event) + '\n')
+            state['streamed'] += 1
+    lost = range(start + settings['drop_after'], min(start + settings['drop_after'] + settings['lose'],
+                                                     len(events)))
+    state['lost'].extend(lost)
+    state['position'] = start + settings['drop_after'] + settings['lose']
+    out.flush()
+    write_state(settings['state'], state)
+
+
+def install_fake_ssh(directory, drop_after, lose):
+    """Puts a fake 'ssh' first on the PATH, returning the files its state and queries are kept in."""
+    state, queries = os.path.join(directory, 'stream-state.json'), os.path.join(directory, 'queries')
+    write_state(state, {'position': 0, 'lost': [], 'sessions': 0, 'streamed': 0, 'done': False})
+    open(queries, 'w').close()
+    ssh = os.path.join(directory, 'ssh')
+    with open(ssh, 'w') as script:
+        script.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" --fake-ssh "$@"\n')
+    os.chmod(ssh, 0o755)
+    identity = os.path.join(directory, 'identity')
+    open(identity, 'w').close()
+    os.environ.update({
+        'PATH': directory + os.pathsep + os.environ.get('PATH', ''),
+        'GERRIT_IDENTITY_FILE': identity,
+        'BATYAM_BENCH_STREAM': json.dumps({'events': EVENTS, 'state': state, 'queries': queries,
+                                           'drop_after': drop_after, 'lose': lose}),
+    })
+    return state, queries
+
+
+def expected_ccs(events):
+    """Returns the (team, url) -> (state, title, last updated) the recording leaves the teams with."""
+    expected = {}
+    for event in events:
+        if event['type'] not in STATUS and event['type'] not in ('patchset-created', 'comment-added'):
+            continue
+        patch = event_patch(event)
+        for team in TEAMS:
+            server = team['servers'][0]
+            if patch['project'] in server['repositories'] and patch['owner']['name'] not in server['bot_users']:
+                expected[(team['name'], patch['url'])] = (
+                    'OP' if patch['status'] == 'NEW' else 'CD', patch['subject'],
+                    datetime.fromtimestamp(patch['lastUpdated'], timezone.utc))
+    return expected
+
+
+def stored_ccs():
+    from database.models import CodeContribution
+    return {(cc.team, cc.url): (cc.state, cc.title, cc.last_updated) for cc in CodeContribution.objects.all()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--drop-after', type=int, default=8, help='events each session streams before dropping')
+    parser.add_argument('--lose', type=int, default=2, help='events lost after each dropped session')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if not args.json else logging.WARNING, format='%(message)s')
+
+    directory = tempfile.mkdtemp(prefix='batyam-stream-')
+    try:
+        state_path, queries_path = install_fake_ssh(directory, args.drop_after, args.lose)
+        import django_store
+        import gerrit_stream
+        from django.conf import settings
+        from django.core.management import call_command
+
+        store = django_store.DjangoStore()
+        settings.DATABASES['default']['NAME'] = os.path.join(directory, 'db.sqlite3')
+        call_command('migrate', verbosity=0)
+        consumers = gerrit_stream.create_consumers(
+            {'teams': TEAMS, 'gerrit_stream': {'overlap': 60, 'max_backoff': 0.1}}, store)
+        consumer = consumers[0]
+        thread = threading.Thread(target=consumer.run, daemon=True)
+        start = time.perf_counter()
+        thread.start()
+        while True:
+            with open(state_path) as state_file:
+                state = json.load(state_file)
+            if state['done']:
+                break
+            time.sleep(0.05)
+        consumer.stop()
+        thread.join()
+        elapsed = time.perf_counter() - start
+        consumer.server.close()
+        with open(queries_path) as queries:
+            catch_up_queries = len(queries.readlines())
+
+        expected, stored = expected_ccs(read_events()), stored_ccs()
+        differences = sorted(f'{key}: expected {expected.get(key)}, stored {stored.get(key)}'
+                             for key in set(expected) | set(stored) if expected.get(key) != stored.get(key))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    results = {
+        'recorded_events': len(read_events()), 'streamed_events': state['streamed'], 'lost_events': len(state['lost']),
+        'handled_events': consumer.events, 'sessions': state['sessions'], 'catch_up_queries': catch_up_queries,
+        'stored_ccs': len(stored), 'differences': len(differences), 'wall_time_s': round(elapsed, 3),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, value in results.items():
+            print(f'{name:>16} {value}')
+        for difference in differences:
+            print(difference)
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--fake-ssh']:
+        fake_ssh(sys.argv[2:])
+    else:
+        main()
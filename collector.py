@@ -0,0 +1,71 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import ratelimit
+
+DEFAULT_SERVER_WORKERS = 4
+
+
+def pull_source(server, source, sync_store=None):
+    """Returns the report rows of a server's source, only pulling what changed since the last run given a sync store."""
+    with ratelimit.charge_to(server.source_key(source)), \
+            metrics.tagged(phase='list', server=server.name, host=server.host,
+                           namespace=server.source_namespace(source)):
+        if sync_store:
+            return sync_store.pull(server, source)
+        return [server.cc_to_dict(cc) for cc in server.get_source_ccs(source)]
+
+
+def resolve_sources(server):
+    with metrics.tagged(phase='list', server=server.name, host=server.host):
+        return server.get_sources()
+
+
+def collect_sequentially(servers, sync_store=None):
+    """Pulls the CC of each server one after another and yields them, per source, as (server, source, rows)."""
+    for server in servers:
+        for source in resolve_sources(server):
+            yield server, source, pull_source(server, source, sync_store)
+
+
+def collect_concurrently(servers, workers, server_workers=DEFAULT_SERVER_WORKERS, sync_store=None):
+    """Pulls the CC of the servers' sources (projects, repos...) in parallel and yields them as (server, source, rows).
+
+    Each server gets its own thread pool, sized by its 'workers' setting (or server_workers), while a
+    shared semaphore caps the number of sources being pulled at once to 'workers' overall.
+    Sources are yielded in the exact order a sequential run would produce them.
+    """
+
+    limiter = threading.BoundedSemaphore(workers)
+    executors = [ThreadPoolExecutor(max_workers=server.workers or server_workers) for server in servers]
+
+    def limited(func, *args):
+        with limiter:
+            return func(*args)
+
+    planned, pulled = [], []
+    try:
+        # resolving the sources is a network round-trip too, so do it for all the servers at once
+        planned.extend(executor.submit(limited, resolve_sources, server)
+                       for server, executor in zip(servers, executors))
+        for server, executor, sources in zip(servers, executors, planned):
+            sources = sources.result()
+            logging.info(f"Pulling {len(sources)} sources from {server.name} ({server.host}).")
+            pulled.extend((server, source, executor.submit(limited, pull_source, server, source, sync_store))
+                          for source in sources)
+        for server, source, rows in pulled:
+            yield server, source, rows.result()
+    finally:
+        for future in planned + [rows for _, _, rows in pulled]:
+            future.cancel()  # no-op for finished ones, drops the pending ones if we stopped early
+        for executor in executors:
+            executor.shutdown(wait=False)
+
+
+def collect_sources(servers, workers=None, sync_store=None):
+    """Yields the (server, source, rows) of the given servers, concurrently when more than a worker is allowed."""
+    if workers and workers > 1:
+        return collect_concurrently(servers, workers, sync_store=sync_store)
+    return collect_sequentially(servers, sync_store)
@@ -0,0 +1,35 @@
+import logging
+import os
+import sys
+
+import metrics
+
+DJANGO_PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batyam')
+DEFAULT_SETTINGS = 'batyam_webapp.settings'
+
+
+class DjangoStore:
+    """Loads the collected CC into the batyam Django app's database (see batyam/database/ingestion.py).
+
+    Django is only imported and set up once a store is created, as the report itself doesn't need it.
+    """
+
+    def __init__(self, settings=DEFAULT_SETTINGS):
+        if DJANGO_PROJECT_DIR not in sys.path:
+            sys.path.append(DJANGO_PROJECT_DIR)
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings)
+        import django
+        django.setup()
+        from database import ingestion
+        self._ingestion = ingestion
+
+    def ingest(self, team, rows, scopes=None):
+        """Upserts a team's collected rows, in a single transaction, closing the missing CC of the pulled scopes."""
+        with metrics.run_metrics.timed('ingest', phase='store', server='Django', team=team):
+            created, updated, closed = self._ingestion.ingest(team, rows, scopes)
+        logging.info(f"Stored the CC of {team}: {created} new, {updated} updated, {closed} closed.")
+
+    def upsert(self, team, row):
+        """Creates or updates a single CC of the team, e.g out of an event; returns the number created and updated."""
+        with metrics.run_metrics.timed('upsert', phase='store', server='Django', team=team):
+            return self._ingestion.upsert(team, row)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Keeps the stored CC of the configured Gerrit servers current, out of their 'gerrit stream-events'.
+
+A long-running alternative to polling Gerrit: it reads the same configuration (and .env) as app.py, with the
+'database' settings set, and holds a single stream-events SSH session per Gerrit host until it's stopped.
+"""
+import logging
+import os
+import threading
+from subprocess import DEVNULL, PIPE, Popen
+from time import time
+
+from dotenv import load_dotenv
+
+import app
+import base
+import metrics
+import planner
+
+EVENT_TYPES = ['patchset-created', 'change-merged', 'change-abandoned', 'comment-added']
+# the change's status isn't always part of its events
+EVENT_STATUS = {'change-merged': 'MERGED', 'change-abandoned': 'ABANDONED'}
+DEFAULT_OVERLAP = 60  # seconds
+DEFAULT_MAX_BACKOFF = 300  # seconds
+
+
+class GerritStreamConsumer:
+    """Holds a 'gerrit stream-events' session to a Gerrit host, upserting the changes of its events in the store.
+
+    The events are those of the server's repositories, and they are dropped for the changes owned by bot users;
+    each is stored for the teams which asked for its change (see planner.RunPlan.teams_wanting). When the session
+    ends it's reopened, backing off up to max_backoff seconds while it keeps failing, and the changes updated
+    since it ended (from 'overlap' seconds before) are pulled by a catch-up query, as their events were missed.
+    """
+
+    def __init__(self, server, plan, store, overlap=DEFAULT_OVERLAP, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.server = server
+        self.plan = plan
+        self.store = store
+        self.overlap = overlap
+        self.max_backoff = max_backoff
+        self.disconnected_at = None
+        self.events = self.stored = 0
+        self._stopped = threading.Event()
+        self._stream = None
+
+    def stream_command(self):
+        """Returns the SSH command streaming the host's events of the handled types."""
+        subscriptions = [option for event_type in EVENT_TYPES for option in ('-s', event_type)]
+        return self.server.ssh_command + ['-i', os.getenv("GERRIT_IDENTITY_FILE"), 'gerrit', 'stream-events',
+                                          *subscriptions]
+
+    def event_to_patch(self, event):
+        """Returns the change of a handled event, as the patch a query would return, or None."""
+        change = event.get('change')
+        if event.get('type') not in EVENT_TYPES or not change:
+            return None
+        return dict(change, status=EVENT_STATUS.get(event['type'], change.get('status') or 'NEW'),
+                    lastUpdated=event.get('eventCreatedOn') or int(time()))
+
+    def store_patch(self, patch):
+        """Stores the patch's CC for the teams which asked for it, returning how many did."""
+        projects = set(self.server.namespaces or [])
+        if patch.get('project') not in projects and '*' not in projects:
+            return 0
+        row = self.server.cc_to_dict(patch)
+        teams = self.plan.teams_wanting(self.server, (patch.get('project'),), row)
+        for team in teams:
+            self.store.upsert(team.get('name'), row)
+        self.stored += len(teams)
+        return len(teams)
+
+    def catch_up(self, updated_after):
+        """Stores the changes of the server's repositories updated since then, returning how many there were."""
+        patches = 0
+        with metrics.tagged(phase='catch-up', server=self.server.name, host=self.server.host):
+            for source in self.server.get_sources():
+                for patch in self.server.get_source_ccs(source, updated_after=updated_after):
+                    self.store_patch(patch)
+                    patches += 1
+        logging.info(f"Gerrit {self.server.host}: caught up with {patches} changes updated while disconnected.")
+        return patches
+
+    def session(self):
+        """Streams the host's events until the session ends, catching up first with what a previous one missed."""
+        with Popen(self.stream_command(), stdout=PIPE, stdin=DEVNULL) as self._stream:
+            logging.info(f"Gerrit {self.server.host}: streaming events.")
+            if self.disconnected_at:
+                # the events of the meantime are buffered in the stream until they're read
+                self.catch_up(self.disconnected_at - self.overlap)
+            for line in self._stream.stdout:
+                try:
+                    event = base.json_loads(line)
+                except ValueError:
+                    logging.warning(f"Gerrit {self.server.host}: skipped an unreadable event: {line[:200]!r}.")
+                    continue
+                patch = self.event_to_patch(event)
+                if patch and not self.server.is_bot_patch(patch):
+                    self.events += 1
+                    self.store_patch(patch)
+        self.disconnected_at = time()
+        if not self._stopped.is_set():
+            logging.warning(f"Gerrit {self.server.host}: the events stream ended ({self._stream.returncode}).")
+
+    def run(self):
+        """Streams the host's events until stop() is called, reconnecting whenever the session ends."""
+        backoff = initial_backoff = min(1, self.max_backoff)
+        while not self._stopped.is_set():
+            started = time()
+            try:
+                self.session()
+            except Exception as e:
+                self.disconnected_at = self.disconnected_at or time()
+                logging.exception(f"Gerrit {self.server.host}: the events stream failed: {e}.")
+            if time() - started > self.max_backoff:
+                backoff = initial_backoff  # the session was up for a while, it's a new failure
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def stop(self):
+        self._stopped.set()
+        if self._stream and self._stream.poll() is None:
+            self._stream.terminate()
+
+
+def create_consumers(config, store):
+    """creates a consumer per configured Gerrit host, along with the run plan of the teams they store the CC for."""
+    plan = planner.RunPlan(config.get('teams'))
+    stream_config = config.get('gerrit_stream') or {}
+    servers = plan.create_servers(lambda team: app.create_servers_from_dictionary(
+        {'servers': [server for server in team.get('servers') if server.get('vendor').casefold() == 'gerrit']}))
+    return [GerritStreamConsumer(server, plan, store, stream_config.get('overlap', DEFAULT_OVERLAP),
+                                 stream_config.get('max_backoff', DEFAULT_MAX_BACKOFF)) for server in servers]
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(filename='gerrit_stream.log',
+                        level=logging.INFO,
+                        format="%(asctime)s; %(threadName)s; %(levelname)s: %(message)s",
+                        datefmt='%d/%m/%Y %H:%M:%S',
+                        )
+    config = app.get_configuration()
+    database_config = config.get('database') or {}
+    if not database_config.get('settings'):
+        raise SystemExit("The Gerrit events are stored in the database, set the 'database' settings.")
+    import django_store
+
+    consumers = create_consumers(config, django_store.DjangoStore(database_config['settings']))
+    threads = [threading.Thread(target=consumer.run, name=consumer.server.host, daemon=True)
+               for consumer in consumers]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        for consumer in consumers:
+            consumer.stop()
+    finally:
+        for consumer in consumers:
+            consumer.server.close()
+
+
+if __name__ == '__main__':
+    main()
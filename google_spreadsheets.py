@@ -1,16 +1,24 @@
 import json
 import os
-import tempfile
+import threading
 from datetime import datetime
 
-import numpy as np
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from jinja2 import FileSystemLoader, Environment
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+
+# the credentials and services are only loaded once a report is published, and reused for the next ones
+_credentials = None
+_services = {}
+_lock = threading.Lock()
 
 
 def generate_and_load_credentials():
-    """Generates a json credentials file for Google API using .env and a jinja2 template files."""
+    """Generates the Google API credentials from .env, using a jinja2 template file."""
+    from google.oauth2 import service_account
+    from jinja2 import FileSystemLoader, Environment
+
     file_loader = FileSystemLoader('templates')
     env = Environment(loader=file_loader)
     template = env.get_template('.json.j2')
@@ -18,48 +26,75 @@ def generate_and_load_credentials():
         private_key_id=os.getenv('GOOGLE_PRIVATE_KEY_ID'),
         private_key=os.getenv('GOOGLE_PRIVATE_KEY')
     )
-    with tempfile.TemporaryDirectory(dir=os.getcwd()) as temp_dir:
-        json_file_dir = os.path.join(temp_dir, 'google_creds.json')
-        with open(json_file_dir, 'w') as jsonfile:
-            json.dump(json.loads(output), jsonfile, separators=(',', ':'))
-        return service_account.Credentials.from_service_account_file(json_file_dir)
-
-
-credentials = generate_and_load_credentials()
-scopes = credentials.with_scopes(
-    [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive",
-    ]
-)
-
-
-def create_spreadsheet(title, data):
-    """creates a spreadsheet instance, populate it with the df values and returns it."""
-    sheets_service = build("sheets", "v4", credentials=credentials)
-    sheets = sheets_service.spreadsheets()
-    body_content = {"properties": {"title": f"{title} - {datetime.now().date().strftime('%d/%m/%y')}"},
-                    "sheets": list(map(lambda d: {"properties": {"title": d.get("title")}}, data))}
-    res = sheets.create(body=body_content).execute()
-    spreadsheet_id = res.get("spreadsheetId")
-
-    def df_to_sheet(df_cc):
-        """convert the DF into a matrix of the columns and values."""
-        df_columns = [np.array(df_cc.columns)]
-        df_values = df_cc.values.tolist()
-        return np.concatenate((df_columns, df_values)).tolist()
-
-    update_body = {
-        "valueInputOption": "RAW",
-        "data": list(map(lambda d: {"range": d.get("title"), "values": df_to_sheet(d.get("df"))}, data))
-    }
-    sheets.values().batchUpdate(spreadsheetId=spreadsheet_id, body=update_body).execute()
-    return res
+    return service_account.Credentials.from_service_account_info(json.loads(output), scopes=SCOPES)
+
+
+def get_service(name, version):
+    """Returns a Google API service, built on first use and then reused (building one fetches its discovery document).
+
+    The services aren't thread safe, reports are published one after the other.
+    """
+    global _credentials
+    with _lock:
+        if (name, version) not in _services:
+            from googleapiclient.discovery import build
+            if _credentials is None:
+                _credentials = generate_and_load_credentials()
+            _services[(name, version)] = build(name, version, credentials=_credentials, cache_discovery=False)
+        return _services[(name, version)]
+
+
+def create_spreadsheet(title, sheet_title, dated=True):
+    """creates an empty spreadsheet instance with a single sheet and returns it."""
+    sheets = get_service("sheets", "v4").spreadsheets()
+    if dated:
+        title = f"{title} - {datetime.now().date().strftime('%d/%m/%y')}"
+    body_content = {"properties": {"title": title}, "sheets": [{"properties": {"title": sheet_title}}]}
+    return sheets.create(body=body_content).execute()
+
+
+def get_spreadsheet(spreadsheet_id):
+    """returns the spreadsheet's URL and its sheets' properties, or None when it doesn't exist (anymore)."""
+    from googleapiclient.errors import HttpError
+
+    sheets = get_service("sheets", "v4").spreadsheets()
+    try:
+        return sheets.get(spreadsheetId=spreadsheet_id,
+                          fields="spreadsheetId,spreadsheetUrl,sheets.properties").execute()
+    except HttpError as e:
+        if e.resp.status == 404:
+            return None
+        raise
+
+
+def get_values(spreadsheet_id, sheet_title):
+    """returns the rows of values of the sheet, without their trailing empty cells."""
+    sheets = get_service("sheets", "v4").spreadsheets()
+    return sheets.values().get(spreadsheetId=spreadsheet_id, range=f"'{sheet_title}'").execute().get("values", [])
+
+
+def batch_update(spreadsheet_id, requests):
+    """applies the requests (e.g adding sheets, updating or deleting rows) to the spreadsheet, all at once."""
+    sheets = get_service("sheets", "v4").spreadsheets()
+    return sheets.batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": requests}).execute()
+
+
+def row_data(values):
+    """converts a row of values into the cells of an updateCells or appendCells request."""
+    return {"values": [{"userEnteredValue": {"stringValue": str(value)}} if value not in (None, '') else {}
+                       for value in values]}
+
+
+def append_values(spreadsheet_id, sheet_title, values):
+    """appends the rows of values after the sheet's last row, growing it as needed."""
+    sheets = get_service("sheets", "v4").spreadsheets()
+    return sheets.values().append(spreadsheetId=spreadsheet_id, range=f"'{sheet_title}'", valueInputOption="RAW",
+                                  insertDataOption="INSERT_ROWS", body={"values": values}).execute()
 
 
 def post_spreadsheet(spreadsheet_id, options, notify=False):
     """Post the spreadsheet to Google drive, configure access permissions and returns the instance."""
-    drive_service = build("drive", "v3", credentials=credentials)
+    drive_service = get_service("drive", "v3")
 
     return (
         drive_service.permissions().create(
@@ -70,16 +105,9 @@ def post_spreadsheet(spreadsheet_id, options, notify=False):
     )
 
 
-def create_and_share_spreadsheet(title, df):
-    """Creates a Google spreadsheet instance with DF information, set access permissions and returns it's URL."""
-    data = [
-        {
-            "title": datetime.now().date().strftime('%d/%m/%y'),
-            "df": df
-        }
-    ]
+def share_spreadsheet(spreadsheet):
+    """Sets the spreadsheet's access permissions and returns its URL."""
     permissions = {"config": {"role": "reader", "type": "domain", "domain": "redhat.com"}, "notify": False}
-    sheet = create_spreadsheet(title, data)
-    post_spreadsheet(sheet.get("spreadsheetId"), permissions.get("config"), permissions.get("notify"))
+    post_spreadsheet(spreadsheet.get("spreadsheetId"), permissions.get("config"), permissions.get("notify"))
 
-    return sheet.get("spreadsheetUrl").rsplit('/', 1)[0]
+    return spreadsheet.get("spreadsheetUrl").rsplit('/', 1)[0]
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from time import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from ratelimit import RateLimitedAdapter
+
+DEFAULT_MAX_SIZE = 256  # MB
+DEFAULT_MAX_AGE = 0  # seconds a response is served without being revalidated
+
+
+class ResponseCache:
+    """An on-disk (SQLite) cache of GET responses, evicting the least recently used ones past max_size MB."""
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size * 1024 * 1024
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, headers TEXT, body BLOB, '
+                             'size INTEGER, stored_at REAL, accessed_at REAL)')
+
+    def get(self, key):
+        """Returns the cached (headers, body, stored_at) of the key, or None."""
+        with self._lock, self._db:
+            entry = self._db.execute('SELECT headers, body, stored_at FROM responses WHERE key = ?',
+                                     (key,)).fetchone()
+            if entry:
+                self._db.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time(), key))
+                return json.loads(entry[0]), entry[1], entry[2]
+
+    def put(self, key, headers, body):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                             (key, json.dumps(dict(headers)), body, len(body), time(), time()))
+            self._evict()
+
+    def touch(self, key, headers):
+        """Marks the key's response as revalidated, updating its headers with the fresh ones."""
+        with self._lock, self._db:
+            self._db.execute('UPDATE responses SET headers = ?, stored_at = ?, accessed_at = ? WHERE key = ?',
+                             (json.dumps(dict(headers)), time(), time(), key))
+
+    def _evict(self):
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_size:
+            return
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall():
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_size:
+                break
+
+
+class ConditionalCacheAdapter(RateLimitedAdapter):
+    """A requests transport adapter revalidating cached GET responses with If-None-Match/If-Modified-Since.
+
+    A revalidated response (304) is served from the cache; on GitHub it doesn't count against the rate limit.
+    Responses younger than max_age seconds are served without asking the server (or its scheduler) at all.
+    """
+
+    def __init__(self, cache, max_age=DEFAULT_MAX_AGE, scheduler=None, **kwargs):
+        super().__init__(scheduler, **kwargs)
+        self.cache = cache
+        self.max_age = max_age
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(request):
+        # the same URL returns different content to different tokens or media types
+        variant = '\n'.join([request.method, request.url, request.headers.get('Authorization', ''),
+                             request.headers.get('PRIVATE-TOKEN', ''), request.headers.get('Accept', '')])
+        return hashlib.sha256(variant.encode()).hexdigest()
+
+    def send(self, request, stream=False, **kwargs):
+        if request.method != 'GET' or stream:
+            return super().send(request, stream=stream, **kwargs)
+        key = self._key(request)
+        entry = self.cache.get(key)
+        if entry:
+            headers, body, stored_at = entry
+            headers = CaseInsensitiveDict(headers)
+            if time() - stored_at < self.max_age:
+                self.hits += 1
+                return self._cached_response(request, headers, body)
+            if 'ETag' in headers:
+                request.headers['If-None-Match'] = headers['ETag']
+            if 'Last-Modified' in headers:
+                request.headers['If-Modified-Since'] = headers['Last-Modified']
+        response = super().send(request, stream=stream, **kwargs)
+        if entry and response.status_code == 304:
+            self.revalidations += 1
+            headers.update(response.headers)
+            self.cache.touch(key, headers)
+            return self._cached_response(request, headers, body)
+        self.misses += 1
+        if response.status_code == 200 and ('ETag' in response.headers or 'Last-Modified' in response.headers):
+            self.cache.put(key, response.headers, response.content)
+        return response
+
+    def _cached_response(self, request, headers, body):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = body
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def log_stats(self, name):
+        logging.info(f"HTTP cache of {name}: {self.hits} hits, {self.revalidations} revalidated, "
+                     f"{self.misses} misses.")
+
+
+def mount_cache(session, path, max_size=DEFAULT_MAX_SIZE, max_age=DEFAULT_MAX_AGE, scheduler=None):
+    """Mounts a conditional cache on the session's HTTPS and HTTP traffic, returning its adapter."""
+    adapter = ConditionalCacheAdapter(ResponseCache(path, max_size), max_age, scheduler)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return adapter
@@ -0,0 +1,125 @@
+import logging
+import queue
+import smtplib
+import threading
+from time import perf_counter, sleep
+
+import metrics
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_DELAY = 5  # seconds, doubled on every retry
+DEFAULT_TIMEOUT = 60  # seconds
+
+
+class Mailer:
+    """Delivers the run's emails from a background thread, through a single SMTP session kept open for all of them.
+
+    Messages are queued as soon as they're built, so the run carries on with the next reports while they're sent.
+    Transient failures (a dropped connection, a 4xx reply) are retried with the same message, reconnecting if needed,
+    up to max_retries times; the other failures are logged, without failing the run. The host may carry a port
+    (host:port), and given a user the session is authenticated, over STARTTLS when the server offers it.
+    """
+
+    def __init__(self, host, user=None, password=None, max_retries=DEFAULT_MAX_RETRIES,
+                 retry_delay=DEFAULT_RETRY_DELAY, timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        self.connections = 0
+        self._smtp = None
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def send(self, message):
+        """Queues the message, to be delivered in the background."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._deliver_queued, name='mailer', daemon=True)
+            self._thread.start()
+        # the delivery is tagged like the calls of the thread which queued it (e.g by team)
+        self._queue.put((message, metrics.current_tags(), perf_counter()))
+
+    def close(self):
+        """Waits for the queued messages to be delivered, then ends the SMTP session."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self.sent or self.failed:
+            logging.info(f"Mails: {self.sent} sent, {self.failed} failed, over {self.connections} SMTP connections.")
+
+    def _deliver_queued(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            message, tags, queued_at = item
+            with metrics.tagged(**tags):
+                self._deliver(message, queued_at)
+        self._disconnect()
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, timeout=self.timeout)
+        try:
+            if self.user:
+                smtp.ehlo()
+                if smtp.has_extn('starttls'):
+                    smtp.starttls()
+                    smtp.ehlo()
+                smtp.login(self.user, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        self.connections += 1
+        return smtp
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+    def _deliver(self, message, queued_at):
+        description = f"'{message['Subject']}' to {message['To']}"
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                with metrics.run_metrics.timed('send message', phase='email', server='SMTP', host=self.host):
+                    if self._smtp is None:
+                        self._smtp = self._connect()
+                    self._smtp.send_message(message)
+            except smtplib.SMTPResponseException as e:
+                error = f"{e.smtp_code} {e.smtp_error.decode(errors='replace')}"
+                if not 400 <= e.smtp_code < 500:
+                    logging.error(f"Mail {description} was rejected: {error}.")
+                    self.failed += 1
+                    return
+                if e.smtp_code == 421:  # the server is closing the connection
+                    self._disconnect()
+            except smtplib.SMTPRecipientsRefused as e:
+                logging.error(f"Mail {description} was rejected, its recipients were refused: {e.recipients}.")
+                self.failed += 1
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                # the connection is in an unknown state, the next attempt reconnects
+                self._disconnect()
+                error = e
+            else:
+                self.sent += 1
+                latency = perf_counter() - queued_at
+                if metrics.current_tags().get('team'):
+                    metrics.run_metrics.record_team(metrics.current_tags()['team'], email_latency_seconds=latency)
+                logging.info(f"Mail {description} sent {latency:.1f} seconds after being queued"
+                             f"{f', after {attempt} retries' if attempt else ''}.")
+                return
+            logging.warning(f"Mail {description} failed (attempt {attempt + 1} of {self.max_retries + 1}): {error}.")
+        logging.error(f"Mail {description} was not sent, giving up.")
+        self.failed += 1
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import perf_counter, time
+
+# calls are aggregated by these tags, in this order; a 'team' tag also adds them to the team's totals
+LABELS = ('phase', 'server', 'host', 'namespace')
+DEFAULT_SLOW_CALL = 10  # seconds
+DEFAULT_SLOWEST = 20
+
+_tags = threading.local()
+
+
+def current_tags():
+    return getattr(_tags, 'value', {})
+
+
+@contextmanager
+def tagged(**tags):
+    """Tags the calls recorded by the current thread within the context, on top of the enclosing context's tags."""
+    previous = current_tags()
+    _tags.value = dict(previous, **tags)
+    try:
+        yield
+    finally:
+        _tags.value = previous
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomically(path, content):
+    """Writes the file through a temporary one, so its readers (e.g node_exporter) never see it half written."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.batyam-')
+    with os.fdopen(fd, 'w') as temp_file:
+        temp_file.write(content)
+    os.replace(temp_path, path)
+
+
+class RunMetrics:
+    """Times and counts the run's outbound calls (GitLab/GitHub requests, Gerrit queries, Google Sheets, SMTP).
+
+    Calls are aggregated by their phase (connect, list, enrich, publish, email), server, host and namespace,
+    taken from the thread's tags and the recorded ones. Calls slower than slow_call seconds are logged,
+    and export() writes the run's summary as JSON and as a Prometheus textfile, to the configured paths.
+    """
+
+    def __init__(self, summary_path=None, prometheus_path=None, slow_call=DEFAULT_SLOW_CALL, slowest=DEFAULT_SLOWEST):
+        self.summary_path = summary_path
+        self.prometheus_path = prometheus_path
+        self.slow_call = slow_call
+        self.slowest = slowest
+        self.started_at = time()
+        self._started = perf_counter()
+        self._calls = OrderedDict()
+        self._teams = OrderedDict()
+        self._slowest_calls = []
+        self._lock = threading.Lock()
+
+    def record(self, duration, description='', error=False, **tags):
+        """Records a call which took 'duration' seconds, tagged by the thread's tags and the given ones."""
+        tags = dict(current_tags(), **tags)
+        key = tuple(tags.get(label) or '' for label in LABELS)
+        with self._lock:
+            calls = self._calls.setdefault(key, {'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            calls['calls'] += 1
+            calls['errors'] += int(error)
+            calls['seconds'] += duration
+            calls['max_seconds'] = max(calls['max_seconds'], duration)
+            if tags.get('team'):
+                phases = self._teams.setdefault(tags['team'], OrderedDict()).setdefault('phases', OrderedDict())
+                phase = phases.setdefault(tags.get('phase') or '', {'calls': 0, 'seconds': 0.0})
+                phase['calls'] += 1
+                phase['seconds'] += duration
+            if self.slowest:
+                self._slowest_calls.append(dict(zip(LABELS, key), description=description, seconds=duration))
+                if len(self._slowest_calls) > self.slowest * 2:
+                    self._trim_slowest()
+        if self.slow_call is not None and duration >= self.slow_call:
+            logging.warning(f"Slow {key[0] or 'outbound'} call to {key[1] or key[2]}"
+                            f"{f' ({key[3]})' if key[3] else ''}: {description} took {duration:.1f} seconds.")
+
+    def _trim_slowest(self):
+        self._slowest_calls.sort(key=lambda call: call['seconds'], reverse=True)
+        del self._slowest_calls[self.slowest:]
+
+    @contextmanager
+    def timed(self, description='', **tags):
+        """Records the call made within the context, as an error if it raises."""
+        start = perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(perf_counter() - start, description, error, **tags)
+
+    def record_team(self, team, **totals):
+        """Adds the given totals (e.g rows, requests) to the team's."""
+        with self._lock:
+            team_totals = self._teams.setdefault(team, OrderedDict())
+            for name, value in totals.items():
+                team_totals[name] = team_totals.get(name, 0) + value
+
+    def summary(self):
+        with self._lock:
+            self._trim_slowest()
+            return {
+                'started_at': self.started_at,
+                'duration_seconds': perf_counter() - self._started,
+                'calls': [dict(zip(LABELS, key), **calls) for key, calls in self._calls.items()],
+                'teams': [dict(totals, team=team) for team, totals in self._teams.items()],
+                'slowest_calls': list(self._slowest_calls),
+            }
+
+    def prometheus(self, summary=None):
+        """Returns the summary in the Prometheus text format, for the node_exporter's textfile collector."""
+        summary = summary or self.summary()
+        lines = [
+            '# HELP batyam_run_timestamp_seconds When the last run started.',
+            '# TYPE batyam_run_timestamp_seconds gauge',
+            f"batyam_run_timestamp_seconds {summary['started_at']:.3f}",
+            '# HELP batyam_run_duration_seconds How long the last run took.',
+            '# TYPE batyam_run_duration_seconds gauge',
+            f"batyam_run_duration_seconds {summary['duration_seconds']:.3f}",
+        ]
+        series = [('calls', 'batyam_calls', 'Outbound calls of the last run.'),
+                  ('errors', 'batyam_call_errors', 'Outbound calls of the last run which failed.'),
+                  ('seconds', 'batyam_call_seconds', 'Seconds spent in outbound calls during the last run.'),
+                  ('max_seconds', 'batyam_call_max_seconds', 'Slowest outbound call of the last run.')]
+        for field, name, description in series:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} gauge']
+            for calls in summary['calls']:
+                labels = ','.join(f'{label}="{_escape(calls[label])}"' for label in LABELS)
+                lines.append(f'{name}{{{labels}}} {calls[field]:g}')
+        lines += ['# HELP batyam_team_phase_seconds Seconds spent in a phase for a team during the last run.',
+                  '# TYPE batyam_team_phase_seconds gauge']
+        for team in summary['teams']:
+            for phase, totals in team.get('phases', {}).items():
+                lines.append(f'batyam_team_phase_seconds{{team="{_escape(team["team"])}",phase="{_escape(phase)}"}} '
+                             f'{totals["seconds"]:g}')
+        totals = sorted({name for team in summary['teams'] for name in team if name not in ('team', 'phases')})
+        for name in totals:
+            lines += [f'# HELP batyam_team_{name} The team\'s {name} during the last run.',
+                      f'# TYPE batyam_team_{name} gauge']
+            lines += [f'batyam_team_{name}{{team="{_escape(team["team"])}"}} {team[name]:g}'
+                      for team in summary['teams'] if name in team]
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        """Writes the run's summary to the configured JSON and Prometheus textfile paths, if any."""
+        summary = self.summary()
+        if self.summary_path:
+            _write_atomically(self.summary_path, json.dumps(summary, indent=2))
+        if self.prometheus_path:
+            _write_atomically(self.prometheus_path, self.prometheus(summary))
+        slowest = ', '.join(f"{call['description'] or call['phase']} ({call['seconds']:.1f}s)"
+                            for call in summary['slowest_calls'][:3])
+        logging.info(f"Run took {summary['duration_seconds']:.1f} seconds, "
+                     f"{sum(calls['calls'] for calls in summary['calls'])} outbound calls"
+                     f"{f', the slowest: {slowest}' if slowest else ''}.")
+
+
+run_metrics = RunMetrics()
@@ -0,0 +1,146 @@
+import logging
+from collections import OrderedDict
+
+
+def _key(value):
+    return str(value).casefold()
+
+
+def _merge(values, more_values):
+    """Appends the values not listed yet, keeping their order."""
+    listed = {_key(value) for value in values}
+    return values + [value for value in more_values or [] if _key(value) not in listed]
+
+
+def _selects(wanted, value):
+    return wanted == ['*'] or _key(value) in {_key(item) for item in wanted or []}
+
+
+class RunPlan:
+    """Merges the servers of all the teams, so that each host, namespace and repository is pulled once per run.
+
+    Teams using the same host share a single server, pulling the union of their namespaces and repositories
+    (only dropping the bot users all of them drop); split() then hands each team the rows it asked for.
+    """
+
+    def __init__(self, teams):
+        self.teams = teams or []
+        self.servers = OrderedDict()
+        self._created = {}
+        self.team_sources = [[] for _ in self.teams]
+        for team in self.teams:
+            try:
+                for server in team.get('servers'):
+                    self._add_server(server)
+            except TypeError as e:
+                logging.warning(f"No valid servers found for team {team.get('name')}: {e}.")
+
+    @staticmethod
+    def _server_key(server):
+        # the teams filtering a host's PRs by different base branches can't share its server
+        return _key(server.get('vendor')), server.get('host'), server.get('base_branch')
+
+    def _add_server(self, server):
+        key = self._server_key(server)
+        if key not in self.servers:
+            self.servers[key] = dict(server, namespaces=list(server.get('namespaces') or []),
+                                     users=list(server.get('users') or []),
+                                     repositories=list(server.get('repositories') or []),
+                                     bot_users=list(server.get('bot_users') or []))
+            return
+        merged = self.servers[key]
+        merged['namespaces'] = _merge(merged['namespaces'], server.get('namespaces'))
+        merged['users'] = _merge(merged['users'], server.get('users'))
+        if merged['repositories'] == ['*'] or server.get('repositories') == ['*']:
+            merged['repositories'] = ['*']
+        else:
+            merged['repositories'] = _merge(merged['repositories'], server.get('repositories'))
+        merged['bot_users'] = [bot for bot in merged['bot_users'] if _selects(server.get('bot_users'), bot)]
+        merged['workers'] = max(merged.get('workers') or 0, server.get('workers') or 0) or None
+        for option, value in server.items():
+            merged.setdefault(option, value)
+
+    def create_servers(self, create_servers_from_dictionary):
+        """Creates a single server object per unique server, out of their merged configurations."""
+        servers = []
+        for key, server_config in self.servers.items():
+            for server in create_servers_from_dictionary({'servers': [server_config]}):
+                self._created[server] = key
+                servers.append(server)
+        return servers
+
+    @staticmethod
+    def _wants(server_config, server, source, row):
+        """Tells whether a team's server configuration asked for a row pulled from the server's source."""
+        if _selects(server_config.get('bot_users'), row['contributor']):
+            return False
+        if not _selects(server_config.get('repositories'), row['project']):
+            return False
+        namespace = server.source_namespace(source)
+        return namespace is None or _selects(server_config.get('namespaces'), namespace) or \
+            _selects(server_config.get('users'), namespace)
+
+    def split(self, pulled):
+        """Splits the (server, source, rows) pulled from the merged servers into a list of rows per team.
+
+        The teams share the rows (immutable CodeContribution records), which tell their server apart by their 'vendor'.
+        """
+        completed = {id(team): rows for team, rows in self.split_as_pulled(pulled)}
+        return [completed[id(team)] for team in self.teams]
+
+    def split_as_pulled(self, pulled):
+        """Yields each team along with its rows (see split()), as soon as the sources of all its servers are pulled.
+
+        The sources come server after server, as collector.collect_sources() yields them, so a team is complete once
+        the last of its servers is left behind; the teams are thus yielded by the order their servers are pulled in.
+        """
+        team_rows = [[] for _ in self.teams]
+        created = set(self._created.values())
+        waiting = OrderedDict((index, {self._server_key(server_config) for server_config in team.get('servers') or []}
+                               & created) for index, team in enumerate(self.teams))
+        pulling = None
+        for server, source, rows in pulled:
+            if self._created[server] != pulling:
+                yield from self._completed(waiting, pulling, team_rows)
+                pulling = self._created[server]
+            for team, rows_of_team, sources in zip(self.teams, team_rows, self.team_sources):
+                server_configs = [server_config for server_config in team.get('servers') or []
+                                  if self._server_key(server_config) == pulling]
+                if server_configs:
+                    sources.append((server, source))
+                rows_of_team.extend(row for row in rows
+                                    if any(self._wants(server_config, server, source, row)
+                                           for server_config in server_configs))
+        # the servers which had no sources to pull were never reached
+        for index in waiting:
+            yield self.teams[index], team_rows[index]
+
+    def _completed(self, waiting, pulled_key, team_rows):
+        """Yields (and stops waiting for) the teams which only waited for the server that was just pulled."""
+        for index, keys in list(waiting.items()):
+            keys.discard(pulled_key)
+            if not keys:
+                del waiting[index]
+                yield self.teams[index], team_rows[index]
+
+    def teams_wanting(self, server, source, row):
+        """Returns the teams which asked for a row of one of the merged servers' sources (e.g from a Gerrit event)."""
+        return [team for team in self.teams
+                if any(self._server_key(server_config) == self._created[server] and
+                       self._wants(server_config, server, source, row) for server_config in team.get('servers') or [])]
+
+    def _sources_of(self, team):
+        return next(sources for other, sources in zip(self.teams, self.team_sources) if other is team)
+
+    def pulled_scopes(self, team):
+        """Returns the (vendor, kind, value) scopes of the sources pulled for a team, see base.Server.source_scope()."""
+        scopes = [(server.name, server.source_scope(source)) for server, source in self._sources_of(team)]
+        return [(vendor,) + scope for vendor, scope in scopes if scope]
+
+    def requests_used(self, team):
+        """Returns how many rate limited requests were sent for the sources a team asked for.
+
+        A source shared by several teams counts against each of them, as each would have pulled it on its own.
+        """
+        return sum(server.scheduler.usage[server.source_key(source)] for server, source in self._sources_of(team)
+                   if getattr(server, 'scheduler', None))
@@ -0,0 +1,193 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from time import perf_counter, time
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE = 2  # seconds, doubled on every retry of a request
+EXHAUSTED_WAIT = 60  # seconds before probing a quota which ran out without a reset time
+
+_charged = threading.local()
+
+
+@contextmanager
+def charge_to(label):
+    """Charges the requests sent by the current thread within the context to the given label."""
+    previous = getattr(_charged, 'label', None)
+    _charged.label = label
+    try:
+        yield
+    finally:
+        _charged.label = previous
+
+
+def retry_after(value):
+    """Returns the seconds to wait of a Retry-After header, either a number of seconds or an HTTP date."""
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time(), 0)
+    except (TypeError, ValueError):
+        return 0  # unreadable, the exponential backoff applies
+
+
+def request_cost(request):
+    """Estimates how much of the server's budget a request consumes: searches first, then listings, then lookups."""
+    if request.method != 'GET':
+        return 3
+    if 'per_page' in request.url or 'page=' in request.url:
+        return 2
+    return 1
+
+
+class RateLimitScheduler:
+    """Paces the requests to a host by the rate limit it reports back.
+
+    Never sends more requests at once than the quota has left (up to max_concurrency), lets the cheapest
+    waiting requests go first, and holds all of them once the server throttles, until its reset time or
+    a jittered exponential backoff passes.
+    """
+
+    def __init__(self, host, max_concurrency=DEFAULT_MAX_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES):
+        self.host = host
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.blocked_until = 0
+        self.usage = Counter()
+        self._in_flight = 0
+        self._waiting = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+
+    def _can_send(self, ticket):
+        if self._waiting[0] != ticket or time() < self.blocked_until:
+            return False
+        if self.remaining is not None and self.reset_at and time() >= self.reset_at:
+            self.remaining = None  # a new rate limit window started
+        allowed = self.max_concurrency if self.remaining is None else min(self.max_concurrency, self.remaining)
+        return self._in_flight < allowed
+
+    def _wait_time(self):
+        if time() < self.blocked_until:
+            return self.blocked_until - time()
+        if self.remaining is not None and self.remaining <= self._in_flight and self.reset_at:
+            return max(self.reset_at - time(), 0.1)
+        # a request in flight will notify once done, otherwise nothing would
+        return None if self._in_flight else EXHAUSTED_WAIT
+
+    def acquire(self, cost=1):
+        """Blocks until a request of the given cost may be sent."""
+        ticket = (cost, next(self._order))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            while not self._can_send(ticket):
+                self._condition.wait(self._wait_time())
+            heapq.heappop(self._waiting)
+            self._in_flight += 1
+            self.usage[getattr(_charged, 'label', None)] += 1
+            self._condition.notify_all()
+
+    def release(self, response=None):
+        """Updates the quota from a response's headers, returning the seconds to wait if it got throttled."""
+        headers = response.headers if response is not None else {}
+        with self._condition:
+            self._in_flight -= 1
+            remaining = headers.get('X-RateLimit-Remaining', headers.get('RateLimit-Remaining'))
+            reset_at = headers.get('X-RateLimit-Reset', headers.get('RateLimit-Reset'))
+            limit = headers.get('X-RateLimit-Limit', headers.get('RateLimit-Limit'))
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset_at is not None:
+                self.reset_at = float(reset_at)
+            if limit is not None:
+                self.limit = int(limit)
+            if self.remaining == 0 and not (self.reset_at and self.reset_at > time()):
+                # the quota ran out without telling when it's renewed, a single request probes it after a while
+                self.blocked_until = max(self.blocked_until, time() + EXHAUSTED_WAIT)
+                self.remaining = 1
+            self._condition.notify_all()
+        return self._throttled_for(response) if response is not None else None
+
+    def _throttled_for(self, response):
+        throttled = response.status_code == 429 or (
+            response.status_code == 403 and (self.remaining == 0 or 'Retry-After' in response.headers))
+        if not throttled:
+            return None
+        if 'Retry-After' in response.headers:
+            return retry_after(response.headers['Retry-After'])
+        if self.remaining == 0 and self.reset_at:
+            return max(self.reset_at - time(), 0)
+        return 0
+
+    def back_off(self, delay, attempt):
+        """Holds all the host's requests for the server's delay, or an exponential backoff, plus some jitter."""
+        delay = max(delay, BACKOFF_BASE * 2 ** attempt) + random.uniform(0, BACKOFF_BASE)
+        with self._condition:
+            self.blocked_until = max(self.blocked_until, time() + delay)
+        logging.warning(f"{self.host} throttled the requests, holding them for {delay:.1f} seconds.")
+
+    def log_stats(self, name):
+        left = f", {self.remaining} of {self.limit} left" if self.limit is not None else ''
+        logging.info(f"Rate limit of {name}: {sum(self.usage.values())} requests sent{left}.")
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """A requests transport adapter sending the requests through a host's RateLimitScheduler, if given one.
+
+    Throttled requests are retried (up to the scheduler's max_retries) instead of failing the collection.
+    Every request sent is recorded in the run's metrics.
+    """
+
+    def __init__(self, scheduler=None, **kwargs):
+        super().__init__(**kwargs)
+        self.scheduler = scheduler
+
+    def _send(self, request, **kwargs):
+        url = urlparse(request.url)
+        start = perf_counter()
+        response = None
+        try:
+            response = super().send(request, **kwargs)
+            return response
+        finally:
+            metrics.run_metrics.record(perf_counter() - start, f'{request.method} {url.path}',
+                                       error=response is None or response.status_code >= 400,
+                                       **dict({'host': url.netloc}, **metrics.current_tags()))
+
+    def send(self, request, **kwargs):
+        if not self.scheduler:
+            return self._send(request, **kwargs)
+        for attempt in itertools.count():
+            self.scheduler.acquire(request_cost(request))
+            response = None
+            try:
+                response = self._send(request, **kwargs)
+            finally:
+                delay = self.scheduler.release(response)
+            if delay is None or attempt >= self.scheduler.max_retries:
+                return response
+            response.close()
+            self.scheduler.back_off(delay, attempt)
+
+
+def mount_scheduler(session, scheduler):
+    adapter = RateLimitedAdapter(scheduler)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return adapter
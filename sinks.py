@@ -0,0 +1,413 @@
+import csv
+import html
+import json
+import logging
+import os
+import tempfile
+from abc import ABCMeta, abstractmethod
+from bisect import bisect
+from collections import OrderedDict
+from datetime import datetime, timezone
+from itertools import chain, islice
+
+import base
+import metrics
+
+REPORT_COLUMNS = ['project', 'last updated', 'contributor', 'state', 'title', 'web_url']
+FILE_COLUMNS = REPORT_COLUMNS + ['vendor']
+REPORT_TITLE = 'Open Code Contributions - {team}'
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_EMAIL_MAX_SIZE = 1024  # KB
+DEFAULT_SHEETS_RETENTION = 14  # daily tabs
+
+
+def chunked(rows, size=DEFAULT_CHUNK_SIZE):
+    """Yields the rows in lists of up to 'size' rows."""
+    rows = iter(rows)
+    chunk = list(islice(rows, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(rows, size))
+
+
+def render_values(row):
+    """returns the row's report values, showing how long ago the CC was updated instead of when."""
+    values = ['' if row.get(column) is None else row.get(column) for column in REPORT_COLUMNS]
+    updated_at = row.get('last updated')
+    values[1] = base.Server.convert_timestamp_to_time_passed(updated_at.timestamp()) if updated_at else ''
+    return values
+
+
+class Sink(metaclass=ABCMeta):
+    """An output of the teams' reports, taking each report's rows chunk by chunk (so they're never all copied at once).
+
+    Sinks publish a team's report one after the other, given the links to it the previous sinks returned,
+    by the sinks' link descriptions.
+    """
+
+    name = ''
+    link_description = ''
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+    @abstractmethod
+    def publish(self, team, rows, links):
+        """Outputs the team's report rows, and returns a link to the output if it has one."""
+
+
+class DatabaseSink(Sink):
+    """Stores the rows in the batyam Django app's database (see django_store.py).
+
+    The ingestion takes the rows in chunks of its own, sized by the database's limits, within a single transaction.
+    Given the run plan, only the stored CC of the sources it pulled for the team may be closed for missing.
+    """
+
+    name = 'database'
+
+    def __init__(self, store, plan=None):
+        super().__init__()
+        self.store = store
+        self.plan = plan
+
+    def publish(self, team, rows, links):
+        self.store.ingest(team.get('name'), rows, self.plan.pulled_scopes(team) if self.plan else None)
+
+
+class FileSink(Sink):
+    """Writes the rows to a CSV file, or to a JSON one given a .json path, with the CC's update times in ISO format.
+
+    The path and the link may contain {team} and {date}; the file is only replaced once it's fully written.
+    """
+
+    name = 'file'
+    link_description = 'for download'
+
+    def __init__(self, path, url=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        super().__init__(chunk_size)
+        self.path = path
+        self.url = url
+
+    def publish(self, team, rows, links):
+        fields = {'team': team.get('name'), 'date': datetime.now().date().isoformat()}
+        path = self.path.format(**fields)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.batyam-')
+        try:
+            with os.fdopen(fd, 'w', newline='') as temp_file:
+                if path.endswith('.json'):
+                    self._write_json(temp_file, rows)
+                else:
+                    self._write_csv(temp_file, rows)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        logging.info(f"Wrote the report of {team.get('name')} to {path}.")
+        return self.url.format(**fields) if self.url else None
+
+    def _file_values(self, row):
+        values = [row.get(column) for column in FILE_COLUMNS]
+        values[1] = values[1].isoformat() if values[1] else None
+        return values
+
+    def _write_csv(self, file, rows):
+        writer = csv.writer(file)
+        writer.writerow(FILE_COLUMNS)
+        for chunk in chunked(rows, self.chunk_size):
+            writer.writerows(self._file_values(row) for row in chunk)
+
+    def _write_json(self, file, rows):
+        file.write('[')
+        separator = '\n'
+        for chunk in chunked(rows, self.chunk_size):
+            for row in chunk:
+                file.write(separator + json.dumps(OrderedDict(zip(FILE_COLUMNS, self._file_values(row)))))
+                separator = ',\n'
+        file.write('\n]\n')
+
+
+class SheetsSink(Sink):
+    """Publishes the rows on a new Google spreadsheet, shared within the domain, appending them chunk by chunk.
+
+    No spreadsheet is created for an empty report.
+    """
+
+    name = 'Google Sheets'
+    link_description = 'on Google Sheets'
+
+    def publish(self, team, rows, links):
+        import google_spreadsheets
+
+        spreadsheet = None
+        sheet_title = datetime.now().date().strftime('%d/%m/%y')
+        for chunk in chunked(rows, self.chunk_size):
+            values = [render_values(row) for row in chunk]
+            if spreadsheet is None:
+                with self._timed('create spreadsheet'):
+                    spreadsheet = google_spreadsheets.create_spreadsheet(REPORT_TITLE.format(team=team.get('name')),
+                                                                         sheet_title)
+                values.insert(0, REPORT_COLUMNS)
+            with self._timed(f'append {len(chunk)} rows'):
+                google_spreadsheets.append_values(spreadsheet.get('spreadsheetId'), sheet_title, values)
+        if spreadsheet is None:
+            return None
+        with self._timed('share spreadsheet'):
+            return google_spreadsheets.share_spreadsheet(spreadsheet)
+
+    @staticmethod
+    def _timed(description):
+        return metrics.run_metrics.timed(description, phase='publish', server='Google Sheets',
+                                         host='sheets.googleapis.com')
+
+
+def _runs(positions):
+    """Yields the (first, last + 1) ranges of consecutive positions among the sorted ones."""
+    start = end = None
+    for position in positions:
+        if position != end:
+            if start is not None:
+                yield start, end
+            start = position
+        end = position + 1
+    if start is not None:
+        yield start, end
+
+
+class PersistentSheetsSink(SheetsSink):
+    """Keeps a single Google spreadsheet per team, with a tab per day, updating it in place.
+
+    The CC are diffed by their URL against the latest tab: today's tab is a copy of it, where the closed CC's rows
+    are deleted, the changed ones updated and the new ones appended, all in a single batchUpdate (the rows keep
+    their places, so the tab isn't in the report's order). Nothing is sent when nothing changed, and the tabs
+    past the 'retention' latest ones are deleted. The CC's update times are written as such, not as their age,
+    so that unchanged CC stay so. The teams' spreadsheet IDs are kept in a JSON file at 'path'.
+    """
+
+    def __init__(self, path, retention=DEFAULT_SHEETS_RETENTION, chunk_size=DEFAULT_CHUNK_SIZE):
+        super().__init__(chunk_size)
+        self.path = path
+        self.retention = max(retention, 1)
+        try:
+            with open(path) as spreadsheets_file:
+                self.spreadsheets = json.load(spreadsheets_file)
+        except FileNotFoundError:
+            self.spreadsheets = {}
+
+    @staticmethod
+    def _values(row):
+        values = ['' if row.get(column) is None else str(row.get(column)) for column in REPORT_COLUMNS]
+        updated_at = row.get('last updated')
+        values[1] = updated_at.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M UTC') if updated_at else ''
+        return values
+
+    @staticmethod
+    def _is_daily_tab(sheet):
+        try:
+            datetime.strptime(sheet['properties']['title'], '%Y-%m-%d')
+            return True
+        except ValueError:
+            return False
+
+    def _save(self):
+        with open(self.path, 'w') as spreadsheets_file:
+            json.dump(self.spreadsheets, spreadsheets_file, indent=2)
+
+    def publish(self, team, rows, links):
+        import google_spreadsheets
+
+        title = REPORT_TITLE.format(team=team.get('name'))
+        today = datetime.now().date().isoformat()
+        spreadsheet = None
+        created = False
+        if self.spreadsheets.get(team.get('name')):
+            with self._timed('get spreadsheet'):
+                spreadsheet = google_spreadsheets.get_spreadsheet(self.spreadsheets[team.get('name')])
+        if spreadsheet is None:
+            rows = iter(rows)
+            first_chunk = list(islice(rows, self.chunk_size))
+            if not first_chunk:
+                return None
+            rows = chain(first_chunk, rows)
+            with self._timed('create spreadsheet'):
+                spreadsheet = google_spreadsheets.create_spreadsheet(title, today, dated=False)
+            with self._timed('share spreadsheet'):
+                google_spreadsheets.share_spreadsheet(spreadsheet)
+            self.spreadsheets[team.get('name')] = spreadsheet['spreadsheetId']
+            self._save()
+            created = True
+            logging.info(f"Created the Google spreadsheet of {team.get('name')}.")
+        url = spreadsheet['spreadsheetUrl'].rsplit('/', 1)[0]
+
+        tabs = sorted((sheet['properties'] for sheet in spreadsheet['sheets'] if self._is_daily_tab(sheet)),
+                      key=lambda tab: tab['title'])
+        previous_values = []
+        if tabs and not created:
+            with self._timed('get values'):
+                previous_values = google_spreadsheets.get_values(spreadsheet['spreadsheetId'], tabs[-1]['title'])
+        if tabs and tabs[-1]['title'] == today:
+            sheet_id = tabs[-1]['sheetId']
+            new_tab = []
+        else:
+            # today's tab comes first, as a copy of the latest one
+            sheet_id = max(sheet['properties']['sheetId'] for sheet in spreadsheet['sheets']) + 1
+            if tabs:
+                new_tab = [{'duplicateSheet': {'sourceSheetId': tabs[-1]['sheetId'], 'insertSheetIndex': 0,
+                                               'newSheetId': sheet_id, 'newSheetName': today}}]
+            else:
+                new_tab = [{'addSheet': {'properties': {'sheetId': sheet_id, 'title': today, 'index': 0}}}]
+            tabs.append({'sheetId': sheet_id, 'title': today})
+        requests = self._diff(rows, previous_values, sheet_id)
+        if not requests:
+            logging.info(f"The Google spreadsheet of {team.get('name')} is up to date.")
+            return url
+
+        expired = [{'deleteSheet': {'sheetId': tab['sheetId']}} for tab in tabs[:-self.retention]]
+        with self._timed(f'batch update {len(requests)} ranges'):
+            google_spreadsheets.batch_update(spreadsheet['spreadsheetId'], new_tab + requests + expired)
+        return url
+
+    def _diff(self, rows, previous_values, sheet_id):
+        """Returns the requests turning the sheet's previous rows of values (the header first) into the rows'.
+
+        Only the previous rows are held in memory besides the changes, the rows are taken chunk by chunk.
+        """
+        import google_spreadsheets
+
+        width = len(REPORT_COLUMNS)
+        previous_values = [values + [''] * (width - len(values)) for values in previous_values]
+        previous = {values[-1]: (position, values) for position, values in enumerate(previous_values) if position}
+        changed, appended, seen = [], [], set()
+        if not previous_values:
+            appended.append(REPORT_COLUMNS)
+        elif previous_values[0] != REPORT_COLUMNS:
+            changed.append((0, REPORT_COLUMNS))
+        for chunk in chunked(rows, self.chunk_size):
+            for row in chunk:
+                values = self._values(row)
+                if values[-1] in seen:
+                    continue
+                seen.add(values[-1])
+                if values[-1] not in previous:
+                    appended.append(values)
+                elif previous[values[-1]][1] != values:
+                    changed.append((previous[values[-1]][0], values))
+        removed = sorted(position for key, (position, _) in previous.items() if key not in seen)
+
+        requests = []
+        # deleted from the bottom up, so the rows above keep their places
+        for start, end in reversed(list(_runs(removed))):
+            requests.append({'deleteDimension': {'range': {'sheetId': sheet_id, 'dimension': 'ROWS',
+                                                           'startIndex': start, 'endIndex': end}}})
+        # then the changed rows are where they moved to
+        changed = sorted((position - bisect(removed, position), values) for position, values in changed)
+        new_values = dict(changed)
+        for start, end in _runs(position for position, _ in changed):
+            requests.append({'updateCells': {'start': {'sheetId': sheet_id, 'rowIndex': start, 'columnIndex': 0},
+                                             'rows': [google_spreadsheets.row_data(new_values[position])
+                                                      for position in range(start, end)],
+                                             'fields': 'userEnteredValue'}})
+        if appended:
+            requests.append({'appendCells': {'sheetId': sheet_id,
+                                             'rows': [google_spreadsheets.row_data(values) for values in appended],
+                                             'fields': 'userEnteredValue'}})
+        return requests
+
+
+class EmailSink(Sink):
+    """Mails the report to the team's recipients as an HTML table, along with the links to the other outputs.
+
+    The CC may be grouped by a report column (e.g project), a table per group. Past max_size KB of table,
+    the remaining CC are left out, and the email starts with a summary of the whole report instead.
+    """
+
+    name = 'email'
+
+    def __init__(self, send, group_by=None, max_size=DEFAULT_EMAIL_MAX_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+        super().__init__(chunk_size)
+        if group_by and group_by not in REPORT_COLUMNS:
+            raise ValueError(f"Can't group the email's report by '{group_by}', not a report column.")
+        self.send = send
+        self.group_by = group_by
+        self.max_size = max_size
+
+    def publish(self, team, rows, links):
+        summary_column = self.group_by or 'project'
+        tables = OrderedDict()  # the rendered rows of each group
+        counts = OrderedDict()  # the CC of each group, shown or not
+        size = shown = total = 0
+        for chunk in chunked(rows, self.chunk_size):
+            for row in chunk:
+                total += 1
+                group = row.get(summary_column) or ''
+                counts[group] = counts.get(group, 0) + 1
+                if size is None:
+                    continue
+                cells = ''.join(f'<td>{html.escape(str(value))}</td>' for value in render_values(row))
+                rendered = f'    <tr>\n      <th>{total}</th>{cells}\n    </tr>\n'
+                if size + len(rendered) > self.max_size * 1024:
+                    size = None  # the cap is reached, the following CC are only counted
+                    continue
+                size += len(rendered)
+                shown += 1
+                tables.setdefault(group if self.group_by else '', []).append(rendered)
+
+        body = ''.join(f'<p>The report is also available {description}:<br> {link}</p>'
+                       for description, link in links.items())
+        if shown < total:
+            logging.warning(f"The report of {team.get('name')} is too large for an email, "
+                            f"only {shown} of its {total} CC are sent.")
+            body = self._summary(summary_column, counts, shown, total, bool(links)) + body
+        elif not total:
+            logging.info("Sending an empty report.")
+        if self.group_by:
+            body += ''.join(f'<h3>{html.escape(str(group))} ({counts[group]})</h3>\n{self._table(rendered_rows)}'
+                            for group, rendered_rows in sorted(tables.items(), key=lambda item: str(item[0])))
+        else:
+            body += self._table(tables.get('', []))
+        self.send(REPORT_TITLE.format(team=team.get('name')), body, team.get('recipients'))
+
+    @staticmethod
+    def _table(rendered_rows):
+        header = ''.join(f'<th>{column}</th>' for column in REPORT_COLUMNS)
+        return (f'<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: left;">\n'
+                f'      <th></th>{header}\n    </tr>\n  </thead>\n  <tbody>\n{"".join(rendered_rows)}'
+                f'  </tbody>\n</table>\n')
+
+    @staticmethod
+    def _summary(column, counts, shown, total, linked):
+        rows = ''.join(f'<tr><td>{html.escape(str(group))}</td><td>{count}</td></tr>'
+                       for group, count in sorted(counts.items(), key=lambda item: (-item[1], str(item[0]))))
+        return (f'<p>The report has {total} CC, too many for an email: only the first {shown} are shown below'
+                f'{", see the links for the full report" if linked else ""}.</p>\n'
+                f'<table border="1"><tr><th>{column}</th><th>CC</th></tr>{rows}</table>\n')
+
+
+def create_sinks(report_config, send, store=None, plan=None):
+    """creates the report's sinks out of its configuration, the database and the email always coming first and last."""
+    chunk_size = report_config.get('chunk_size') or DEFAULT_CHUNK_SIZE
+    sinks = [DatabaseSink(store, plan)] if store else []
+    file_config = report_config.get('file') or {}
+    if file_config.get('path'):
+        sinks.append(FileSink(file_config['path'], file_config.get('url'), chunk_size))
+    persistent_sheets = report_config.get('persistent_sheets') or {}
+    if report_config.get('sheets', True) and persistent_sheets.get('path'):
+        sinks.append(PersistentSheetsSink(persistent_sheets['path'],
+                                          persistent_sheets.get('retention') or DEFAULT_SHEETS_RETENTION, chunk_size))
+    elif report_config.get('sheets', True):
+        sinks.append(SheetsSink(chunk_size))
+    email_config = report_config.get('email') or {}
+    sinks.append(EmailSink(send, email_config.get('group_by'), email_config.get('max_size') or DEFAULT_EMAIL_MAX_SIZE,
+                           chunk_size))
+    return sinks
+
+
+def publish(team, rows, sinks):
+    """Outputs the team's report rows to each of the sinks, in order."""
+    links = OrderedDict()
+    for sink in sinks:
+        link = sink.publish(team, rows, links)
+        if link:
+            links[sink.link_description] = link
+    return links
@@ -0,0 +1,76 @@
+import json
+import sqlite3
+import threading
+from time import time
+
+import base
+
+# pulling a bit more than what changed since the last run covers clock skews between us and the servers
+DEFAULT_OVERLAP = 300
+
+
+class SyncStore:
+    """Keeps, in SQLite, when each server's source was last pulled and the open CC it had back then.
+
+    Following runs pull only the CC updated since that watermark and merge them into the stored ones,
+    dropping the CC which got closed or merged meanwhile.
+    """
+
+    def __init__(self, path, overlap=DEFAULT_OVERLAP):
+        self.overlap = overlap
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS sources '
+                             '(server TEXT, source TEXT, watermark REAL, PRIMARY KEY (server, source))')
+            self._db.execute('CREATE TABLE IF NOT EXISTS ccs (server TEXT, source TEXT, position INTEGER, '
+                             'updated_at REAL, row TEXT, PRIMARY KEY (server, source, position))')
+
+    @staticmethod
+    def server_key(server):
+        return f'{server.name}:{server.host}'
+
+    def load(self, server, source):
+        """Returns the source's watermark (None if it was never pulled) and its stored (updated_at, row) pairs."""
+        key = (self.server_key(server), server.source_key(source))
+        with self._lock:
+            watermark = self._db.execute('SELECT watermark FROM sources WHERE server = ? AND source = ?',
+                                         key).fetchone()
+            ccs = self._db.execute('SELECT updated_at, row FROM ccs WHERE server = ? AND source = ? '
+                                   'ORDER BY position', key).fetchall()
+        return (watermark[0] if watermark else None), [(updated_at, json.loads(row)) for updated_at, row in ccs]
+
+    def save(self, server, source, watermark, ccs):
+        key = (self.server_key(server), server.source_key(source))
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?)', key + (watermark,))
+            self._db.execute('DELETE FROM ccs WHERE server = ? AND source = ?', key)
+            # the rows' 'last updated' datetime is kept as the updated_at timestamp instead
+            self._db.executemany('INSERT INTO ccs VALUES (?, ?, ?, ?, ?)', [
+                key + (position, updated_at, json.dumps({name: value for name, value in row.items()
+                                                         if name != 'last updated'}))
+                for position, (updated_at, row) in enumerate(ccs)
+            ])
+
+    def pull(self, server, source):
+        """Returns the source's open CC as report rows, pulling only what changed since its last pull."""
+        started = time()
+        watermark, stored = self.load(server, source)
+        if watermark is None:
+            ccs = [(server.cc_updated_at(cc), server.cc_to_dict(cc)) for cc in server.get_source_ccs(source)]
+        else:
+            ccs, changed_urls = [], set()
+            for cc in server.get_source_ccs(source, updated_after=watermark - self.overlap):
+                row = server.cc_to_dict(cc)
+                if row['web_url'] not in changed_urls:
+                    changed_urls.add(row['web_url'])
+                    if row['state'] == 'open':
+                        ccs.append((server.cc_updated_at(cc), row))
+            # the latest changes go first, as in a full pull sorted by update time
+            ccs += [(updated_at, row) for updated_at, row in stored if row['web_url'] not in changed_urls]
+        self.save(server, source, started, ccs)
+        # the stored rows are loaded as dicts, without their 'last updated' (nor a vendor, from before it was kept)
+        return [row if isinstance(row, base.CodeContribution) else
+                base.CodeContribution.from_row(row, last_updated=server.convert_timestamp_to_datetime(updated_at),
+                                               vendor=server.name)
+                for updated_at, row in ccs]
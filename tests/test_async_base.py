@@ -0,0 +1,26 @@
+import asyncio
+
+import pytest
+
+import async_base
+import base
+
+
+def test_graphql_errors_of_the_org_search_are_raised():
+    server = async_base.AsyncGitHub('github.com', ['acme'], ['*'])
+
+    async def request(method, url, phase=None, **kwargs):
+        return {'errors': [{'type': 'RATE_LIMITED', 'message': 'API rate limit exceeded'}]}, None
+
+    server._request = request
+
+    async def pull():
+        return [pr async for pr in server.get_source_ccs(('org', 'acme'))]
+
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(base.GraphQLError) as raised:
+            loop.run_until_complete(pull())
+    finally:
+        loop.close()
+    assert raised.value.errors[0]['type'] == 'RATE_LIMITED'
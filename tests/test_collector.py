@@ -0,0 +1,82 @@
+import threading
+
+import base
+import collector
+
+
+class Concurrency:
+    """Counts the sources being pulled at once, keeping the highest count."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current = 0
+        self.highest = 0
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.highest = max(self.highest, self.current)
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.current -= 1
+
+
+class FakeServer(base.Server):
+    """A server whose first sources take the longest to pull, so that they finish last."""
+
+    def __init__(self, name, sources, overall, workers=None):
+        super().__init__(name, f'{name.lower()}.example.com', workers)
+        self.sources = sources
+        self.overall = overall
+        self.concurrency = Concurrency()
+
+    def _connect(self):
+        pass
+
+    def _set_namespaces(self, namespaces):
+        pass
+
+    def get_sources(self):
+        return list(self.sources)
+
+    def get_source_ccs(self, source, updated_after=None, **filters):
+        with self.overall, self.concurrency:
+            threading.Event().wait(0.01 * (len(self.sources) - self.sources.index(source)))
+        return [f'{source}#{number}' for number in range(3)]
+
+    def cc_to_dict(self, cc):
+        return cc
+
+    def cc_updated_at(self, cc):
+        return 0
+
+
+def fake_servers():
+    overall = Concurrency()
+    return [FakeServer('GitHub', [f'repo-{number}' for number in range(8)], overall, workers=2),
+            FakeServer('Gitlab', [f'project-{number}' for number in range(6)], overall),
+            FakeServer('Gerrit', [], overall),
+            FakeServer('Gitea', ['org'], overall, workers=1)], overall
+
+
+def test_the_concurrent_collection_yields_what_a_sequential_one_does():
+    servers, _ = fake_servers()
+    sequential = [(server.name, source, rows) for server, source, rows in collector.collect_sequentially(servers)]
+    servers, overall = fake_servers()
+    concurrent = [(server.name, source, rows)
+                  for server, source, rows in collector.collect_sources(servers, workers=4)]
+
+    assert concurrent == sequential
+    assert overall.highest > 1
+
+
+def test_the_sources_pulled_at_once_are_capped_per_server_and_overall():
+    servers, overall = fake_servers()
+    list(collector.collect_sources(servers, workers=3))
+
+    github, gitlab, _, gitea = servers
+    assert github.concurrency.highest == 2
+    assert gitlab.concurrency.highest <= collector.DEFAULT_SERVER_WORKERS
+    assert gitea.concurrency.highest == 1
+    assert overall.highest == 3
@@ -0,0 +1,100 @@
+import itertools
+
+import requests
+
+import http_cache
+
+ETAG = '"v1"'
+LAST_MODIFIED = 'Wed, 01 Jan 2020 00:00:00 GMT'
+
+
+def response(status_code=200, body=b'', **headers):
+    result = requests.Response()
+    result.status_code = status_code
+    result.headers.update({name.replace('_', '-'): value for name, value in headers.items()})
+    result._content = body
+    result._content_consumed = True
+    return result
+
+
+class StubAdapter(http_cache.ConditionalCacheAdapter):
+    """Answers the requests out of a list of responses instead of sending them, keeping the requests it got."""
+
+    def __init__(self, cache, responses, **kwargs):
+        super().__init__(cache, **kwargs)
+        self.responses = responses
+        self.sent = []
+
+    def _send(self, request, **kwargs):
+        self.sent.append(request)
+        return self.responses.pop(0)
+
+
+def get(adapter, url='https://api.example.com/repos', **headers):
+    return adapter.send(requests.Request('GET', url, headers=headers).prepare())
+
+
+def test_a_cached_response_is_revalidated_and_served_when_not_modified(tmp_path):
+    adapter = StubAdapter(http_cache.ResponseCache(str(tmp_path / 'cache.sqlite')), [
+        response(200, b'[1, 2]', ETag=ETAG, Last_Modified=LAST_MODIFIED, Content_Type='application/json'),
+        response(304, X_RateLimit_Remaining='4999'),
+    ])
+    assert get(adapter).json() == [1, 2]
+    assert 'If-None-Match' not in adapter.sent[0].headers
+
+    cached = get(adapter)
+    assert adapter.sent[1].headers['If-None-Match'] == ETAG
+    assert adapter.sent[1].headers['If-Modified-Since'] == LAST_MODIFIED
+    assert (cached.status_code, cached.json()) == (200, [1, 2])
+    assert cached.headers['Content-Type'] == 'application/json'
+    # the fresh headers replace the cached ones
+    assert cached.headers['X-RateLimit-Remaining'] == '4999'
+    assert (adapter.hits, adapter.revalidations, adapter.misses) == (0, 1, 1)
+
+
+def test_a_modified_response_replaces_the_cached_one(tmp_path):
+    adapter = StubAdapter(http_cache.ResponseCache(str(tmp_path / 'cache.sqlite')), [
+        response(200, b'[1]', ETag=ETAG),
+        response(200, b'[1, 2]', ETag='"v2"'),
+        response(304),
+    ])
+    get(adapter)
+    assert get(adapter).json() == [1, 2]
+    assert get(adapter).json() == [1, 2]
+    assert adapter.sent[2].headers['If-None-Match'] == '"v2"'
+    assert (adapter.hits, adapter.revalidations, adapter.misses) == (0, 1, 2)
+
+
+def test_the_responses_younger_than_max_age_are_served_without_asking_the_server(tmp_path):
+    adapter = StubAdapter(http_cache.ResponseCache(str(tmp_path / 'cache.sqlite')), [
+        response(200, b'[1]', ETag=ETAG),
+        response(200, b'[2]'),
+    ], max_age=60)
+    get(adapter)
+    assert get(adapter).json() == [1]
+    assert len(adapter.sent) == 1
+    # another token, or a response without validators, isn't cached
+    assert get(adapter, Authorization='token other').json() == [2]
+    assert len(adapter.sent) == 2
+    assert (adapter.hits, adapter.revalidations, adapter.misses) == (1, 0, 2)
+
+
+def test_the_least_recently_used_responses_are_evicted_past_max_size(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(http_cache, 'time', lambda: next(clock))
+    cache = http_cache.ResponseCache(str(tmp_path / 'cache.sqlite'), max_size=25 / 1024 / 1024)
+    cache.put('a', {'ETag': ETAG}, b'a' * 10)
+    cache.put('b', {'ETag': ETAG}, b'b' * 10)
+    assert cache.get('a')[1] == b'a' * 10
+    cache.put('c', {'ETag': ETAG}, b'c' * 10)
+
+    assert cache.get('b') is None
+    assert cache.get('a')[1] == b'a' * 10
+    assert cache.get('c')[1] == b'c' * 10
+
+
+def test_the_cache_persists_across_runs(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    http_cache.ResponseCache(path).put('a', {'ETag': ETAG}, b'body')
+    headers, body, _ = http_cache.ResponseCache(path).get('a')
+    assert (headers, body) == ({'ETag': ETAG}, b'body')
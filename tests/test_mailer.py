@@ -0,0 +1,98 @@
+import smtplib
+import threading
+from email.message import EmailMessage
+from functools import partial
+
+import mailer
+import metrics
+
+
+class FakeSMTPServer:
+    """Answers each message sent to it with the next of its replies: None delivers it, an exception is raised."""
+
+    def __init__(self, replies=(), delay=0):
+        self.replies = list(replies)
+        self.delay = delay
+        self.sessions = []
+        self.delivered = []
+
+
+class FakeSMTP:
+    def __init__(self, server, host, timeout=None):
+        self.server = server
+        self.closed = False
+        server.sessions.append(self)
+
+    def send_message(self, message):
+        threading.Event().wait(self.server.delay)
+        reply = self.server.replies.pop(0) if self.server.replies else None
+        if reply is not None:
+            raise reply
+        self.server.delivered.append(message['Subject'])
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+def message(subject):
+    result = EmailMessage()
+    result['Subject'] = subject
+    result['To'] = 'team@example.com'
+    result.set_content('report')
+    return result
+
+
+def mailer_of(monkeypatch, server, max_retries=2):
+    monkeypatch.setattr(mailer.smtplib, 'SMTP', partial(FakeSMTP, server))
+    monkeypatch.setattr(metrics, 'run_metrics', metrics.RunMetrics(slow_call=None))
+    return mailer.Mailer('smtp.example.com', max_retries=max_retries, retry_delay=0)
+
+
+def test_a_4xx_reply_is_retried_over_the_same_session(monkeypatch):
+    server = FakeSMTPServer([smtplib.SMTPDataError(451, b'try again later')])
+    run_mailer = mailer_of(monkeypatch, server)
+    run_mailer.send(message('backend'))
+    run_mailer.close()
+
+    assert server.delivered == ['backend']
+    assert (run_mailer.sent, run_mailer.failed, run_mailer.connections) == (1, 0, 1)
+
+
+def test_a_dropped_connection_is_reconnected(monkeypatch):
+    server = FakeSMTPServer([smtplib.SMTPServerDisconnected('Connection unexpectedly closed'),
+                             smtplib.SMTPSenderRefused(421, b'closing the connection', 'reports@example.com')])
+    run_mailer = mailer_of(monkeypatch, server)
+    run_mailer.send(message('backend'))
+    run_mailer.close()
+
+    assert server.delivered == ['backend']
+    assert (run_mailer.sent, run_mailer.failed, run_mailer.connections) == (1, 0, 3)
+    assert all(session.closed for session in server.sessions)
+
+
+def test_the_rejected_and_the_retried_too_many_times_mails_fail_without_stopping_the_others(monkeypatch):
+    server = FakeSMTPServer([smtplib.SMTPDataError(550, b'mailbox unavailable')]
+                            + [smtplib.SMTPDataError(451, b'try again later')] * 3)
+    run_mailer = mailer_of(monkeypatch, server)
+    for subject in ['rejected', 'retried', 'sent']:
+        run_mailer.send(message(subject))
+    run_mailer.close()
+
+    assert server.delivered == ['sent']
+    assert (run_mailer.sent, run_mailer.failed, run_mailer.connections) == (1, 2, 1)
+
+
+def test_close_waits_for_the_queued_mails(monkeypatch):
+    server = FakeSMTPServer(delay=0.02)
+    run_mailer = mailer_of(monkeypatch, server)
+    subjects = [f'team {number}' for number in range(5)]
+    for subject in subjects:
+        run_mailer.send(message(subject))
+    assert len(server.delivered) < len(subjects)
+    run_mailer.close()
+
+    assert server.delivered == subjects
+    assert len(server.sessions) == 1 and server.sessions[0].closed
@@ -0,0 +1,71 @@
+import pytest
+
+import base
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(base, 'time', lambda: now[0])
+    return now
+
+
+def test_the_least_recently_used_entries_are_evicted_past_the_size(clock):
+    cache = base.MetadataCache(size=2)
+    cache.put('project', 'gitlab.com', 1, 'api')
+    cache.put('project', 'gitlab.com', 2, 'web')
+    assert cache.lookup('project', 'gitlab.com', 1) == 'api'
+    cache.put('project', 'gitlab.com', 3, 'docs')
+
+    assert cache.lookup('project', 'gitlab.com', 2) is None
+    assert cache.lookup('project', 'gitlab.com', '1') == 'api'
+    assert cache.lookup('project', 'gitlab.com', 3) == 'docs'
+    # the same id on another host is another entry
+    assert cache.lookup('project', 'gitlab.example.com', 3, 'missing') == 'missing'
+
+
+def test_the_entries_expire_after_the_ttl(clock):
+    cache = base.MetadataCache(ttl=60)
+    cache.put('user', 'github.com', 'alice', 'Alice')
+    clock[0] += 59
+    assert cache.lookup('user', 'github.com', 'alice') == 'Alice'
+    clock[0] += 1
+    assert cache.lookup('user', 'github.com', 'alice') is None
+
+    assert cache.get('user', 'github.com', 'alice', lambda: 'Alice Liddell') == 'Alice Liddell'
+    assert cache.lookup('user', 'github.com', 'alice') == 'Alice Liddell'
+
+
+def test_the_hits_and_misses_are_counted(clock):
+    cache = base.MetadataCache()
+    loads = []
+    for _ in range(3):
+        cache.get('user', 'github.com', 'alice', lambda: loads.append('alice') or 'Alice')
+    cache.lookup('user', 'github.com', 'bob')
+
+    assert loads == ['alice']
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_the_unexpired_entries_are_saved_for_the_next_run(clock, tmp_path):
+    path = str(tmp_path / 'metadata.json')
+    cache = base.MetadataCache(path=path, ttl=60)
+    cache.put('user', 'github.com', 'alice', 'Alice')
+    clock[0] += 30
+    cache.put('project', 'gitlab.com', 7, ['acme', 'api'])
+    cache.save()
+
+    clock[0] += 40
+    next_run = base.MetadataCache(path=path, ttl=60)
+    assert next_run.lookup('user', 'github.com', 'alice') is None
+    assert next_run.lookup('project', 'gitlab.com', 7) == ['acme', 'api']
+    # an entry keeps its age across runs
+    clock[0] += 20
+    assert next_run.lookup('project', 'gitlab.com', 7) is None
+
+
+def test_a_missing_or_corrupted_file_starts_cold(clock, tmp_path):
+    assert base.MetadataCache(path=str(tmp_path / 'missing.json')).lookup('user', 'github.com', 'alice') is None
+    corrupted = tmp_path / 'corrupted.json'
+    corrupted.write_text('[["user", "github.com"')
+    assert base.MetadataCache(path=str(corrupted)).lookup('user', 'github.com', 'alice') is None
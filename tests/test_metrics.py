@@ -0,0 +1,127 @@
+import logging
+import threading
+
+import pytest
+
+import metrics
+
+GITHUB = {'phase': 'list', 'server': 'GitHub', 'host': 'api.github.com', 'namespace': 'acme'}
+
+
+def calls(run_metrics):
+    return {tuple(call[label] for label in metrics.LABELS): (call['calls'], call['errors'], round(call['seconds'], 1))
+            for call in run_metrics.summary()['calls']}
+
+
+def test_the_tags_nest_and_are_restored():
+    with metrics.tagged(phase='list', server='GitHub'):
+        with metrics.tagged(namespace='acme', server='GitHub Enterprise'):
+            assert metrics.current_tags() == {'phase': 'list', 'server': 'GitHub Enterprise', 'namespace': 'acme'}
+        assert metrics.current_tags() == {'phase': 'list', 'server': 'GitHub'}
+        with pytest.raises(ValueError):
+            with metrics.tagged(phase='enrich'):
+                raise ValueError
+        assert metrics.current_tags() == {'phase': 'list', 'server': 'GitHub'}
+    assert metrics.current_tags() == {}
+
+
+def test_the_calls_are_aggregated_by_their_tags_across_threads():
+    run_metrics = metrics.RunMetrics(slow_call=None)
+
+    def pull(namespace):
+        with metrics.tagged(phase='list', server='GitHub', host='api.github.com', namespace=namespace):
+            for _ in range(100):
+                run_metrics.record(0.5)
+            # the recorded tags complete, or override, the thread's ones
+            run_metrics.record(1, phase='enrich')
+
+    threads = [threading.Thread(target=pull, args=(namespace,)) for namespace in ['acme', 'acme', 'acme-ui']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with pytest.raises(RuntimeError), run_metrics.timed('GET /user', **GITHUB):
+        raise RuntimeError
+
+    assert calls(run_metrics) == {
+        ('list', 'GitHub', 'api.github.com', 'acme'): (201, 1, 100.0),
+        ('enrich', 'GitHub', 'api.github.com', 'acme'): (2, 0, 2.0),
+        ('list', 'GitHub', 'api.github.com', 'acme-ui'): (100, 0, 50.0),
+        ('enrich', 'GitHub', 'api.github.com', 'acme-ui'): (1, 0, 1.0),
+    }
+
+
+def test_the_team_totals_add_up():
+    run_metrics = metrics.RunMetrics(slow_call=None)
+    with metrics.tagged(team='backend'):
+        run_metrics.record(2, **GITHUB)
+        run_metrics.record(1, phase='email', server='SMTP')
+    run_metrics.record_team('backend', rows=3, requests=2)
+    run_metrics.record_team('backend', rows=2)
+    run_metrics.record_team('frontend', rows=1)
+
+    assert run_metrics.summary()['teams'] == [
+        {'team': 'backend', 'phases': {'list': {'calls': 1, 'seconds': 2}, 'email': {'calls': 1, 'seconds': 1}},
+         'rows': 5, 'requests': 2},
+        {'team': 'frontend', 'rows': 1},
+    ]
+
+
+def test_the_prometheus_textfile():
+    run_metrics = metrics.RunMetrics(slow_call=None)
+    with metrics.tagged(team='back "end"'):
+        run_metrics.record(0.5, **GITHUB)
+        run_metrics.record(1.5, error=True, **GITHUB)
+    run_metrics.record(0.25, phase='email', server='SMTP', host='smtp.example.com')
+    run_metrics.record_team('back "end"', rows=5, requests=2)
+    run_metrics.record_team('frontend', rows=1)
+    summary = dict(run_metrics.summary(), started_at=1577836800, duration_seconds=12.5)
+
+    assert run_metrics.prometheus(summary) == '''\
+# HELP batyam_run_timestamp_seconds When the last run started.
+# TYPE batyam_run_timestamp_seconds gauge
+batyam_run_timestamp_seconds 1577836800.000
+# HELP batyam_run_duration_seconds How long the last run took.
+# TYPE batyam_run_duration_seconds gauge
+batyam_run_duration_seconds 12.500
+# HELP batyam_calls Outbound calls of the last run.
+# TYPE batyam_calls gauge
+batyam_calls{phase="list",server="GitHub",host="api.github.com",namespace="acme"} 2
+batyam_calls{phase="email",server="SMTP",host="smtp.example.com",namespace=""} 1
+# HELP batyam_call_errors Outbound calls of the last run which failed.
+# TYPE batyam_call_errors gauge
+batyam_call_errors{phase="list",server="GitHub",host="api.github.com",namespace="acme"} 1
+batyam_call_errors{phase="email",server="SMTP",host="smtp.example.com",namespace=""} 0
+# HELP batyam_call_seconds Seconds spent in outbound calls during the last run.
+# TYPE batyam_call_seconds gauge
+batyam_call_seconds{phase="list",server="GitHub",host="api.github.com",namespace="acme"} 2
+batyam_call_seconds{phase="email",server="SMTP",host="smtp.example.com",namespace=""} 0.25
+# HELP batyam_call_max_seconds Slowest outbound call of the last run.
+# TYPE batyam_call_max_seconds gauge
+batyam_call_max_seconds{phase="list",server="GitHub",host="api.github.com",namespace="acme"} 1.5
+batyam_call_max_seconds{phase="email",server="SMTP",host="smtp.example.com",namespace=""} 0.25
+# HELP batyam_team_phase_seconds Seconds spent in a phase for a team during the last run.
+# TYPE batyam_team_phase_seconds gauge
+batyam_team_phase_seconds{team="back \\"end\\"",phase="list"} 2
+# HELP batyam_team_requests The team's requests during the last run.
+# TYPE batyam_team_requests gauge
+batyam_team_requests{team="back \\"end\\""} 2
+# HELP batyam_team_rows The team's rows during the last run.
+# TYPE batyam_team_rows gauge
+batyam_team_rows{team="back \\"end\\""} 5
+batyam_team_rows{team="frontend"} 1
+'''
+
+
+def test_only_the_calls_slower_than_the_threshold_are_logged(caplog):
+    caplog.set_level(logging.WARNING)
+    run_metrics = metrics.RunMetrics(slow_call=1)
+    run_metrics.record(0.5, 'GET /repos', **GITHUB)
+    run_metrics.record(2, 'GET /repos', **GITHUB)
+    run_metrics.record(1, 'send message', phase='email', host='smtp.example.com')
+    metrics.RunMetrics(slow_call=None).record(100, 'GET /repos', **GITHUB)
+
+    assert [record.getMessage() for record in caplog.records] == [
+        'Slow list call to GitHub (acme): GET /repos took 2.0 seconds.',
+        'Slow email call to smtp.example.com: send message took 1.0 seconds.',
+    ]
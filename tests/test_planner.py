@@ -0,0 +1,148 @@
+from datetime import datetime, timezone
+
+import base
+import planner
+
+UPDATED = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeServer(base.Server):
+    """A server whose sources are the orgs it's configured with."""
+
+    def __init__(self, vendor, host, namespaces):
+        super().__init__(vendor, host)
+        self.namespaces = list(namespaces or [])
+
+    def _connect(self):
+        pass
+
+    def _set_namespaces(self, namespaces):
+        pass
+
+    def get_sources(self):
+        return list(self.namespaces)
+
+    def get_source_ccs(self, source, updated_after=None, **filters):
+        return []
+
+    def source_namespace(self, source):
+        return source
+
+    def source_scope(self, source):
+        return ('url', f'https://{self.host}/{source}/') if source else None
+
+    def cc_to_dict(self, cc):
+        return cc
+
+    def cc_updated_at(self, cc):
+        return 0
+
+
+def create_fake_servers(team):
+    return [FakeServer(server['vendor'], server['host'], server.get('namespaces'))
+            for server in team.get('servers')]
+
+
+def cc(vendor, project, contributor, number):
+    return base.CodeContribution(project, UPDATED, contributor, 'open', f'Change {number}',
+                                 f'https://{vendor.lower()}.example.com/{project}/{number}', vendor)
+
+
+TEAMS = [
+    {'name': 'backend', 'servers': [
+        {'vendor': 'GitHub', 'host': 'github.com', 'namespaces': ['acme'], 'repositories': ['api', 'shared'],
+         'bot_users': ['dependabot']},
+        {'vendor': 'Gerrit', 'host': 'review.example.com', 'repositories': ['core'], 'bot_users': ['ci-bot']},
+    ]},
+    {'name': 'frontend', 'servers': [
+        {'vendor': 'github', 'host': 'github.com', 'namespaces': ['acme', 'acme-ui'], 'repositories': ['web', 'shared'],
+         'bot_users': ['dependabot', 'renovate']},
+    ]},
+    {'name': 'everything', 'servers': [
+        {'vendor': 'Gerrit', 'host': 'review.example.com', 'repositories': ['*']},
+    ]},
+]
+
+
+def test_the_teams_servers_are_merged_per_host():
+    plan = planner.RunPlan(TEAMS)
+    github = plan.servers[('github', 'github.com', None)]
+    assert github['namespaces'] == ['acme', 'acme-ui']
+    assert github['repositories'] == ['api', 'shared', 'web']
+    # a bot is only dropped when every team drops it
+    assert github['bot_users'] == ['dependabot']
+    gerrit = plan.servers[('gerrit', 'review.example.com', None)]
+    assert gerrit['repositories'] == ['*']
+    assert gerrit['bot_users'] == []
+
+
+def test_the_teams_with_different_base_branches_dont_share_a_server():
+    plan = planner.RunPlan([
+        {'name': 'a', 'servers': [{'vendor': 'GitHub', 'host': 'github.com', 'base_branch': 'main'}]},
+        {'name': 'b', 'servers': [{'vendor': 'GitHub', 'host': 'github.com'}]},
+    ])
+    assert list(plan.servers) == [('github', 'github.com', 'main'), ('github', 'github.com', None)]
+
+
+def test_each_team_gets_the_rows_of_its_repositories_without_its_bots():
+    plan = planner.RunPlan(TEAMS)
+    github, gerrit = plan.create_servers(create_fake_servers)
+    api = cc('GitHub', 'api', 'alice', 1)
+    shared = cc('GitHub', 'shared', 'bob', 2)
+    web = cc('GitHub', 'web', 'carol', 3)
+    web_ui = cc('GitHub', 'web', 'dan', 4)
+    renovate = cc('GitHub', 'shared', 'renovate', 5)
+    dependabot = cc('GitHub', 'api', 'dependabot', 6)
+    core = cc('Gerrit', 'core', 'erin', 7)
+    other = cc('Gerrit', 'other', 'frank', 8)
+    ci = cc('Gerrit', 'core', 'ci-bot', 9)
+
+    backend, frontend, everything = plan.split([
+        (github, 'acme', [api, shared, web, renovate, dependabot]),
+        (github, 'acme-ui', [web_ui]),
+        (gerrit, None, [core, other, ci]),
+    ])
+
+    assert backend == [api, shared, renovate, core]
+    # acme-ui's rows only go to the team which asked for that org
+    assert frontend == [shared, web, web_ui]
+    assert everything == [core, other, ci]
+    # the teams share the rows rather than copies of them
+    assert backend[1] is frontend[0]
+
+
+def test_the_teams_wanting_a_row_out_of_an_event():
+    plan = planner.RunPlan(TEAMS)
+    _, gerrit = plan.create_servers(create_fake_servers)
+    assert [team['name'] for team in plan.teams_wanting(gerrit, None, cc('Gerrit', 'core', 'erin', 1))] == \
+        ['backend', 'everything']
+    assert [team['name'] for team in plan.teams_wanting(gerrit, None, cc('Gerrit', 'core', 'ci-bot', 2))] == \
+        ['everything']
+
+
+def test_only_the_sources_pulled_for_a_team_are_within_its_scopes():
+    plan = planner.RunPlan(TEAMS)
+    github, gerrit = plan.create_servers(create_fake_servers)
+    # acme-ui failed to be pulled, and Gerrit's source can't be told apart once stored
+    plan.split([(github, 'acme', []), (gerrit, None, [])])
+
+    assert plan.pulled_scopes(TEAMS[0]) == [('GitHub', 'url', 'https://github.com/acme/')]
+    assert plan.pulled_scopes(TEAMS[1]) == [('GitHub', 'url', 'https://github.com/acme/')]
+    assert plan.pulled_scopes(TEAMS[2]) == []
+
+
+def test_each_team_is_yielded_as_soon_as_its_servers_are_pulled():
+    plan = planner.RunPlan(TEAMS + [{'name': 'nothing', 'servers': []}])
+    github, gerrit = plan.create_servers(create_fake_servers)
+    events = []
+
+    def pulled():
+        for server, source in [(github, 'acme'), (github, 'acme-ui'), (gerrit, None)]:
+            events.append(source)
+            yield server, source, []
+
+    for team, rows in plan.split_as_pulled(pulled()):
+        events.append(team['name'])
+
+    # the frontend only waits for GitHub, the backend and everything also wait for Gerrit
+    assert events == ['acme', 'nothing', 'acme-ui', None, 'frontend', 'backend', 'everything']
@@ -0,0 +1,141 @@
+import threading
+from email.utils import formatdate
+from time import time
+
+import requests
+
+import ratelimit
+
+
+def response(status_code=200, **headers):
+    """A response of the given status and headers, without a body."""
+    result = requests.Response()
+    result.status_code = status_code
+    result.headers.update({name.replace('_', '-'): str(value) for name, value in headers.items()})
+    result._content = b''
+    result._content_consumed = True
+    return result
+
+
+def acquire_in_thread(scheduler, cost, acquired):
+    thread = threading.Thread(target=lambda: (scheduler.acquire(cost), acquired.append(cost)), daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for(condition, timeout=2):
+    deadline = time() + timeout
+    while not condition() and time() < deadline:
+        threading.Event().wait(0.01)
+    return condition()
+
+
+def test_the_cheapest_waiting_request_goes_first():
+    scheduler = ratelimit.RateLimitScheduler('api.example.com', max_concurrency=1)
+    scheduler.acquire()
+    acquired = []
+    threads = [acquire_in_thread(scheduler, 3, acquired)]
+    assert wait_for(lambda: len(scheduler._waiting) == 1)
+    threads.append(acquire_in_thread(scheduler, 1, acquired))
+    assert wait_for(lambda: len(scheduler._waiting) == 2)
+
+    scheduler.release(response())
+    assert wait_for(lambda: acquired == [1])
+    scheduler.release(response())
+    assert wait_for(lambda: acquired == [1, 3])
+    for thread in threads:
+        thread.join(1)
+
+
+def test_no_more_requests_at_once_than_the_quota_has_left():
+    scheduler = ratelimit.RateLimitScheduler('api.example.com', max_concurrency=10)
+    scheduler.acquire()
+    scheduler.release(response(X_RateLimit_Remaining=2, X_RateLimit_Reset=time() + 60, X_RateLimit_Limit=5000))
+    scheduler.acquire()
+    scheduler.acquire()
+    acquired = []
+    thread = acquire_in_thread(scheduler, 1, acquired)
+    assert not wait_for(lambda: acquired, timeout=0.2)
+
+    scheduler.release(response(X_RateLimit_Remaining=3, X_RateLimit_Reset=time() + 60))
+    assert wait_for(lambda: acquired == [1])
+    thread.join(1)
+    assert (scheduler.remaining, scheduler.limit, sum(scheduler.usage.values())) == (3, 5000, 4)
+
+
+def test_the_quota_is_renewed_at_its_reset_time():
+    scheduler = ratelimit.RateLimitScheduler('api.example.com')
+    scheduler.acquire()
+    scheduler.release(response(RateLimit_Remaining=0, RateLimit_Reset=time() + 0.2))
+    started = time()
+    scheduler.acquire()
+    assert 0.1 < time() - started < 2
+    assert scheduler.remaining is None
+
+
+def test_an_exhausted_quota_without_a_reset_time_is_probed_after_a_while(monkeypatch):
+    monkeypatch.setattr(ratelimit, 'EXHAUSTED_WAIT', 0.2)
+    scheduler = ratelimit.RateLimitScheduler('api.example.com')
+    scheduler.acquire()
+    assert scheduler.release(response(RateLimit_Remaining=0)) is None
+    acquired = []
+    thread = acquire_in_thread(scheduler, 1, acquired)
+    thread.join(2)
+    assert acquired == [1]
+
+
+def test_throttled_responses():
+    scheduler = ratelimit.RateLimitScheduler('api.example.com')
+    scheduler.acquire()
+    assert scheduler.release(response(429, Retry_After=30)) == 30
+    scheduler.acquire()
+    assert 80 < scheduler.release(response(429, Retry_After=formatdate(time() + 90, usegmt=True))) <= 90
+    scheduler.acquire()
+    assert scheduler.release(response(429, Retry_After='soon')) == 0
+    scheduler.acquire()
+    assert scheduler.release(response(403)) is None  # a permission error
+    scheduler.acquire()
+    assert scheduler.release(response(404)) is None
+    scheduler.acquire()
+    assert 50 < scheduler.release(response(403, X_RateLimit_Remaining=0, X_RateLimit_Reset=time() + 60)) <= 60
+
+
+def test_back_off_holds_all_the_requests(monkeypatch):
+    monkeypatch.setattr(ratelimit.random, 'uniform', lambda low, high: 0)
+    scheduler = ratelimit.RateLimitScheduler('api.example.com')
+    scheduler.back_off(0, 3)
+    assert 15 < scheduler.blocked_until - time() <= 16
+    scheduler.back_off(30, 0)
+    assert 29 < scheduler.blocked_until - time() <= 30
+
+    scheduler.blocked_until = time() + 0.2
+    started = time()
+    scheduler.acquire()
+    assert time() - started >= 0.15
+
+
+class FakeAdapter(ratelimit.RateLimitedAdapter):
+    """Answers the requests out of a list of responses, instead of sending them."""
+
+    def __init__(self, scheduler, responses):
+        super().__init__(scheduler)
+        self.responses = responses
+        self.sent = 0
+
+    def _send(self, request, **kwargs):
+        self.sent += 1
+        return self.responses.pop(0)
+
+
+def test_the_throttled_requests_are_retried(monkeypatch):
+    monkeypatch.setattr(ratelimit, 'BACKOFF_BASE', 0)
+    request = requests.Request('GET', 'https://api.example.com/repos').prepare()
+    adapter = FakeAdapter(ratelimit.RateLimitScheduler('api.example.com', max_retries=2),
+                          [response(429, Retry_After=0), response(429, Retry_After=0), response(200)])
+    assert adapter.send(request).status_code == 200
+    assert adapter.sent == 3
+
+    adapter = FakeAdapter(ratelimit.RateLimitScheduler('api.example.com', max_retries=1),
+                          [response(429, Retry_After=0), response(429, Retry_After=0), response(200)])
+    assert adapter.send(request).status_code == 429
+    assert adapter.sent == 2
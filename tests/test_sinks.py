@@ -0,0 +1,280 @@
+import csv
+import json
+import re
+from datetime import datetime, timezone
+
+import pytest
+
+import base
+import google_spreadsheets
+import sinks
+
+UPDATED = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeSpreadsheets:
+    """Stands in for the Google spreadsheets of google_spreadsheets, applying the batchUpdate requests to lists."""
+
+    def __init__(self):
+        self.spreadsheets = {}
+        self.batch_updates = []
+
+    def create_spreadsheet(self, title, sheet_title, dated=True):
+        spreadsheet_id = f'spreadsheet-{len(self.spreadsheets)}'
+        self.spreadsheets[spreadsheet_id] = [{'sheetId': 0, 'title': sheet_title, 'rows': []}]
+        return self.get_spreadsheet(spreadsheet_id)
+
+    def get_spreadsheet(self, spreadsheet_id):
+        if spreadsheet_id not in self.spreadsheets:
+            return None
+        return {'spreadsheetId': spreadsheet_id,
+                'spreadsheetUrl': f'https://docs.google.com/spreadsheets/d/{spreadsheet_id}/edit',
+                'sheets': [{'properties': {'sheetId': sheet['sheetId'], 'title': sheet['title']}}
+                           for sheet in self.spreadsheets[spreadsheet_id]]}
+
+    def share_spreadsheet(self, spreadsheet):
+        return spreadsheet['spreadsheetUrl'].rsplit('/', 1)[0]
+
+    def get_values(self, spreadsheet_id, sheet_title):
+        sheet = next(sheet for sheet in self.spreadsheets[spreadsheet_id] if sheet['title'] == sheet_title)
+        values = [list(row) for row in sheet['rows']]
+        for row in values:
+            while row and row[-1] == '':
+                row.pop()
+        return values
+
+    def batch_update(self, spreadsheet_id, requests):
+        self.batch_updates.append(requests)
+        apply(self.spreadsheets[spreadsheet_id], requests)
+
+
+def cell_values(row_data):
+    return [cell.get('userEnteredValue', {}).get('stringValue', '') for cell in row_data['values']]
+
+
+def apply(sheets, requests):
+    """Applies the requests of a batchUpdate to the sheets, each a dict holding its rows of values."""
+    for request in requests:
+        (kind, body), = request.items()
+        if kind == 'addSheet':
+            properties = body['properties']
+            sheets.insert(properties['index'], {'sheetId': properties['sheetId'], 'title': properties['title'],
+                                                'rows': []})
+        elif kind == 'duplicateSheet':
+            source = next(sheet for sheet in sheets if sheet['sheetId'] == body['sourceSheetId'])
+            sheets.insert(body['insertSheetIndex'], {'sheetId': body['newSheetId'], 'title': body['newSheetName'],
+                                                     'rows': [list(row) for row in source['rows']]})
+        elif kind == 'deleteSheet':
+            sheets[:] = [sheet for sheet in sheets if sheet['sheetId'] != body['sheetId']]
+        else:
+            sheet_id = body['range']['sheetId'] if kind == 'deleteDimension' else \
+                body['start']['sheetId'] if kind == 'updateCells' else body['sheetId']
+            rows = next(sheet for sheet in sheets if sheet['sheetId'] == sheet_id)['rows']
+            if kind == 'deleteDimension':
+                assert body['range']['dimension'] == 'ROWS'
+                del rows[body['range']['startIndex']:body['range']['endIndex']]
+            elif kind == 'updateCells':
+                assert body['start']['columnIndex'] == 0
+                start = body['start']['rowIndex']
+                for offset, row_data in enumerate(body['rows']):
+                    rows[start + offset] = cell_values(row_data)
+            else:
+                rows.extend(cell_values(row_data) for row_data in body['rows'])
+
+
+@pytest.fixture
+def fake_spreadsheets(monkeypatch):
+    fake = FakeSpreadsheets()
+    for name in ('create_spreadsheet', 'get_spreadsheet', 'share_spreadsheet', 'get_values', 'batch_update'):
+        monkeypatch.setattr(google_spreadsheets, name, getattr(fake, name))
+    return fake
+
+
+def freeze_today(monkeypatch, day):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.strptime(day, '%Y-%m-%d')
+
+    monkeypatch.setattr(sinks, 'datetime', FrozenDatetime)
+
+
+def cc(number, title=None):
+    return base.CodeContribution(f'project-{number % 3}', UPDATED, f'contributor-{number % 5}', 'open',
+                                 title or f'Change {number}', f'https://git.example.com/changes/{number}', 'GitLab')
+
+
+def sheet_of(rows):
+    """Returns the values of a sheet holding the rows, in their order."""
+    return [sinks.REPORT_COLUMNS] + [sinks.PersistentSheetsSink._values(row) for row in rows]
+
+
+def test_the_diff_deletes_from_the_bottom_up_then_updates_the_shifted_rows_then_appends(tmp_path):
+    sink = sinks.PersistentSheetsSink(str(tmp_path / 'spreadsheets.json'), chunk_size=2)
+    previous = sheet_of([cc(number) for number in range(1, 9)])
+    rows = [cc(9), cc(1), cc(4, title='Renamed'), cc(5), cc(7, title='Renamed too'), cc(8), cc(10)]
+
+    requests = sink._diff(rows, previous, sheet_id=7)
+
+    kinds = [kind for request in requests for kind in request]
+    assert kinds == ['deleteDimension', 'deleteDimension', 'updateCells', 'updateCells', 'appendCells']
+    # 6 first (row 6), then 2 and 3 (rows 2 and 3), so the rows above each deletion keep their places
+    assert [(request['deleteDimension']['range']['startIndex'], request['deleteDimension']['range']['endIndex'])
+            for request in requests[:2]] == [(6, 7), (2, 4)]
+    # 4 and 7 moved up to rows 2 and 4
+    assert [(request['updateCells']['start']['rowIndex'], len(request['updateCells']['rows']))
+            for request in requests[2:4]] == [(2, 1), (4, 1)]
+    assert len(requests[4]['appendCells']['rows']) == 2
+    sheet = [{'sheetId': 7, 'title': '2020-01-01', 'rows': [list(values) for values in previous]}]
+    apply(sheet, requests)
+    # the rows keep their places, the new ones come last
+    assert sheet[0]['rows'] == sheet_of([cc(1), cc(4, title='Renamed'), cc(5), cc(7, title='Renamed too'), cc(8),
+                                         cc(9), cc(10)])
+
+
+def test_the_diff_fixes_the_header_and_appends_it_to_an_empty_sheet(tmp_path):
+    sink = sinks.PersistentSheetsSink(str(tmp_path / 'spreadsheets.json'))
+    previous = [['project', 'age']] + sheet_of([cc(1)])[1:]
+
+    sheet = [{'sheetId': 0, 'title': '2020-01-01', 'rows': [list(values) for values in previous]}]
+    apply(sheet, sink._diff([cc(1)], previous, 0))
+    assert sheet[0]['rows'] == sheet_of([cc(1)])
+
+    sheet = [{'sheetId': 0, 'title': '2020-01-01', 'rows': []}]
+    apply(sheet, sink._diff([cc(1), cc(2)], [], 0))
+    assert sheet[0]['rows'] == sheet_of([cc(1), cc(2)])
+
+
+def test_publishes_a_tab_per_day_only_sending_the_changes(tmp_path, monkeypatch, fake_spreadsheets):
+    path = str(tmp_path / 'spreadsheets.json')
+    team = {'name': 'team-a'}
+    freeze_today(monkeypatch, '2020-01-01')
+    sink = sinks.PersistentSheetsSink(path, retention=2)
+    assert sink.publish(team, iter([]), {}) is None
+    assert not fake_spreadsheets.spreadsheets
+
+    url = sink.publish(team, iter([cc(1), cc(2), cc(3)]), {})
+    assert url == 'https://docs.google.com/spreadsheets/d/spreadsheet-0'
+    assert fake_spreadsheets.get_values('spreadsheet-0', '2020-01-01') == sheet_of([cc(1), cc(2), cc(3)])
+
+    # the spreadsheet is found again by the next runs, which send nothing when nothing changed
+    freeze_today(monkeypatch, '2020-01-02')
+    sink = sinks.PersistentSheetsSink(path, retention=2)
+    assert sink.publish(team, iter([cc(1), cc(2), cc(3)]), {}) == url
+    assert len(fake_spreadsheets.batch_updates) == 1
+
+    sink.publish(team, iter([cc(1), cc(3, title='Renamed'), cc(4)]), {})
+    freeze_today(monkeypatch, '2020-01-03')
+    sink.publish(team, iter([cc(3, title='Renamed'), cc(4), cc(5)]), {})
+
+    # today's tab comes first, and only the 'retention' latest tabs are kept
+    sheets = fake_spreadsheets.spreadsheets['spreadsheet-0']
+    assert [sheet['title'] for sheet in sheets] == ['2020-01-03', '2020-01-02']
+    assert fake_spreadsheets.get_values('spreadsheet-0', '2020-01-02') == \
+        sheet_of([cc(1), cc(3, title='Renamed'), cc(4)])
+    assert fake_spreadsheets.get_values('spreadsheet-0', '2020-01-03') == \
+        sheet_of([cc(3, title='Renamed'), cc(4), cc(5)])
+
+
+def report_rows(count):
+    return [base.CodeContribution(f'project-{number % 3}', UPDATED, f'contributor-{number % 5}', 'open',
+                                  f'Change <{number}>', f'https://git.example.com/changes/{number}', 'GitLab')
+            for number in range(count)]
+
+
+class Outbox:
+    def __init__(self):
+        self.sent = []
+
+    def __call__(self, subject, body, recipients=None):
+        self.sent.append((subject, body, recipients))
+
+
+def shown_titles(body):
+    return re.findall(r'<td>(Change &lt;\d+&gt;)</td>', body)
+
+
+def test_the_email_holds_the_whole_report_with_the_links_first():
+    outbox = Outbox()
+    sinks.EmailSink(outbox, chunk_size=2).publish({'name': 'team-a', 'recipients': ['a@example.com']},
+                                                  iter(report_rows(5)), {'for download': 'https://files/team-a.csv'})
+
+    (subject, body, recipients), = outbox.sent
+    assert (subject, recipients) == ('Open Code Contributions - team-a', ['a@example.com'])
+    assert body.startswith('<p>The report is also available for download:<br> https://files/team-a.csv</p>')
+    assert 'too many for an email' not in body
+    assert shown_titles(body) == [f'Change &lt;{number}&gt;' for number in range(5)]
+    assert body.count('<table') == 1
+
+
+def test_an_oversized_email_starts_with_a_summary_of_the_whole_report():
+    outbox = Outbox()
+    sinks.EmailSink(outbox, max_size=1).publish({'name': 'team-a'}, iter(report_rows(20)),
+                                                {'for download': 'https://files/team-a.csv'})
+
+    (_, body, _), = outbox.sent
+    titles = shown_titles(body)
+    # the rows fitting in 1 KB of table, in the report's order
+    assert 0 < len(titles) < 20
+    assert titles == [f'Change &lt;{number}&gt;' for number in range(len(titles))]
+    assert body.startswith(f'<p>The report has 20 CC, too many for an email: only the first {len(titles)} are '
+                           f'shown below, see the links for the full report.</p>')
+    # the summary counts all the CC per project, the largest groups first
+    assert '<tr><th>project</th><th>CC</th></tr><tr><td>project-0</td><td>7</td></tr>' \
+           '<tr><td>project-1</td><td>7</td></tr><tr><td>project-2</td><td>6</td></tr></table>' in body
+    assert body.index('https://files/team-a.csv') < body.index('<table border="1" class="dataframe">')
+
+
+def test_the_email_groups_the_report_by_a_column():
+    outbox = Outbox()
+    sinks.EmailSink(outbox, group_by='project').publish({'name': 'team-a'}, iter(reversed(report_rows(5))), {})
+
+    (_, body, _), = outbox.sent
+    assert re.findall(r'<h3>(.*?)</h3>', body) == ['project-0 (2)', 'project-1 (2)', 'project-2 (1)']
+    groups = body.split('<h3>')[1:]
+    assert shown_titles(groups[0]) == ['Change &lt;3&gt;', 'Change &lt;0&gt;']
+    assert shown_titles(groups[2]) == ['Change &lt;2&gt;']
+
+    with pytest.raises(ValueError):
+        sinks.EmailSink(outbox, group_by='vendor')
+
+
+def test_the_report_is_written_to_a_csv_file(tmp_path, monkeypatch):
+    freeze_today(monkeypatch, '2020-01-02')
+    sink = sinks.FileSink(str(tmp_path / 'reports' / '{team}-{date}.csv'), 'https://files/{team}-{date}.csv',
+                          chunk_size=2)
+
+    assert sink.publish({'name': 'team-a'}, iter(report_rows(3)), {}) == 'https://files/team-a-2020-01-02.csv'
+
+    with open(tmp_path / 'reports' / 'team-a-2020-01-02.csv', newline='') as report_file:
+        lines = list(csv.reader(report_file))
+    assert lines[0] == sinks.FILE_COLUMNS
+    assert lines[1] == ['project-0', '2020-01-01T00:00:00+00:00', 'contributor-0', 'open', 'Change <0>',
+                        'https://git.example.com/changes/0', 'GitLab']
+    assert len(lines) == 4
+
+
+def test_the_report_is_written_to_a_json_file(tmp_path):
+    path = tmp_path / 'team-a.json'
+    assert sinks.FileSink(str(path)).publish({'name': 'team-a'}, iter(report_rows(2)), {}) is None
+
+    assert json.loads(path.read_text()) == [
+        {'project': f'project-{number}', 'last updated': '2020-01-01T00:00:00+00:00',
+         'contributor': f'contributor-{number}', 'state': 'open', 'title': f'Change <{number}>',
+         'web_url': f'https://git.example.com/changes/{number}', 'vendor': 'GitLab'} for number in range(2)]
+    assert sinks.FileSink(str(path)).publish({'name': 'team-a'}, iter([]), {}) is None
+    assert json.loads(path.read_text()) == []
+
+
+def test_a_failed_write_keeps_the_previous_file(tmp_path):
+    path = tmp_path / 'team-a.csv'
+    path.write_text('previous report\n')
+
+    def failing_rows():
+        yield from report_rows(2)
+        raise RuntimeError('the collection failed')
+
+    with pytest.raises(RuntimeError):
+        sinks.FileSink(str(path)).publish({'name': 'team-a'}, failing_rows(), {})
+    assert path.read_text() == 'previous report\n'
+    assert [file.name for file in tmp_path.iterdir()] == ['team-a.csv']
@@ -0,0 +1,177 @@
+import json
+
+import base
+import sync
+
+T0 = 1600000000
+
+
+class FakeGerrit(base.Gerrit):
+    """A Gerrit server answering its queries out of a list of patches, recording the updated_after it's given."""
+
+    def __init__(self, patches):
+        base.Server.__init__(self, 'Gerrit', 'review.example.com')
+        self.bot_users = []
+        self.patches = patches
+        self.queries = []
+
+    def get_sources(self):
+        return [('core',)]
+
+    def get_source_ccs(self, projects, status='open', updated_after=None):
+        self.queries.append(updated_after)
+        if updated_after is None:
+            return [patch for patch in self.patches if patch['status'] == 'NEW']
+        return [patch for patch in self.patches if patch['lastUpdated'] >= updated_after]
+
+
+def patch(number, updated, status='NEW', subject=None):
+    return {'project': 'core', 'owner': {'name': 'alice'}, 'status': status, 'subject': subject or f'Change {number}',
+            'url': f'https://review.example.com/c/{number}', 'lastUpdated': updated}
+
+
+def titles(rows):
+    return [row['title'] for row in rows]
+
+
+def test_a_cc_closed_between_two_pulls_drops_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync, 'time', lambda: T0 + 1000)
+    server = FakeGerrit([patch(1, T0 + 30), patch(2, T0 + 20), patch(3, T0 + 10), patch(4, T0, 'MERGED')])
+    store = sync.SyncStore(str(tmp_path / 'sync.sqlite'), overlap=300)
+
+    first = store.pull(server, ('core',))
+    assert titles(first) == ['Change 1', 'Change 2', 'Change 3']
+    assert all(isinstance(row, base.CodeContribution) and row['vendor'] == 'Gerrit' for row in first)
+
+    # meanwhile, 2 is merged, 3 is renamed and 5 is opened, while 1 isn't touched
+    server.patches = [patch(1, T0 + 30), patch(2, T0 + 2000, 'MERGED'), patch(3, T0 + 2100, subject='Renamed'),
+                      patch(4, T0, 'MERGED'), patch(5, T0 + 2200)]
+    monkeypatch.setattr(sync, 'time', lambda: T0 + 3000)
+    second = store.pull(server, ('core',))
+
+    assert server.queries == [None, T0 + 1000 - 300]
+    assert titles(second) == ['Renamed', 'Change 5', 'Change 1']
+    assert second[2]['last updated'] == base.Server.convert_timestamp_to_datetime(T0 + 30)
+
+
+def test_the_store_is_kept_between_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync, 'time', lambda: T0 + 1000)
+    path = str(tmp_path / 'sync.sqlite')
+    server = FakeGerrit([patch(1, T0 + 30), patch(2, T0 + 20)])
+    sync.SyncStore(path).pull(server, ('core',))
+
+    server.patches = [patch(1, T0 + 30), patch(2, T0 + 2000, 'ABANDONED')]
+    monkeypatch.setattr(sync, 'time', lambda: T0 + 3000)
+    rows = sync.SyncStore(path).pull(server, ('core',))
+
+    assert titles(rows) == ['Change 1']
+    assert rows[0] == base.CodeContribution('core', base.Server.convert_timestamp_to_datetime(T0 + 30), 'alice',
+                                            'open', 'Change 1', 'https://review.example.com/c/1', 'Gerrit')
+
+
+class FakeResponse:
+    def __init__(self, items, next_url=None):
+        self.content = json.dumps(items).encode()
+        self.links = {'next': {'url': next_url}} if next_url else {}
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    """Answers the GET requests out of the pages given per URL, recording the requests."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append((url, params))
+        return self.pages[url]
+
+
+class FakeRepo:
+    full_name = 'acme/api'
+
+
+def pr(number, updated):
+    return {'number': number, 'updated_at': base.Server.convert_timestamp_to_iso(updated)}
+
+
+def github(pages):
+    server = base.GitHub.__new__(base.GitHub)
+    base.Server.__init__(server, 'GitHub', 'github.com')
+    server.api_url, server.graphql_url = base.github_api_urls('github.com')
+    server.base_branch = None
+    server.api = FakeSession(pages)
+    return server
+
+
+def test_github_lists_the_prs_updated_since_the_watermark_and_stops_there():
+    url = 'https://api.github.com/repos/acme/api/pulls'
+    server = github({url: FakeResponse([pr(1, T0 + 300), pr(2, T0 + 200), pr(3, T0 + 100)], url + '?page=2'),
+                     url + '?page=2': FakeResponse([pr(4, T0 + 50)])})
+
+    pulls = list(server.get_source_ccs(('repo', FakeRepo()), updated_after=T0 + 150))
+
+    assert [pull['number'] for pull in pulls] == [1, 2]
+    # whatever their state, latest update first, and the next page isn't asked for past the watermark
+    assert server.api.requests == [(url, {'state': 'all', 'sort': 'updated', 'direction': 'desc', 'per_page': 100})]
+
+
+def test_github_searches_the_org_prs_updated_since_the_watermark(monkeypatch):
+    server = github({})
+    queries = []
+    monkeypatch.setattr(server, '_search_pulls', lambda query: queries.append(query) or iter([]))
+
+    list(server.get_source_ccs(('org', 'acme'), updated_after=T0))
+    list(server.get_source_ccs(('org', 'acme')))
+
+    assert queries == [f'org:acme is:pr sort:updated-desc updated:>={base.Server.convert_timestamp_to_iso(T0)}',
+                       'org:acme is:pr sort:updated-desc is:open']
+
+
+class FakeGitlabClient:
+    """Lists the group's projects and MRs, recording the MR listings' parameters."""
+
+    def __init__(self):
+        self.listings = []
+
+    def http_list(self, path, query_data, as_list=True):
+        if path.endswith('/projects'):
+            return [{'id': 1, 'name': 'api'}, {'id': 2, 'name': 'docs'}]
+        self.listings.append((path, query_data))
+        return [{'project_id': 1, 'iid': 10}, {'project_id': 2, 'iid': 20}]
+
+
+class FakeGroup:
+    id = 7
+
+
+def test_gitlab_lists_the_mrs_updated_since_the_watermark_in_any_state(monkeypatch):
+    monkeypatch.setattr(base, 'metadata_cache', base.MetadataCache())
+    server = base.Gitlab.__new__(base.Gitlab)
+    base.Server.__init__(server, 'GitLab', 'https://gitlab.example.com')
+    server.per_page = 100
+    server.gl = FakeGitlabClient()
+    server.repos = ['api']
+
+    assert [mr['iid'] for mr in server.get_source_ccs(('group', FakeGroup()), updated_after=T0)] == [10]
+    list(server.get_source_ccs(('group', FakeGroup())))
+
+    assert server.gl.listings == [
+        ('/groups/7/merge_requests', {'state': 'all', 'order_by': 'updated_at', 'per_page': 100,
+                                      'updated_after': base.Server.convert_timestamp_to_iso(T0)}),
+        ('/groups/7/merge_requests', {'state': 'opened', 'order_by': 'updated_at', 'per_page': 100}),
+    ]
+
+
+def test_gerrit_queries_the_changes_updated_since_the_watermark_in_any_status(monkeypatch):
+    monkeypatch.setattr(base, 'time', lambda: T0 + 1000)
+    server = base.Gerrit.__new__(base.Gerrit)
+    base.Server.__init__(server, 'Gerrit', 'review.example.com')
+    server.ssh_command, server.query_options, server.query_limit = ['ssh'], [], 100
+
+    assert server.query_command(['core', 'docs'], 0, updated_after=T0 + 400)[-2:] == \
+        ['(project:core OR project:docs)', '-age:601s']
+    assert server.query_command(['core'], 100)[-2:] == ['(project:core)', 'status:open']